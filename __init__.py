@@ -1,10 +1,51 @@
 default_app_config = 'krewcabapi.apps.stripe.apps.AppConfig'
 
-from .utils import clear_expired_idempotency_keys, convert_tstamp, CustomValidation
-from .settings import get_callback_function, get_idempotency_key, get_default_api_key, get_stripe_api_version, \
-    set_stripe_api_version, get_subscriber_model_string
-from .fields import StripeEnumField, StripeCurrencyCodeField, StripeDateTimeField
-from .enums import EnumMetaClass, Enum, CardCheckResult, CardBrand, CardFundingType, CardTokenizationMethod, \
-    BusinessType, AccountType, CustomerTaxExempt
-from .checks import check_stripe_api_key, validate_stripe_api_version
-from .admin import IdempotencyKeyAdmin
+import importlib
+
+# The public names of the package, resolved from their module on first access
+# so that importing the package (or a single helper) doesn't import the stripe
+# SDK, the models and the admin.
+_LAZY_ATTRIBUTES = {
+    "clear_expired_idempotency_keys": "utils",
+    "convert_tstamp": "utils",
+    "CustomValidation": "utils",
+    "StripeObjectView": "utils",
+    "get_callback_function": "settings",
+    "get_idempotency_key": "settings",
+    "get_default_api_key": "settings",
+    "get_stripe_api_version": "settings",
+    "set_stripe_api_version": "settings",
+    "get_subscriber_model_string": "settings",
+    "StripeEnumField": "fields",
+    "StripeCurrencyCodeField": "fields",
+    "StripeDateTimeField": "fields",
+    "EnumMetaClass": "enums",
+    "Enum": "enums",
+    "CardCheckResult": "enums",
+    "CardBrand": "enums",
+    "CardFundingType": "enums",
+    "CardTokenizationMethod": "enums",
+    "BusinessType": "enums",
+    "AccountType": "enums",
+    "CustomerTaxExempt": "enums",
+    "check_stripe_api_key": "checks",
+    "validate_stripe_api_version": "checks",
+    "IdempotencyKeyAdmin": "admin",
+    "WebhookEventAdmin": "admin",
+}
+
+__all__ = list(_LAZY_ATTRIBUTES)
+
+
+def __getattr__(name):
+    module_name = _LAZY_ATTRIBUTES.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(importlib.import_module(f".{module_name}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
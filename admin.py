@@ -12,3 +12,13 @@ class IdempotencyKeyAdmin(admin.ModelAdmin):
 
     def has_add_permission(self, request):
         return False
+
+
+@admin.register(models.WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = ("stripe_id", "type", "created", "received", "processed", "livemode")
+    list_filter = ("type", "livemode")
+    search_fields = ("stripe_id",)
+
+    def has_add_permission(self, request):
+        return False
@@ -0,0 +1,44 @@
+import asyncio
+import contextvars
+
+from .fetch import get_executor, submit
+from .governor import get_lane, priority
+
+try:
+    from asgiref.sync import sync_to_async
+except ImportError:  # asgiref only ships with Django >= 3.0
+    sync_to_async = None
+
+
+async def run_stripe(func, *args, **kwargs):
+    """
+    Run a blocking Stripe API call on the shared pool.
+
+    The event loop keeps running while the call waits on the network. The call
+    runs in a copy of the caller's context, e.g. with its identity map, and in
+    its rate governor lane.
+    """
+    lane = get_lane()
+    context = contextvars.copy_context()
+
+    def call():
+        with priority(lane):
+            return func(*args, **kwargs)
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), context.run, call)
+
+
+async def run_db(func, *args, **kwargs):
+    """
+    Run a blocking database call without blocking the event loop.
+
+    Uses asgiref's thread-sensitive `sync_to_async` when available, so the call
+    shares the connection of the other synchronous code of the request. Otherwise
+    the call runs on the shared pool and the connections it left behind are closed
+    according to CONN_MAX_AGE.
+    """
+    if sync_to_async is not None:
+        return await sync_to_async(func, thread_sensitive=True)(*args, **kwargs)
+
+    return await asyncio.wrap_future(submit(func, *args, **kwargs))
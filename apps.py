@@ -3,3 +3,7 @@ from django.apps import AppConfig as BaseAppConfig
 
 class AppConfig(BaseAppConfig):
     name = 'krewcabapi.apps.stripe'
+
+    def ready(self):
+        from . import checks  # noqa: F401
+        from . import signals  # noqa: F401
@@ -0,0 +1,11 @@
+"""
+Benchmarks of the hot paths of the app, run against a fake Stripe API.
+
+Run them from the project, with its settings::
+
+    DJANGO_SETTINGS_MODULE=krewcabapi.settings python -m krewcabapi.apps.stripe.benchmarks \
+        --output results.json --compare baseline.json
+
+The benchmarks needing the database run in a PostgreSQL test database created
+for the run, and are skipped if it cannot be created.
+"""
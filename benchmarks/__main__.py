@@ -0,0 +1,134 @@
+import argparse
+import importlib
+import sys
+
+import django
+
+MODULES = [
+    "conversion", "idempotency", "models", "fingerprint", "views", "cleanup", "imports"
+]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m {}".format(__package__), description="Run the Stripe app benchmarks."
+    )
+    parser.add_argument(
+        "-k",
+        dest="patterns",
+        action="append",
+        help="Only run the benchmarks whose name matches this glob pattern, e.g. 'conversion.*'.",
+    )
+    parser.add_argument("-o", "--output", help="Write the results to this JSON file.")
+    parser.add_argument(
+        "--compare", help="Compare the results to those of this JSON file and fail on regressions."
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="The relative slowdown of the median counted as a regression.",
+    )
+    parser.add_argument(
+        "--min-time", type=float, default=1.0, help="Seconds each measurement runs for at least."
+    )
+    parser.add_argument(
+        "--rows",
+        type=int,
+        default=1000000,
+        help="The number of expired idempotency keys seeded for the cleanup benchmark.",
+    )
+    parser.add_argument("--no-db", action="store_true", help="Skip the benchmarks needing the database.")
+    parser.add_argument(
+        "--keepdb", action="store_true", help="Keep the test database between runs."
+    )
+    return parser.parse_args(argv)
+
+
+def setup_database(keepdb=False):
+    """
+    Create the test database, and return its teardown function, or the reason
+    the database benchmarks cannot run.
+    """
+    from django.db import connection
+
+    try:
+        connection.ensure_connection()
+    except Exception as e:
+        return None, "cannot connect to the database: {}".format(e)
+    if connection.vendor != "postgresql":
+        return None, "the models need PostgreSQL"
+
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=keepdb)
+
+    def teardown():
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keepdb)
+
+    return teardown, None
+
+
+def print_results(results, out=sys.stdout):
+    for entry in results:
+        if "skipped" in entry:
+            out.write("{:<60} skipped: {}\n".format(entry["name"], entry["skipped"]))
+            continue
+        out.write(
+            "{:<60} median {:>10.3f} ms  p99 {:>10.3f} ms  {:>12.1f} ops/s\n".format(
+                entry["name"],
+                entry["median"] * 1000,
+                entry["p99"] * 1000,
+                entry["ops_per_second"] or 0,
+            )
+        )
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    django.setup()
+
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    from . import harness
+
+    for module in MODULES:
+        importlib.import_module(".{}".format(module), __package__)
+    benchmarks = harness.select(args.patterns)
+
+    setup_test_environment()
+    teardown, skip_reason = None, None
+    if not args.no_db and any(bench.db for bench in benchmarks):
+        teardown, skip_reason = setup_database(keepdb=args.keepdb)
+        if skip_reason:
+            sys.stderr.write("Skipping the database benchmarks: {}\n".format(skip_reason))
+
+    try:
+        results = harness.run_benchmarks(
+            benchmarks,
+            skip_db=args.no_db or teardown is None,
+            min_time=args.min_time,
+            options={"rows": args.rows},
+        )
+    finally:
+        if teardown is not None:
+            teardown()
+        teardown_test_environment()
+
+    print_results(results)
+    report = harness.make_report(results)
+    if args.output:
+        harness.dump(report, args.output)
+
+    if args.compare:
+        changes, regressions = harness.compare(report, harness.load(args.compare), args.threshold)
+        for name, old, new, change in changes:
+            print("{:<60} {:>10.3f} ms -> {:>10.3f} ms  {:+.1%}".format(
+                name, old * 1000, new * 1000, change
+            ))
+        if regressions:
+            print("Regressed: {}".format(", ".join(regressions)))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,43 @@
+from django.db import connection
+
+from ..models import IdempotencyKey
+from ..utils import clear_expired_idempotency_keys
+from .harness import SkipBenchmark, benchmark
+
+BATCH_SIZE = 10000
+# The ORM deletion loads every row, so it runs on a smaller table.
+ORM_ROWS = 50000
+
+
+def _seed_expired_keys(rows):
+    if connection.vendor != "postgresql":
+        raise SkipBenchmark("Seeding the table needs PostgreSQL.")
+
+    qn = connection.ops.quote_name
+    meta = IdempotencyKey._meta
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {qn(meta.db_table)} "
+            f"({qn(meta.pk.column)}, {qn(meta.get_field('action').column)}, "
+            f"{qn(meta.get_field('livemode').column)}, {qn(meta.get_field('created').column)}) "
+            "SELECT md5(i::text)::uuid, 'customer:bench-' || i, false, "
+            "now() - interval '2 days' FROM generate_series(1, %s) AS i",
+            [rows],
+        )
+
+
+@benchmark("cleanup.clear_expired_idempotency_keys", db=True)
+def bench_clear_expired_idempotency_keys(runner):
+    rows = runner.options.get("rows", 1000000)
+
+    _seed_expired_keys(rows)
+    runner.run(
+        clear_expired_idempotency_keys, dry_run=True, name="count", rounds=1, ops=rows
+    )
+    runner.run(
+        clear_expired_idempotency_keys, batch_size=BATCH_SIZE, name="batched", rounds=1, ops=rows
+    )
+
+    rows = min(rows, ORM_ROWS)
+    _seed_expired_keys(rows)
+    runner.run(clear_expired_idempotency_keys, name="orm", rounds=1, ops=rows)
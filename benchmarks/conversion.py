@@ -0,0 +1,111 @@
+import copy
+from collections import OrderedDict
+
+from django.utils.translation import gettext_lazy as _
+
+from ..enums import CardBrand, Enum, EnumMetaClass
+from ..fields import StripeEnumField
+from ..models import Account, Card, Customer
+from ..serializers import CardPaymentMethodFastReadSerializer, CardPaymentMethodReadSerializer
+from ..utils import convert_tstamp
+from .fixtures import fake_objects
+from .harness import benchmark
+
+BATCH_SIZE = 1000
+
+# The members of enums.CardBrand, to build the same class again.
+CARD_BRAND_MEMBERS = [
+    ("AmericanExpress", (_("American Express"), "American Express")),
+    ("DinersClub", (_("Diners Club"), "Diners Club")),
+    ("Discover", _("Discover")),
+    ("JCB", _("JCB")),
+    ("MasterCard", _("MasterCard")),
+    ("UnionPay", _("UnionPay")),
+    ("Visa", _("Visa")),
+    ("Unknown", _("Unknown")),
+]
+
+
+def _bench_object_to_record(runner, model, object_type):
+    objects = fake_objects(object_type, BATCH_SIZE)
+
+    def convert(objects, in_place):
+        for data in objects:
+            model._stripe_object_to_record(data, in_place=in_place)
+
+    # Objects converted in place are renamed, so each round gets fresh copies.
+    runner.run(
+        convert, name="in_place", setup=lambda: (copy.deepcopy(objects), True), ops=BATCH_SIZE
+    )
+    runner.run(convert, objects, False, name="view", ops=BATCH_SIZE)
+    runner.run(
+        model._build_stripe_field_converters, model._meta.fields, name="build_plan"
+    )
+
+
+@benchmark("conversion.customer_to_record")
+def bench_customer_to_record(runner):
+    _bench_object_to_record(runner, Customer, "customer")
+
+
+@benchmark("conversion.account_to_record")
+def bench_account_to_record(runner):
+    _bench_object_to_record(runner, Account, "account")
+
+
+@benchmark("conversion.card_to_record")
+def bench_card_to_record(runner):
+    _bench_object_to_record(runner, Card, "card")
+
+
+@benchmark("conversion.convert_tstamp")
+def bench_convert_tstamp(runner):
+    timestamps = [1577836800 + i for i in range(BATCH_SIZE)]
+
+    def convert(timestamps):
+        for timestamp in timestamps:
+            convert_tstamp(timestamp)
+
+    runner.run(convert, timestamps, ops=BATCH_SIZE)
+
+
+@benchmark("conversion.stripe_enum_field")
+def bench_stripe_enum_field(runner):
+    def construct():
+        for _i in range(BATCH_SIZE):
+            StripeEnumField(enum=CardBrand)
+
+    runner.run(construct, ops=BATCH_SIZE)
+
+
+@benchmark("conversion.enum_metaclass")
+def bench_enum_metaclass(runner):
+    def build():
+        for _i in range(BATCH_SIZE):
+            EnumMetaClass("CardBrand", (Enum,), OrderedDict(CARD_BRAND_MEMBERS))
+
+    runner.run(build, ops=BATCH_SIZE)
+
+
+@benchmark("conversion.card_serializer")
+def bench_card_serializer(runner):
+    cards = [
+        Card(pk=pk, **Card._stripe_object_to_record(data, in_place=False))
+        for pk, data in enumerate(fake_objects("card", BATCH_SIZE), 1)
+    ]
+    renderer = CardPaymentMethodFastReadSerializer()
+    # The rows the list view renders, as ``values()`` returns them.
+    rows = [
+        {source: getattr(card, attname) for _name, source, attname, _render in renderer.plan}
+        for card in cards
+    ]
+
+    def render_drf(cards):
+        return CardPaymentMethodReadSerializer(cards, many=True).data
+
+    def render_instances(cards):
+        return [renderer.render_instance(card) for card in cards]
+
+    runner.run(render_drf, cards, name="drf", ops=BATCH_SIZE)
+    runner.run(renderer.render_many, rows, name="fast", ops=BATCH_SIZE)
+    runner.run(render_instances, cards, name="fast_instances", ops=BATCH_SIZE)
@@ -0,0 +1,65 @@
+from contextlib import contextmanager
+
+from django.db import connection
+
+from ..models import Card, Customer
+from .fixtures import fake_objects
+from .harness import benchmark
+
+# Cards stored for the lookups, over two orders of magnitude, so that the cost
+# of a lookup with the index can be told apart from a scan growing with the table.
+STORED_CARDS = (1000, 10000, 100000)
+LOOKUPS = 20
+INDEX_NAME = "stripe_card_fingerprint_idx"
+
+
+def _lookup(fingerprints, customer):
+    for fingerprint in fingerprints:
+        Card._get_by_fingerprint(fingerprint, customer)
+
+
+def _table_sql(sql):
+    with connection.cursor() as cursor:
+        cursor.execute(sql.format(table=connection.ops.quote_name(Card._meta.db_table)))
+
+
+@contextmanager
+def _without_index():
+    index = next(index for index in Card._meta.indexes if index.name == INDEX_NAME)
+    with connection.schema_editor() as editor:
+        editor.remove_index(Card, index)
+    try:
+        yield
+    finally:
+        with connection.schema_editor() as editor:
+            editor.add_index(Card, index)
+
+
+@benchmark("fingerprint.card_lookup", db=True)
+def bench_card_fingerprint_lookup(runner):
+    customer_data = fake_objects("customer", 1)[0]
+    Customer.sync_from_stripe_data(customer_data)
+    customer = Customer.objects.get(stripe_id=customer_data["id"])
+    cards = fake_objects("card", STORED_CARDS[-1])
+
+    def run_lookups(fingerprints, suffix):
+        runner.run(
+            _lookup, fingerprints, customer, name="customer:" + suffix, ops=len(fingerprints)
+        )
+        runner.run(_lookup, fingerprints, None, name="any:" + suffix, ops=len(fingerprints))
+
+    stored = 0
+    try:
+        for size in STORED_CARDS:
+            Card.sync_from_stripe_data_many(cards[stored:size], customer=customer)
+            stored = size
+            _table_sql("ANALYZE {table}")
+
+            fingerprints = [card["fingerprint"] for card in cards[:size:size // LOOKUPS]]
+            run_lookups(fingerprints, str(size))
+            with _without_index():
+                run_lookups(fingerprints, "{}:no_index".format(size))
+    finally:
+        # A queryset delete would load every card to send post_delete.
+        _table_sql("DELETE FROM {table}")
+        customer.delete()
@@ -0,0 +1,55 @@
+from django.contrib.auth import get_user_model
+from django.core.exceptions import FieldDoesNotExist
+from django.db import DatabaseError, models
+
+from ..testing import FakeStripe
+from .harness import SkipBenchmark
+
+
+def fake_objects(object_type, count, seed=0):
+    """
+    Return `count` Stripe objects of `object_type` (``customer``, ``account`` or
+    ``card``) as the API sends them, generated by a `FakeStripe`.
+
+    :rtype: list of dict
+    """
+    fake = FakeStripe(seed=seed)
+    if object_type == "customer":
+        return [
+            fake.add_customer(email="customer{}@example.com".format(i), metadata={"user": str(i)})
+            for i in range(count)
+        ]
+    if object_type == "account":
+        return [fake.add_account(email="account{}@example.com".format(i)) for i in range(count)]
+    if object_type == "card":
+        customer = fake.add_customer()
+        return [
+            fake.add_card(customer["id"], number="42424242{:08d}".format(i), cvc="123")
+            for i in range(count)
+        ]
+    raise ValueError("Unknown object type: {}".format(object_type))
+
+
+def create_user(index):
+    """
+    Create a user of the project's user model, filling the required fields with
+    placeholder values.
+    """
+    User = get_user_model()
+    values = {}
+    for name in [User.USERNAME_FIELD, *User.REQUIRED_FIELDS, "phone_number"]:
+        try:
+            field = User._meta.get_field(name)
+        except FieldDoesNotExist:
+            continue
+        if isinstance(field, models.EmailField):
+            values[name] = "stripe-bench-{}@example.com".format(index)
+        elif name == "phone_number":
+            values[name] = "+1555{:07d}".format(index)
+        else:
+            values[name] = "stripe-bench-{}".format(index)
+
+    try:
+        return User.objects.create(**values)
+    except (DatabaseError, TypeError, ValueError) as e:
+        raise SkipBenchmark("Cannot create a {}: {}".format(User.__name__, e))
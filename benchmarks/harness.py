@@ -0,0 +1,244 @@
+import fnmatch
+import gc
+import json
+import math
+import platform
+import statistics
+import subprocess
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+
+Benchmark = namedtuple("Benchmark", ["name", "func", "db"])
+
+# Every benchmark defined, in definition order.
+BENCHMARKS = []
+
+
+class SkipBenchmark(Exception):
+    """Raised by a benchmark that cannot run in this environment."""
+
+
+def benchmark(name, db=False):
+    """
+    Register a benchmark function, called with a `Runner`.
+
+    Usage::
+
+        @benchmark("utils.convert_tstamp")
+        def bench_convert_tstamp(runner):
+            runner.run(convert_tstamp, 1577836800)
+
+    :param name: The dotted name the results are reported under.
+    :type name: str
+    :param db: Whether the benchmark needs the database.
+    :type db: bool
+    """
+    def decorator(func):
+        BENCHMARKS.append(Benchmark(name, func, db))
+        return func
+
+    return decorator
+
+
+def select(patterns=None):
+    """Return the benchmarks whose name matches one of the glob `patterns`."""
+    if not patterns:
+        return list(BENCHMARKS)
+    return [
+        bench for bench in BENCHMARKS
+        if any(fnmatch.fnmatchcase(bench.name, pattern) for pattern in patterns)
+    ]
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class Runner:
+    """
+    Time a function over repeated rounds, in the manner of pytest-benchmark.
+
+    Each round is timed on its own, so the results include the latency
+    percentiles as well as the throughput.
+
+    :param min_time: Keep running rounds for at least this many seconds.
+    :type min_time: float
+    :param min_rounds: Run at least this many rounds.
+    :type min_rounds: int
+    :param max_rounds: Run at most this many rounds.
+    :type max_rounds: int
+    :param warmup: The number of untimed rounds run first.
+    :type warmup: int
+    :param options: Options for the benchmarks themselves, e.g. a table size.
+    :type options: dict
+    """
+
+    def __init__(self, min_time=1.0, min_rounds=5, max_rounds=100000, warmup=1, options=None):
+        self.options = options or {}
+        self.min_time = min_time
+        self.min_rounds = min_rounds
+        self.max_rounds = max_rounds
+        self.warmup = warmup
+        self.results = []
+
+    def run(self, func, *args, name=None, setup=None, ops=1, rounds=None, **kwargs):
+        """
+        Time `func(*args, **kwargs)` and record its statistics.
+
+        :param name: A suffix telling the results of several calls apart.
+        :type name: str
+        :param setup: Called, untimed, before each round. If it returns a tuple,
+            it is used as the arguments of `func` for the round.
+        :type setup: callable
+        :param ops: The number of operations one call performs, e.g. the number of
+            records converted, to report the throughput in operations.
+        :type ops: int
+        :param rounds: Run exactly this many rounds, without warmup, e.g. for
+            destructive or slow benchmarks.
+        :type rounds: int
+        :returns: The result of the last call.
+        """
+        def call():
+            call_args = args
+            if setup is not None:
+                setup_args = setup()
+                if isinstance(setup_args, tuple):
+                    call_args = setup_args
+            start = time.perf_counter()
+            result = func(*call_args, **kwargs)
+            return time.perf_counter() - start, result
+
+        if rounds is None:
+            for _ in range(self.warmup):
+                call()
+
+        result = None
+        timings = []
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            started = time.perf_counter()
+            while True:
+                if rounds is not None:
+                    if len(timings) >= rounds:
+                        break
+                elif len(timings) >= self.max_rounds or (
+                    len(timings) >= self.min_rounds
+                    and time.perf_counter() - started >= self.min_time
+                ):
+                    break
+                elapsed, result = call()
+                timings.append(elapsed)
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+        self.results.append(self._stats(name, timings, ops))
+        return result
+
+    @staticmethod
+    def _stats(name, timings, ops):
+        ordered = sorted(timings)
+        mean = statistics.mean(ordered)
+        return {
+            "name": name,
+            "rounds": len(ordered),
+            "ops": ops,
+            "min": ordered[0],
+            "max": ordered[-1],
+            "mean": mean,
+            "median": statistics.median(ordered),
+            "p99": percentile(ordered, 0.99),
+            "stddev": statistics.stdev(ordered) if len(ordered) > 1 else 0.0,
+            "ops_per_second": ops / mean if mean else None,
+        }
+
+
+def run_benchmarks(benchmarks, skip_db=False, **runner_options):
+    """
+    Run `benchmarks` and return one result entry per measurement.
+
+    :param skip_db: If True, the benchmarks needing the database are skipped.
+    :type skip_db: bool
+    :rtype: list of dict
+    """
+    results = []
+    for bench in benchmarks:
+        if bench.db and skip_db:
+            results.append({"name": bench.name, "skipped": "no database available"})
+            continue
+
+        runner = Runner(**runner_options)
+        try:
+            bench.func(runner)
+        except SkipBenchmark as e:
+            results.append({"name": bench.name, "skipped": str(e)})
+            continue
+
+        for stats in runner.results:
+            suffix = stats.pop("name")
+            name = "{}[{}]".format(bench.name, suffix) if suffix else bench.name
+            results.append(dict(name=name, **stats))
+    return results
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL, universal_newlines=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def make_report(results):
+    return {
+        "version": 1,
+        "commit": get_commit(),
+        "datetime": datetime.now(timezone.utc).isoformat(),
+        "machine": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+        },
+        "benchmarks": results,
+    }
+
+
+def compare(report, baseline, threshold=0.1):
+    """
+    Compare the median times of `report` to those of `baseline`.
+
+    :param threshold: The relative slowdown above which a benchmark regressed.
+    :type threshold: float
+    :returns: The ``(name, baseline median, median, change)`` of each benchmark
+        measured in both reports, and the names of those that regressed.
+    :rtype: tuple
+    """
+    previous = {
+        entry["name"]: entry for entry in baseline["benchmarks"] if "median" in entry
+    }
+    changes = []
+    regressions = []
+    for entry in report["benchmarks"]:
+        old = previous.get(entry["name"])
+        if old is None or "median" not in entry or not old["median"]:
+            continue
+        change = entry["median"] / old["median"] - 1
+        changes.append((entry["name"], old["median"], entry["median"], change))
+        if change > threshold:
+            regressions.append(entry["name"])
+    return changes, regressions
+
+
+def dump(report, path):
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
@@ -0,0 +1,60 @@
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection
+
+from .. import idempotency, settings as stripe_settings
+from ..models import IdempotencyKey
+from .harness import benchmark
+
+THREADS = 8
+CALLS = 400
+
+_rounds = itertools.count()
+
+
+def _contend(get_key, threads, actions):
+    """Call `get_key` for every action, from `threads` threads at once."""
+    def work(actions):
+        try:
+            for action in actions:
+                get_key("customer", action, False)
+        finally:
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(work, [actions[i::threads] for i in range(threads)]))
+
+
+def _bench_contention(runner, get_key):
+    # All the threads want the key of the same few actions, as when many
+    # requests create the customer of the same users.
+    shared = ["create:{}".format(i % 10) for i in range(CALLS)]
+    runner.run(_contend, get_key, THREADS, shared, name="shared", ops=CALLS)
+
+    # Every call creates a new key.
+    def distinct():
+        round_number = next(_rounds)
+        return get_key, THREADS, [
+            "create:{}:{}".format(round_number, i) for i in range(CALLS)
+        ]
+
+    runner.run(_contend, name="distinct", setup=distinct, ops=CALLS)
+
+
+@benchmark("idempotency.get_idempotency_key", db=True)
+def bench_get_idempotency_key(runner):
+    _bench_contention(runner, stripe_settings._get_idempotency_key)
+    IdempotencyKey.objects.all().delete()
+
+
+@benchmark("idempotency.allocator", db=True)
+def bench_allocator(runner):
+    allocator = idempotency.IdempotencyKeyAllocator(
+        max_size=stripe_settings.IDEMPOTENCY_KEY_CACHE_SIZE,
+        batch_size=stripe_settings.IDEMPOTENCY_KEY_BATCH_SIZE,
+        flush_interval=stripe_settings.IDEMPOTENCY_KEY_FLUSH_INTERVAL,
+    )
+    _bench_contention(runner, allocator.get)
+    allocator.flush()
+    IdempotencyKey.objects.all().delete()
@@ -0,0 +1,25 @@
+import os
+import subprocess
+import sys
+
+from .harness import benchmark
+
+PACKAGE = __package__.rpartition(".")[0]
+
+
+def _run_python(code):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, sys.path)))
+    subprocess.run([sys.executable, "-c", code], env=env, check=True)
+
+
+@benchmark("imports.package")
+def bench_import_package(runner):
+    # The interpreter start-up is measured too, as the baseline of each round.
+    runner.run(_run_python, "pass", name="interpreter", rounds=5)
+    runner.run(_run_python, "import {}".format(PACKAGE), name="package", rounds=5)
+    runner.run(
+        _run_python,
+        "import django; django.setup(); import {}.models".format(PACKAGE),
+        name="models",
+        rounds=5,
+    )
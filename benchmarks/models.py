@@ -0,0 +1,48 @@
+from ..models import Card, Customer
+from .fixtures import fake_objects
+from .harness import benchmark
+
+BATCH_SIZE = 1000
+
+
+def _create_customer():
+    customer_data = fake_objects("customer", 1)[0]
+    Customer.sync_from_stripe_data(customer_data)
+    return Customer.objects.get(stripe_id=customer_data["id"])
+
+
+@benchmark("models.card_sync_many", db=True)
+def bench_card_sync_many(runner):
+    customer = _create_customer()
+    cards = fake_objects("card", BATCH_SIZE)
+
+    def clear():
+        Card.objects.all().delete()
+
+    runner.run(
+        Card.sync_from_stripe_data_many, cards, customer=customer,
+        name="insert", setup=clear, ops=BATCH_SIZE,
+    )
+    runner.run(
+        Card.sync_from_stripe_data_many, cards, customer=customer,
+        name="update", ops=BATCH_SIZE,
+    )
+    runner.run(
+        Card.sync_from_stripe_data_many, cards, customer=customer, skip_unchanged=True,
+        name="unchanged", ops=BATCH_SIZE,
+    )
+    customer.delete()
+    clear()
+
+
+@benchmark("models.customer_sync_one", db=True)
+def bench_customer_sync_one(runner):
+    customers = fake_objects("customer", 100)
+
+    def sync(customers):
+        for data in customers:
+            Customer.sync_from_stripe_data(data)
+
+    runner.run(sync, customers, ops=len(customers))
+    Customer.objects.all().delete()
+
@@ -0,0 +1,77 @@
+import itertools
+
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from ..models import Account, Card, Customer
+from ..testing import fake_stripe
+from ..views import PaymentMethodsViewSet
+from .fixtures import create_user
+from .harness import benchmark
+
+# The list is paginated: its cost should not grow with the number of cards.
+STORED_CARDS = (1, 100, 10000)
+
+list_view = PaymentMethodsViewSet.as_view({"get": "list"})
+retrieve_view = PaymentMethodsViewSet.as_view({"get": "retrieve"})
+create_view = PaymentMethodsViewSet.as_view({"post": "create"})
+
+
+def _call(view, request, **kwargs):
+    response = view(request, **kwargs)
+    response.render()
+    assert response.status_code < 400, response.content
+    return response
+
+
+def _bench_stored_cards(runner, factory, fake, user, stored_cards, numbers):
+    def request(method, path, data=None):
+        request = getattr(factory, method)(path, data)
+        force_authenticate(request, user=user)
+        return request
+
+    record, _created = Customer.get_or_create_customer_in_stripe(user)
+    customer = Customer.objects.create(user=user, **record)
+    try:
+        for _i in range(stored_cards):
+            fake.add_card(customer.stripe_id, number=next(numbers))
+        Card.sync_from_stripe_data_many(
+            fake.sources[customer.stripe_id].values(), customer=customer
+        )
+        card = Card.objects.filter(customer=customer).first()
+
+        runner.run(
+            _call, list_view, request("get", "/payment-methods/"),
+            name="list:{}".format(stored_cards),
+        )
+        runner.run(
+            _call, list_view, request("get", "/payment-methods/?fields=id,brand,last4"),
+            name="list_fields:{}".format(stored_cards),
+        )
+        runner.run(
+            _call, retrieve_view, request("get", "/payment-methods/{}/".format(card.pk)),
+            pk=card.pk, name="retrieve:{}".format(stored_cards),
+        )
+
+        def new_token():
+            token = fake.add_token(number=next(numbers))
+            return create_view, request("post", "/payment-methods/", {"stripe_id": token["id"]})
+
+        runner.run(_call, name="create:{}".format(stored_cards), setup=new_token)
+    finally:
+        Card.objects.filter(customer=customer).delete()
+        Account.objects.filter(user=user).delete()
+        customer.delete()
+
+
+@benchmark("views.payment_methods", db=True)
+def bench_payment_methods(runner):
+    factory = APIRequestFactory()
+    numbers = ("42424242{:08d}".format(i) for i in itertools.count())
+
+    with fake_stripe() as fake:
+        for index, stored_cards in enumerate(STORED_CARDS):
+            user = create_user(index)
+            try:
+                _bench_stored_cards(runner, factory, fake, user, stored_cards, numbers)
+            finally:
+                user.delete()
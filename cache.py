@@ -0,0 +1,246 @@
+import copy
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+
+from . import settings as stripe_settings
+
+
+class LRUCacheBackend:
+    """
+    An in-process, size-bounded LRU cache whose entries expire after a TTL.
+
+    Values are copied in and out, like with any cache that serializes them, so
+    that a caller changing an object it got cannot change the cached one.
+    """
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        return copy.deepcopy(value)
+
+    def set(self, key, value, ttl):
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class DjangoCacheBackend:
+    """
+    A backend storing entries in one of the project's Django caches.
+
+    Keys are hashed, so that they are valid for any cache, memcached included.
+    They also carry a generation, replaced by `clear`, which only drops the
+    entries of this backend from a cache the rest of the project may share.
+    """
+
+    def __init__(self, alias="default", key_prefix="stripe:object:"):
+        self.cache = caches[alias]
+        self.key_prefix = key_prefix
+
+    def _generation(self):
+        generation_key = self.key_prefix + "generation"
+        generation = self.cache.get(generation_key)
+        if generation is None:
+            generation = uuid.uuid4().hex[:8]
+            if not self.cache.add(generation_key, generation, None):
+                generation = self.cache.get(generation_key) or generation
+        return generation
+
+    def _make_key(self, key):
+        digest = hashlib.md5(repr(key).encode("utf-8")).hexdigest()
+        return "{}{}:{}:{}".format(self.key_prefix, self._generation(), key[0], digest)
+
+    def get(self, key):
+        return self.cache.get(self._make_key(key))
+
+    def set(self, key, value, ttl):
+        self.cache.set(self._make_key(key), value, ttl)
+
+    def delete(self, key):
+        self.cache.delete(self._make_key(key))
+
+    def clear(self):
+        # The entries of the previous generation expire with their TTL.
+        self.cache.set(self.key_prefix + "generation", uuid.uuid4().hex[:8], None)
+
+
+class StripeObjectCache:
+    """
+    Read-through cache of the objects retrieved from the Stripe API.
+
+    Entries are keyed by ``(object name, stripe id, livemode, expand fields, API
+    key hash)``, so that an object retrieved with one API key is never served to
+    a call made with another, and expire after ``ttl`` seconds. Hits and misses
+    are counted.
+    """
+
+    def __init__(self, backend, ttl=30):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    @staticmethod
+    def make_key(stripe_class, stripe_id, livemode=None, expand_fields=(), api_key=None):
+        # API keys are secrets: only their hash is part of the key.
+        digest = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:16]
+        return (
+            stripe_class.OBJECT_NAME, stripe_id, livemode, tuple(expand_fields or ()), digest
+        )
+
+    def get_or_fetch(self, key, fetch):
+        """
+        Return the cached object for `key`, calling `fetch` to load it on a miss.
+
+        :param key: A key built with `make_key`.
+        :type key: tuple
+        :param fetch: Retrieves the object from Stripe.
+        :type fetch: callable
+        """
+        if not self.ttl:
+            return fetch()
+
+        value = self.backend.get(key)
+        with self._stats_lock:
+            if value is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if value is not None:
+            return value
+
+        value = fetch()
+        self.backend.set(key, value, self.ttl)
+        return value
+
+    def invalidate(self, stripe_class, stripe_id, expand_fields=(), api_key=None):
+        """
+        Drop the cached copies of an object, whatever their livemode, retrieved
+        with `api_key` or with any of the configured API keys.
+        """
+        api_keys = {
+            None,
+            stripe_settings.STRIPE_SECRET_KEY,
+            stripe_settings.LIVE_API_KEY,
+            stripe_settings.TEST_API_KEY,
+            api_key,
+        }
+        for key_api_key in api_keys:
+            for livemode in (None, False, True):
+                self.backend.delete(
+                    self.make_key(stripe_class, stripe_id, livemode, expand_fields, key_api_key)
+                )
+
+    def clear(self):
+        self.backend.clear()
+        with self._stats_lock:
+            self.hits = self.misses = 0
+
+    @property
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+def _build_object_cache():
+    backend = stripe_settings.get_callback_function("STRIPE_OBJECT_CACHE_BACKEND")
+    if backend is not None:
+        backend = backend()
+    elif stripe_settings.OBJECT_CACHE_ALIAS:
+        backend = DjangoCacheBackend(stripe_settings.OBJECT_CACHE_ALIAS)
+    else:
+        backend = LRUCacheBackend(max_size=stripe_settings.OBJECT_CACHE_MAX_SIZE)
+
+    return StripeObjectCache(backend, ttl=stripe_settings.OBJECT_CACHE_TTL)
+
+
+object_cache = _build_object_cache()
+
+
+def _payment_methods_version_key(user_id):
+    return "stripe:payment-methods-version:{}".format(user_id)
+
+
+def get_payment_methods_version(user_id):
+    """
+    Return the version of a user's payment methods, as ``(token, modified)``.
+
+    The version lives in the ``STRIPE_PAYMENT_METHODS_VERSION_CACHE`` cache and
+    is replaced by a new one whenever a card of the user is written, see
+    `bump_payment_methods_version`.
+
+    :rtype: tuple
+    """
+    cache = caches[stripe_settings.PAYMENT_METHODS_VERSION_CACHE]
+    key = _payment_methods_version_key(user_id)
+
+    version = cache.get(key)
+    if version is None:
+        version = (uuid.uuid4().hex, timezone.now())
+        if not cache.add(key, version, None):
+            version = cache.get(key) or version
+    return version
+
+
+def bump_payment_methods_version(*user_ids):
+    """
+    Invalidate the payment methods version of the given users once the current
+    transaction commits.
+
+    Bumping earlier would let a request served before the commit store a new
+    version along with the old cards, and answer 304s with them afterwards.
+    """
+    if not user_ids:
+        return
+
+    cache = caches[stripe_settings.PAYMENT_METHODS_VERSION_CACHE]
+    keys = [_payment_methods_version_key(user_id) for user_id in user_ids]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def payment_methods_etag(request, *args, **kwargs):
+    """ETag of a payment-methods response, computed without any query."""
+    if not request.user.is_authenticated:
+        return None
+
+    token, _modified = get_payment_methods_version(request.user.pk)
+    key = "{}:{}:{}".format(token, request.get_full_path(), request.META.get("HTTP_ACCEPT", ""))
+    return hashlib.md5(key.encode()).hexdigest()
+
+
+def payment_methods_last_modified(request, *args, **kwargs):
+    if not request.user.is_authenticated:
+        return None
+
+    _token, modified = get_payment_methods_version(request.user.pk)
+    return modified
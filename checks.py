@@ -27,6 +27,27 @@ def check_stripe_api_key(app_configs=None, **kwargs):
     return messages
 
 
+@checks.register("stripe", checks.Tags.caches)
+def check_payment_methods_version_cache(app_configs=None, **kwargs):
+    """Check the payment methods versions live in a cache shared by every process."""
+    from django.conf import settings
+    from . import settings as stripe_settings
+
+    if not stripe_settings.PAYMENT_METHODS_ETAG:
+        return []
+
+    alias = stripe_settings.PAYMENT_METHODS_VERSION_CACHE
+    backend = settings.CACHES.get(alias, {}).get("BACKEND", "")
+    if backend == "django.core.cache.backends.locmem.LocMemCache":
+        msg = "STRIPE_PAYMENT_METHODS_ETAG needs a cache shared by every process."
+        hint = (
+            'The "{}" cache is a LocMem cache, whose versions other processes would not '
+            "see invalidated: set STRIPE_PAYMENT_METHODS_VERSION_CACHE to a shared cache."
+        ).format(alias)
+        return [checks.Error(msg, hint=hint)]
+    return []
+
+
 def validate_stripe_api_version(version):
     """
     Check the API version is formatted correctly for Stripe.
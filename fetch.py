@@ -0,0 +1,208 @@
+import functools
+import random
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections
+
+from . import settings as stripe_settings
+from .governor import get_governor, get_lane, priority
+from .identity import get_identity_map, identity_map
+from .metrics import get_request_id, record_retry, tag_request
+
+FetchResult = namedtuple("FetchResult", ["item", "result", "error"])
+
+_throttles = {}
+_throttles_lock = threading.Lock()
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Return the thread pool shared by the async API and `submit`."""
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=stripe_settings.ASYNC_MAX_WORKERS,
+                thread_name_prefix="stripe",
+            )
+        return _executor
+
+
+def submit(func, *args, **kwargs):
+    """
+    Run `func` on the shared thread pool.
+
+    The identity map, the request id tag and the rate governor lane active on the
+    calling thread are shared with the call, and the database connections the call leaves behind on
+    its worker thread are closed according to CONN_MAX_AGE.
+
+    :rtype: concurrent.futures.Future
+    """
+    imap = get_identity_map()
+    request_id = get_request_id()
+    lane = get_lane()
+
+    def call():
+        try:
+            with tag_request(request_id), priority(lane):
+                if imap is None:
+                    return func(*args, **kwargs)
+                with identity_map(imap):
+                    return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return get_executor().submit(call)
+
+
+class KeyThrottle:
+    """
+    Bound the concurrency and request rate of the calls made with one API key.
+
+    The rate is only enforced here when the rate governor is disabled, see
+    `get_throttle`.
+
+    The rate is enforced with a token bucket holding up to one second of
+    requests, and at least one. Each use of the throttle takes a token, so a call
+    retried with `call_with_retry` takes one per attempt.
+    """
+
+    def __init__(self, rate=None, concurrency=None):
+        self.rate = rate
+        self._semaphore = threading.BoundedSemaphore(concurrency) if concurrency else None
+        self._lock = threading.Lock()
+        self._tokens = rate or 0
+        self._updated = time.monotonic()
+
+    def __enter__(self):
+        if self._semaphore:
+            self._semaphore.acquire()
+        if self.rate:
+            self._take_token()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._semaphore:
+            self._semaphore.release()
+
+    def _take_token(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    max(1, self.rate), self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def get_throttle(api_key):
+    """
+    Return the process-wide throttle for an API key.
+
+    When the rate governor is enabled, it already paces every call made with
+    the key, so the throttle only bounds the concurrency.
+    """
+    with _throttles_lock:
+        if api_key not in _throttles:
+            _throttles[api_key] = KeyThrottle(
+                rate=None if get_governor() is not None else stripe_settings.FETCH_RATE_LIMIT,
+                concurrency=stripe_settings.FETCH_MAX_CONCURRENCY_PER_KEY,
+            )
+        return _throttles[api_key]
+
+
+def call_with_retry(func, max_retries=None, backoff=0.5, max_backoff=8, throttle=None):
+    """
+    Call `func`, retrying with exponential backoff when Stripe answers 429.
+
+    :param func: The call to make, without arguments.
+    :type func: callable
+    :param max_retries: How many times to retry. \
+        Defaults to stripe_settings.FETCH_MAX_RETRIES.
+    :type max_retries: int
+    :param backoff: The delay before the first retry, in seconds.
+    :type backoff: float
+    :param max_backoff: The longest delay between two attempts, in seconds.
+    :type max_backoff: float
+    :param throttle: Entered around each attempt, e.g. a `KeyThrottle`, and left
+        while waiting to retry.
+    """
+    stripe = stripe_settings.get_stripe()
+
+    if max_retries is None:
+        max_retries = stripe_settings.FETCH_MAX_RETRIES
+
+    for attempt in range(max_retries + 1):
+        try:
+            if throttle is None:
+                return func()
+            with throttle:
+                return func()
+        except stripe.error.RateLimitError:
+            if attempt == max_retries:
+                raise
+            record_retry()
+            delay = min(max_backoff, backoff * 2 ** attempt)
+            time.sleep(delay / 2 + random.uniform(0, delay / 2))
+
+
+def fetch_many(func, items, api_key, max_workers=None, progress=None):
+    """
+    Call `func` on each item over a bounded thread pool.
+
+    Calls are throttled per API key and retried on rate limit errors. A failure
+    is reported on its own item instead of failing the whole batch.
+
+    :param func: The call to make for each item.
+    :type func: callable
+    :param items: The items to call `func` on.
+    :type items: iterable
+    :param api_key: The API key the calls are made with.
+    :type api_key: string
+    :param max_workers: The size of the thread pool. \
+        Defaults to stripe_settings.FETCH_MAX_WORKERS.
+    :type max_workers: int
+    :param progress: Called with the number of items done and the total after
+        each item.
+    :type progress: callable
+    :returns: One result per item, in input order.
+    :rtype: list of FetchResult
+    """
+    items = list(items)
+    throttle = get_throttle(api_key)
+    done = [0]
+    done_lock = threading.Lock()
+    request_id = get_request_id()
+    lane = get_lane()
+
+    def fetch(item):
+        try:
+            with tag_request(request_id), priority(lane):
+                result = FetchResult(
+                    item,
+                    call_with_retry(functools.partial(func, item), throttle=throttle),
+                    None,
+                )
+        except Exception as e:
+            result = FetchResult(item, None, e)
+
+        if progress is not None:
+            with done_lock:
+                done[0] += 1
+                progress(done[0], len(items))
+        return result
+
+    max_workers = max_workers or stripe_settings.FETCH_MAX_WORKERS
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(fetch, items))
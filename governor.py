@@ -0,0 +1,390 @@
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.core.cache import caches
+
+from . import settings as stripe_settings
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+READ = "read"
+WRITE = "write"
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+
+# A context variable, like the identity map's: a lane entered in a coroutine
+# applies neither to the other coroutines of the thread, nor is lost across an
+# await.
+_lane = ContextVar("stripe_rate_governor_lane", default=None)
+
+
+class RateGovernorTimeout(Exception):
+    """
+    Raised when a call waited `RateGovernor.max_wait` seconds for a token.
+
+    Unlike a 429 from Stripe, it is not retried by `fetch.call_with_retry`: the
+    budget is already exhausted, and retrying would only queue more calls.
+    """
+
+
+class LocalBucketStore:
+    """Token buckets held in memory, shared by the threads of one process."""
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, capacity, floor):
+        """
+        Take a token from a bucket, leaving at least `floor` tokens in it.
+
+        :param key: The bucket.
+        :type key: str
+        :param rate: The tokens added per second.
+        :type rate: float
+        :param capacity: The most tokens the bucket holds. A new bucket is full.
+        :type capacity: float
+        :param floor: The tokens that must remain after taking one.
+        :type floor: float
+        :returns: 0 if a token was taken, otherwise the seconds until one is
+            available.
+        :rtype: float
+        """
+        with self._lock:
+            now = time.time()
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens, wait = _take(tokens, updated, now, rate, capacity, floor)
+            self._buckets[key] = (tokens, now)
+            return wait
+
+    def drain(self, key, rate, capacity):
+        """Empty a bucket, e.g. after Stripe answered 429."""
+        with self._lock:
+            self._buckets[key] = (0.0, time.time())
+
+
+class FileBucketStore:
+    """
+    Token buckets held in a memory-mapped file, shared by every process of a
+    host, e.g. the gunicorn and Celery workers.
+
+    The file holds a fixed table of buckets. It is locked with ``flock`` for each
+    operation, and should live on a memory-backed filesystem such as /dev/shm.
+    """
+
+    SLOT = struct.Struct("16sdd")
+
+    def __init__(self, path, slots=1024):
+        self.path = path
+        self.slots = slots
+        self._mmap = None
+        self._fd = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _open(self):
+        # The mapping is reopened in a forked child: flock locks belong to the
+        # open file, which the child would otherwise share with its parent. The
+        # inherited descriptor and mapping are closed first.
+        if self._pid != os.getpid():
+            if self._fd is not None:
+                self._mmap.close()
+                os.close(self._fd)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            size = self.SLOT.size * self.slots
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self._fd, self._mmap, self._pid = fd, mmap.mmap(fd, size), os.getpid()
+        return self._mmap
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            buf = self._open()
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield buf
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _find_slot(self, buf, digest):
+        """Return the offset of the bucket's slot, or of the slot to replace."""
+        start = int.from_bytes(digest[:4], "little") % self.slots
+        oldest = None
+        for i in range(self.slots):
+            offset = (start + i) % self.slots * self.SLOT.size
+            slot_digest, _tokens, updated = self.SLOT.unpack_from(buf, offset)
+            if slot_digest in (digest, bytes(16)):
+                return offset
+            if oldest is None or updated < oldest[1]:
+                oldest = (offset, updated)
+        # The table is full: reuse the least recently used slot.
+        return oldest[0]
+
+    def take(self, key, rate, capacity, floor):
+        digest = hashlib.md5(key.encode("utf-8")).digest()
+        with self._locked() as buf:
+            now = time.time()
+            offset = self._find_slot(buf, digest)
+            slot_digest, tokens, updated = self.SLOT.unpack_from(buf, offset)
+            if slot_digest != digest:
+                tokens, updated = capacity, now
+            tokens, wait = _take(tokens, updated, now, rate, capacity, floor)
+            self.SLOT.pack_into(buf, offset, digest, tokens, now)
+            return wait
+
+    def drain(self, key, rate, capacity):
+        digest = hashlib.md5(key.encode("utf-8")).digest()
+        with self._locked() as buf:
+            self.SLOT.pack_into(buf, self._find_slot(buf, digest), digest, 0.0, time.time())
+
+
+class CacheBucketStore:
+    """
+    Buckets counted in a Django cache shared by every node, e.g. Redis or
+    memcached.
+
+    Caches offer no atomic read-modify-write of a token count, so the budget is
+    enforced over fixed windows of ``capacity / rate`` seconds with atomic
+    ``incr``, allowing up to `capacity` calls per window.
+    """
+
+    def __init__(self, alias="default", key_prefix="stripe:rate:"):
+        self.cache = caches[alias]
+        self.key_prefix = key_prefix
+
+    def _window(self, key, rate, capacity):
+        length = capacity / rate
+        now = time.time()
+        window = int(now // length)
+        return (
+            "{}{}:{}".format(self.key_prefix, key, window),
+            (window + 1) * length - now,
+            length,
+        )
+
+    def take(self, key, rate, capacity, floor):
+        cache_key, remaining, length = self._window(key, rate, capacity)
+        self.cache.add(cache_key, 0, timeout=int(length) + 2)
+        try:
+            count = self.cache.incr(cache_key)
+        except ValueError:
+            # The window expired in between.
+            self.cache.add(cache_key, 1, timeout=int(length) + 2)
+            count = 1
+
+        if count <= capacity - floor:
+            return 0
+        # Give the token back for the callers allowed below the floor.
+        try:
+            self.cache.decr(cache_key)
+        except ValueError:
+            pass
+        return remaining
+
+    def drain(self, key, rate, capacity):
+        cache_key, _remaining, length = self._window(key, rate, capacity)
+        self.cache.set(cache_key, capacity, timeout=int(length) + 2)
+
+
+def _take(tokens, updated, now, rate, capacity, floor):
+    tokens = min(capacity, tokens + max(0.0, now - updated) * rate)
+    if tokens - 1 >= floor:
+        return tokens - 1, 0
+    return tokens, (floor + 1 - tokens) / rate
+
+
+class RateGovernor:
+    """
+    Pace the Stripe API calls with token buckets, one per API key, livemode and
+    kind of call (read or write), so that bursts are spread out instead of
+    answered with 429s.
+
+    Calls run in a lane: interactive calls, e.g. a user adding a card, may use a
+    whole bucket, while background calls (sync, imports, webhook processing)
+    must leave a `reserve` share of it, so interactive calls find tokens even
+    while background traffic saturates the budget.
+
+    :param store: Where the buckets are kept, e.g. a `FileBucketStore` to share
+        them between the processes of a host.
+    :param limits: The calls per second allowed, by mode (``live``/``test``) and
+        kind, e.g. ``{"live": {"read": 50, "write": 50}, ...}``.
+    :type limits: dict
+    :param burst: The seconds of budget a bucket holds.
+    :type burst: float
+    :param reserve: The share of each bucket background calls cannot use.
+    :type reserve: float
+    :param max_wait: The longest a call waits for a token, in seconds, before
+        failing with a `RateGovernorTimeout`.
+    :type max_wait: float
+    """
+
+    def __init__(self, store, limits, burst=1.0, reserve=0.2, max_wait=30):
+        self.store = store
+        self.limits = limits
+        self.burst = burst
+        self.reserve = reserve
+        self.max_wait = max_wait
+
+    @staticmethod
+    def bucket_key(api_key, livemode, kind):
+        # API keys are secrets: only their hash is stored.
+        digest = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:16]
+        return "{}:{}:{}".format(digest, "live" if livemode else "test", kind)
+
+    def _bucket(self, api_key, kind, livemode):
+        if livemode is None:
+            livemode = is_live_key(api_key)
+        rate = self.limits["live" if livemode else "test"][kind]
+        capacity = max(1.0, rate * self.burst)
+        return self.bucket_key(api_key, livemode, kind), rate, capacity
+
+    def acquire(self, api_key, kind, livemode=None, lane=None):
+        """
+        Wait until a call may be made.
+
+        :param api_key: The API key the call is made with.
+        :type api_key: str
+        :param kind: `READ` or `WRITE`.
+        :type kind: str
+        :param livemode: Whether the key is a live one. Guessed from the key
+            prefix if not given.
+        :type livemode: bool
+        :param lane: `INTERACTIVE` or `BACKGROUND`. Defaults to the lane of the
+            current `priority` block.
+        :type lane: str
+        :raises RateGovernorTimeout: If no token is available within `max_wait`
+            seconds.
+        """
+        key, rate, capacity = self._bucket(api_key, kind, livemode)
+        floor = 0
+        if (lane or get_lane()) == BACKGROUND:
+            floor = min(capacity * self.reserve, capacity - 1)
+
+        deadline = time.monotonic() + self.max_wait if self.max_wait is not None else None
+        while True:
+            wait = self.store.take(key, rate, capacity, floor)
+            if not wait:
+                return
+            if deadline is not None and time.monotonic() + wait > deadline:
+                raise RateGovernorTimeout(
+                    "Gave up waiting for the {} budget of this API key.".format(kind)
+                )
+            time.sleep(wait)
+
+    def penalize(self, api_key, kind, livemode=None):
+        """Empty a bucket, making every process back off, e.g. after a 429."""
+        self.store.drain(*self._bucket(api_key, kind, livemode))
+
+    @contextmanager
+    def limit(self, api_key, kind, livemode=None, lane=None):
+        """
+        Wait for a token, then run the block. If Stripe still answers 429, the
+        bucket is drained.
+        """
+        self.acquire(api_key, kind, livemode=livemode, lane=lane)
+        stripe = stripe_settings.get_stripe()
+        try:
+            yield
+        except stripe.error.RateLimitError:
+            self.penalize(api_key, kind, livemode=livemode)
+            raise
+
+
+def is_live_key(api_key):
+    return bool(api_key) and api_key.startswith(("sk_live_", "rk_live_"))
+
+
+def get_lane():
+    """Return the lane of the calls made in this context."""
+    return _lane.get() or stripe_settings.RATE_GOVERNOR_DEFAULT_LANE
+
+
+@contextmanager
+def priority(lane):
+    """
+    Run the Stripe API calls made within the block in a lane::
+
+        with priority(BACKGROUND):
+            list(sync.import_customers())
+    """
+    token = _lane.set(lane)
+    try:
+        yield lane
+    finally:
+        _lane.reset(token)
+
+
+def background():
+    """Shortcut for ``priority(BACKGROUND)``."""
+    return priority(BACKGROUND)
+
+
+def create_store(backend):
+    if backend == "local":
+        return LocalBucketStore()
+    if backend == "file":
+        if fcntl is None:
+            return LocalBucketStore()
+        return FileBucketStore(
+            stripe_settings.RATE_GOVERNOR_PATH
+            or os.path.join(
+                "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(),
+                "stripe-rate-governor",
+            )
+        )
+    if backend == "cache":
+        return CacheBucketStore(stripe_settings.RATE_GOVERNOR_CACHE_ALIAS)
+    raise ValueError("Unknown rate governor backend: {!r}".format(backend))
+
+
+_governor = None
+_governor_lock = threading.Lock()
+
+
+def get_governor():
+    """Return the process-wide `RateGovernor`, or None if it is disabled."""
+    global _governor
+
+    if not stripe_settings.RATE_GOVERNOR_BACKEND:
+        return None
+
+    with _governor_lock:
+        if _governor is None:
+            _governor = RateGovernor(
+                create_store(stripe_settings.RATE_GOVERNOR_BACKEND),
+                stripe_settings.RATE_GOVERNOR_LIMITS,
+                burst=stripe_settings.RATE_GOVERNOR_BURST,
+                reserve=stripe_settings.RATE_GOVERNOR_RESERVE,
+                max_wait=stripe_settings.RATE_GOVERNOR_MAX_WAIT,
+            )
+        return _governor
+
+
+@contextmanager
+def governed(kind, api_key, lane=None):
+    """
+    Pace the Stripe API call made within the block with the process-wide
+    governor, if enabled::
+
+        with governed(WRITE, api_key):
+            stripe.Customer.create(api_key=api_key, ...)
+    """
+    governor = get_governor()
+    if governor is None:
+        yield
+        return
+
+    with governor.limit(api_key, kind, lane=lane):
+        yield
@@ -0,0 +1,254 @@
+import atexit
+import logging
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import timedelta
+from functools import reduce
+from operator import or_
+
+from django.core.cache import caches
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import settings as stripe_settings
+
+logger = logging.getLogger(__name__)
+
+KEY_LIFETIME = timedelta(hours=24)
+
+# Misses on actions hashed to different stripes don't wait for each other.
+MISS_LOCK_STRIPES = 64
+
+
+class IdempotencyKeyAllocator:
+    """
+    Hand out idempotency keys from memory and persist them in the background.
+
+    Keys issued in the last 24 hours are kept in a bounded LRU store, so the same
+    ``(object_type, action, livemode)`` gets the same key without a query. On a
+    miss, an unexpired `IdempotencyKey` row is reused if there is one; otherwise
+    a new key is issued and queued to be written with ``bulk_create`` by a
+    background thread.
+
+    A flush replaces the expired rows of the queued actions, and keeps any row
+    another process wrote first, whose key then replaces the one issued here.
+    Keys whose flush failed are queued again.
+
+    The LRU store is per process: two processes missing the same action before
+    either flushed would issue different keys. Deployments running several
+    processes must set ``cache_alias`` to a cache shared by all of them (not a
+    LocMem cache), through which they agree on the key of an action before it
+    is persisted.
+
+    :param flush_interval: The seconds between two flushes of the background
+        thread, or None to only persist the keys on explicit `flush` calls.
+    :type flush_interval: float
+    """
+
+    def __init__(self, max_size=10000, cache_alias=None, batch_size=500, flush_interval=1.0):
+        self.max_size = max_size
+        self.cache = caches[cache_alias] if cache_alias else None
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+        self._miss_locks = [threading.Lock() for _ in range(MISS_LOCK_STRIPES)]
+        self._pending = []
+        self._wakeup = threading.Event()
+        self._flusher = None
+
+    def get(self, object_type, action, livemode):
+        """
+        Return the idempotency key for an action.
+
+        :rtype: str
+        """
+        action = f"{object_type}:{action}"
+        key = (action, livemode)
+
+        entry = self._get_entry(key)
+        if entry is None:
+            with self._miss_locks[hash(key) % MISS_LOCK_STRIPES]:
+                entry = self._get_entry(key)
+                if entry is None:
+                    entry = self._load(action, livemode)
+                    self._store(key, entry)
+
+        return str(entry[0])
+
+    def _get_entry(self, key):
+        with self._lock:
+            entry = self._keys.get(key)
+            if entry is None:
+                return None
+            if entry[1] + KEY_LIFETIME <= timezone.now():
+                del self._keys[key]
+                return None
+            self._keys.move_to_end(key)
+            return entry
+
+    def _store(self, key, entry):
+        with self._lock:
+            self._keys[key] = entry
+            self._keys.move_to_end(key)
+            while len(self._keys) > self.max_size:
+                self._keys.popitem(last=False)
+
+    def _cache_key(self, action, livemode):
+        return "stripe:idempotency:{}:{}".format(action, int(livemode))
+
+    def _load(self, action, livemode):
+        from .models import IdempotencyKey
+
+        now = timezone.now()
+        cache_key = self._cache_key(action, livemode)
+        if self.cache is not None:
+            entry = self.cache.get(cache_key)
+            if entry is not None and entry[1] + KEY_LIFETIME > now:
+                return entry
+
+        entry = (
+            IdempotencyKey.objects.filter(
+                action=action, livemode=livemode, created__gt=now - KEY_LIFETIME
+            )
+            .values_list("uuid", "created")
+            .first()
+        )
+        is_new = entry is None
+        if is_new:
+            entry = (uuid.uuid4(), now)
+
+        if self.cache is not None:
+            timeout = (entry[1] + KEY_LIFETIME - now).total_seconds()
+            if not self.cache.add(cache_key, entry, timeout):
+                # Another process issued a key first, use it instead.
+                return self.cache.get(cache_key) or entry
+
+        if is_new:
+            self._enqueue(action, livemode, entry[0])
+        return entry
+
+    def _enqueue(self, action, livemode, key_uuid):
+        with self._lock:
+            self._pending.append((action, livemode, key_uuid))
+            full = len(self._pending) >= self.batch_size
+            if self._flusher is None and self.flush_interval is not None:
+                self._flusher = threading.Thread(
+                    target=self._run_flusher, name="stripe-idempotency-flusher", daemon=True
+                )
+                self._flusher.start()
+                atexit.register(self.flush)
+        if full:
+            self._wakeup.set()
+
+    def _run_flusher(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+
+    def flush(self):
+        """
+        Write the keys issued since the last flush to the database.
+
+        :returns: Whether every key was written. Otherwise the keys are queued
+            again for the next flush.
+        :rtype: bool
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+
+        for start in range(0, len(pending), self.batch_size):
+            try:
+                self._write(pending[start:start + self.batch_size])
+            except Exception:
+                logger.exception(
+                    "Could not persist %d idempotency keys, they will be retried.",
+                    len(pending) - start,
+                )
+                with self._lock:
+                    self._pending[:0] = pending[start:]
+                return False
+        return True
+
+    def _write(self, batch):
+        from .models import IdempotencyKey
+
+        actions = reduce(
+            or_, (Q(action=action, livemode=livemode) for action, livemode, _uuid in batch)
+        )
+        with transaction.atomic():
+            # An expired row would make the new key conflict, and be kept instead.
+            IdempotencyKey.objects.filter(
+                actions, created__lte=timezone.now() - KEY_LIFETIME
+            ).delete()
+            IdempotencyKey.objects.bulk_create(
+                [
+                    IdempotencyKey(uuid=key_uuid, action=action, livemode=livemode)
+                    for action, livemode, key_uuid in batch
+                ],
+                ignore_conflicts=True,
+            )
+            stored = {
+                (action, livemode): (key_uuid, created)
+                for action, livemode, key_uuid, created in IdempotencyKey.objects.filter(
+                    actions
+                ).values_list("action", "livemode", "uuid", "created")
+            }
+
+        for action, livemode, key_uuid in batch:
+            entry = stored.get((action, livemode))
+            if entry is not None and entry[0] != key_uuid:
+                # Another process wrote its key first: hand that one out from now on.
+                self._store((action, livemode), entry)
+                if self.cache is not None:
+                    timeout = (entry[1] + KEY_LIFETIME - timezone.now()).total_seconds()
+                    self.cache.set(self._cache_key(action, livemode), entry, timeout)
+
+
+_allocator = None
+_allocator_lock = threading.Lock()
+
+
+def get_allocator():
+    """Return the process-wide `IdempotencyKeyAllocator`."""
+    global _allocator
+
+    with _allocator_lock:
+        if _allocator is None:
+            _allocator = IdempotencyKeyAllocator(
+                max_size=stripe_settings.IDEMPOTENCY_KEY_CACHE_SIZE,
+                cache_alias=stripe_settings.IDEMPOTENCY_KEY_CACHE_ALIAS,
+                batch_size=stripe_settings.IDEMPOTENCY_KEY_BATCH_SIZE,
+                flush_interval=stripe_settings.IDEMPOTENCY_KEY_FLUSH_INTERVAL,
+            )
+        return _allocator
+
+
+def get_idempotency_key(object_type, action, livemode):
+    """
+    Idempotency key provider backed by `IdempotencyKeyAllocator`.
+
+    Enable it with::
+
+        STRIPE_IDEMPOTENCY_KEY_CALLBACK = "krewcabapi.apps.stripe.idempotency.get_idempotency_key"
+    """
+    return get_allocator().get(object_type, action, livemode)
+
+
+def get_idempotency_keys(object_type, actions, livemode):
+    """
+    Bulk counterpart of `get_idempotency_key`, for
+    ``STRIPE_IDEMPOTENCY_KEYS_CALLBACK``.
+
+    :returns: The key of each action, by action.
+    :rtype: dict
+    """
+    allocator = get_allocator()
+    return {action: allocator.get(object_type, action, livemode) for action in actions}
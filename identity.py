@@ -0,0 +1,101 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# A context variable rather than a thread local, so that an identity map
+# activated in a coroutine is neither seen by the other coroutines running on
+# the same thread, nor lost across an await.
+_identity_map = ContextVar("stripe_identity_map", default=None)
+_missing = object()
+
+
+class IdentityMap:
+    """
+    Instances resolved within one request or task, by model and identity key.
+
+    A key maps to None once the lookup found no row, so that repeated misses
+    don't query again either.
+    """
+
+    def __init__(self):
+        self._instances = {}
+
+    def get(self, model, key, default=None):
+        return self._instances.get((model, key), default)
+
+    def set(self, model, key, obj):
+        self._instances[(model, key)] = obj
+
+    def register(self, obj):
+        """Add an instance under all of its identity keys."""
+        for key in obj.identity_keys():
+            self.set(type(obj), key, obj)
+
+    def discard(self, obj):
+        for key in obj.identity_keys():
+            self._instances.pop((type(obj), key), None)
+
+    def clear(self):
+        self._instances.clear()
+
+
+def get_identity_map():
+    """Return the identity map active in this context, if any."""
+    return _identity_map.get()
+
+
+@contextmanager
+def identity_map(imap=None):
+    """
+    Activate an identity map for the duration of a block, e.g. a task::
+
+        with identity_map():
+            customer, _created = Customer.get_or_create_customer_in_stripe(user)
+
+    :param imap: The map to activate, e.g. to share the map of a request with
+        a worker thread. Defaults to a new, empty one.
+    :type imap: IdentityMap
+    """
+    imap = imap if imap is not None else IdentityMap()
+    token = _identity_map.set(imap)
+    try:
+        yield imap
+    finally:
+        _identity_map.reset(token)
+
+
+def resolve(model, key, load):
+    """
+    Return the instance of `model` identified by `key`.
+
+    Within an active identity map, `load` is only called the first time a key is
+    resolved; without one, it is called every time.
+
+    :param model: The model of the instance.
+    :type model: StripeModel
+    :param key: An identity key of the instance, see `StripeModel.identity_keys`.
+    :type key: tuple
+    :param load: Loads the instance, raising ``model.DoesNotExist`` if missing.
+    :type load: callable
+    :raises model.DoesNotExist: If no such instance exists.
+    """
+    imap = get_identity_map()
+    if imap is None:
+        return load()
+
+    obj = imap.get(model, key, _missing)
+    if obj is _missing:
+        try:
+            obj = load()
+        except model.DoesNotExist:
+            obj = None
+        if obj is None:
+            imap.set(model, key, None)
+        else:
+            imap.register(obj)
+            imap.set(model, key, obj)
+
+    if obj is None:
+        raise model.DoesNotExist(
+            "%s matching %r does not exist." % (model._meta.object_name, key)
+        )
+    return obj
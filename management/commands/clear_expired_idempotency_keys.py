@@ -1,10 +1,36 @@
 from django.core.management import BaseCommand
 
-from ...utils import clear_expired_idempotency_keys
+from ...utils import DEFAULT_CLEANUP_BATCH_SIZE, clear_expired_idempotency_keys
 
 
 class Command(BaseCommand):
     help = "Delete expired Stripe idempotency keys."
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            help="Delete the keys with raw statements of at most this many rows each.",
+        )
+        parser.add_argument(
+            "--max-runtime",
+            type=float,
+            help="Stop starting new batches after this many seconds. Implies batches "
+                 "of {} rows if --batch-size is not given.".format(DEFAULT_CLEANUP_BATCH_SIZE),
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only count the expired keys.",
+        )
+
     def handle(self, *args, **options):
-        clear_expired_idempotency_keys()
+        count = clear_expired_idempotency_keys(
+            batch_size=options["batch_size"],
+            max_runtime=options["max_runtime"],
+            dry_run=options["dry_run"],
+        )
+        if options["dry_run"]:
+            self.stdout.write("{} expired idempotency keys would be deleted.".format(count))
+        else:
+            self.stdout.write("Deleted {} expired idempotency keys.".format(count))
@@ -0,0 +1,63 @@
+from django.core.management import BaseCommand, CommandError
+
+from ... import sync
+
+IMPORTERS = {
+    "customers": sync.import_customers,
+    "accounts": sync.import_accounts,
+    "cards": sync.import_cards,
+}
+
+
+class Command(BaseCommand):
+    help = "Import Stripe customers, connect accounts and cards, resuming where the last run stopped."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "objects",
+            nargs="*",
+            default=list(IMPORTERS),
+            help="The object types to import, among {}. Defaults to all of them, "
+                 "cards last.".format(", ".join(IMPORTERS)),
+        )
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=100,
+            help="The number of objects fetched and written per page.",
+        )
+        parser.add_argument(
+            "--reset",
+            action="store_true",
+            help="Ignore the stored resume position and import from the beginning.",
+        )
+        parser.add_argument(
+            "--api-base",
+            help="Send the requests to this URL instead of the Stripe API.",
+        )
+
+    def handle(self, *args, **options):
+        unknown = [name for name in options["objects"] if name not in IMPORTERS]
+        if unknown:
+            raise CommandError(
+                "Unknown object type(s): {}. Choose among {}.".format(
+                    ", ".join(unknown), ", ".join(IMPORTERS)
+                )
+            )
+
+        if options["api_base"]:
+            import stripe
+
+            stripe.api_base = options["api_base"]
+
+        for name in options["objects"]:
+            created = updated = skipped = 0
+            for result in IMPORTERS[name](limit=options["limit"], reset=options["reset"]):
+                created += result.created
+                updated += result.updated
+                skipped += result.skipped
+            self.stdout.write(
+                "Imported {}: {} created, {} updated, {} skipped.".format(
+                    name, created, updated, skipped
+                )
+            )
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management import BaseCommand
+
+from ...webhooks import process_pending_events
+
+
+class Command(BaseCommand):
+    help = "Apply the pending Stripe webhook events."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="The maximum number of events applied per transaction.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once no event is pending instead of waiting for more.",
+        )
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=1.0,
+            help="Seconds to wait when no event is pending.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            count = process_pending_events(batch_size=options["batch_size"])
+            if count:
+                self.stdout.write("Processed {} webhook events.".format(count))
+            elif options["once"]:
+                return
+            else:
+                time.sleep(options["sleep"])
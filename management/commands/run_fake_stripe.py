@@ -0,0 +1,79 @@
+from django.core.management import BaseCommand
+
+from ...testing import FakeStripeServer
+
+
+class Command(BaseCommand):
+    help = "Serve a fake Stripe API on localhost, e.g. for load tests."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1", help="The interface to listen on.")
+        parser.add_argument("--port", type=int, default=12111, help="The port to listen on.")
+        parser.add_argument(
+            "--latency",
+            type=float,
+            default=0,
+            help="The time every request takes, in seconds.",
+        )
+        parser.add_argument(
+            "--jitter",
+            type=float,
+            default=0,
+            help="A random extra time added to every request, up to this many seconds.",
+        )
+        parser.add_argument(
+            "--error-rate",
+            type=float,
+            default=0,
+            help="The share of requests answered with an error, from 0 to 1.",
+        )
+        parser.add_argument(
+            "--error-status",
+            type=int,
+            action="append",
+            dest="error_statuses",
+            help="An HTTP status injected errors are picked from. Defaults to 429 and 500.",
+        )
+        parser.add_argument("--seed", type=int, default=0, help="The seed of the random generator.")
+        parser.add_argument(
+            "--customers",
+            type=int,
+            default=0,
+            help="The number of customers created on startup.",
+        )
+        parser.add_argument(
+            "--cards",
+            type=int,
+            default=0,
+            help="The number of cards created for each of these customers.",
+        )
+        parser.add_argument(
+            "--accounts",
+            type=int,
+            default=0,
+            help="The number of connect accounts created on startup.",
+        )
+
+    def handle(self, *args, **options):
+        server = FakeStripeServer(
+            host=options["host"],
+            port=options["port"],
+            latency=options["latency"],
+            jitter=options["jitter"],
+            error_rate=options["error_rate"],
+            error_statuses=options["error_statuses"] or (429, 500),
+            seed=options["seed"],
+        )
+
+        for i in range(options["customers"]):
+            customer = server.fake.add_customer(email="customer{}@example.com".format(i))
+            for j in range(options["cards"]):
+                server.fake.add_card(customer["id"], number="42424242{:08d}".format(j))
+        for i in range(options["accounts"]):
+            server.fake.add_account(email="account{}@example.com".format(i))
+
+        self.stdout.write("Serving a fake Stripe API at {}".format(server.api_base))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,191 @@
+import bisect
+import logging
+import threading
+import time
+from collections import defaultdict, namedtuple
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from . import settings as stripe_settings
+
+logger = logging.getLogger(__name__)
+
+StripeCall = namedtuple(
+    "StripeCall",
+    ["operation", "object_type", "duration", "status", "error", "bytes", "request_id"],
+)
+
+DEFAULT_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# A context variable, like the identity map's, so that the calls of concurrent
+# coroutines are tagged with their own request.
+_request_id = ContextVar("stripe_metrics_request_id", default=None)
+
+
+@contextmanager
+def tag_request(request_id):
+    """Tag the Stripe calls made within a block with a request id."""
+    token = _request_id.set(request_id)
+    try:
+        yield
+    finally:
+        _request_id.reset(token)
+
+
+def get_request_id():
+    return _request_id.get()
+
+
+class MetricsRegistry:
+    """
+    In-process latency histograms and counters of the Stripe API calls, by
+    operation and object type.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # labels -> [count per bucket..., +Inf count, sum]
+        self.histograms = defaultdict(lambda: [0] * (len(self.buckets) + 2))
+        self.counters = defaultdict(int)
+
+    def record(self, call):
+        labels = (call.operation, call.object_type)
+        bucket = bisect.bisect_left(self.buckets, call.duration)
+
+        with self._lock:
+            histogram = self.histograms[labels]
+            histogram[bucket] += 1
+            histogram[-1] += call.duration
+            self.counters[("stripe_api_calls_total", labels + (call.status,))] += 1
+            if call.error:
+                self.counters[("stripe_api_errors_total", labels + (call.error,))] += 1
+            if call.bytes:
+                self.counters[("stripe_api_response_bytes_total", labels)] += call.bytes
+
+    def inc(self, name, labels, amount=1):
+        with self._lock:
+            self.counters[(name, labels)] += amount
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+
+    def render_prometheus(self):
+        """Render the metrics in the Prometheus text exposition format."""
+        label_names = {
+            "stripe_api_calls_total": ("operation", "object_type", "status"),
+            "stripe_api_errors_total": ("operation", "object_type", "error"),
+            "stripe_api_response_bytes_total": ("operation", "object_type"),
+            "stripe_api_retries_total": (),
+        }
+
+        def format_labels(names, values):
+            return ",".join('{}="{}"'.format(n, v) for n, v in zip(names, values))
+
+        with self._lock:
+            histograms = {labels: list(values) for labels, values in self.histograms.items()}
+            counters = dict(self.counters)
+
+        lines = ["# TYPE stripe_api_call_duration_seconds histogram"]
+        for labels, values in sorted(histograms.items()):
+            base = format_labels(("operation", "object_type"), labels)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), values):
+                cumulative += count
+                lines.append(
+                    'stripe_api_call_duration_seconds_bucket{%s,le="%s"} %d'
+                    % (base, bound, cumulative)
+                )
+            lines.append("stripe_api_call_duration_seconds_sum{%s} %f" % (base, values[-1]))
+            lines.append("stripe_api_call_duration_seconds_count{%s} %d" % (base, cumulative))
+
+        for name, names in label_names.items():
+            lines.append("# TYPE {} counter".format(name))
+            for (counter_name, labels), value in sorted(counters.items()):
+                if counter_name == name:
+                    lines.append("%s{%s} %d" % (name, format_labels(names, labels), value))
+
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+def registry_sink(call):
+    """Record calls in the in-process `registry`; the default sink."""
+    registry.record(call)
+
+
+def log_sink(call):
+    """Log one line per call."""
+    logger.info(
+        "stripe call operation=%s object=%s duration=%.3f status=%s error=%s bytes=%s request_id=%s",
+        *call
+    )
+
+
+_sink = None
+
+
+def get_sink():
+    global _sink
+
+    if _sink is None:
+        _sink = stripe_settings.get_callback_function("STRIPE_METRICS_SINK", registry_sink)
+    return _sink
+
+
+class _CallInfo:
+    __slots__ = ("response",)
+
+    def __init__(self):
+        self.response = None
+
+
+@contextmanager
+def instrument(operation, object_type):
+    """
+    Time a Stripe API call and report it to the configured sink.
+
+    Assign the response to the yielded object to also count the bytes received::
+
+        with instrument("retrieve", "customer") as call:
+            call.response = stripe.Customer.retrieve(...)
+    """
+    if not stripe_settings.METRICS_ENABLED:
+        yield _CallInfo()
+        return
+
+    info = _CallInfo()
+    error = None
+    status = "ok"
+    start = time.perf_counter()
+    try:
+        yield info
+    except Exception as e:
+        error = type(e).__name__
+        status = str(getattr(e, "http_status", None) or "error")
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        last_response = getattr(info.response, "last_response", None)
+        body = getattr(last_response, "body", None)
+        get_sink()(StripeCall(
+            operation,
+            object_type,
+            duration,
+            status,
+            error,
+            len(body) if body else 0,
+            get_request_id(),
+        ))
+
+
+def record_retry():
+    """Count a call retried after a rate limit error."""
+    if stripe_settings.METRICS_ENABLED:
+        registry.inc("stripe_api_retries_total", ())
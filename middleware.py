@@ -0,0 +1,15 @@
+from .identity import identity_map
+
+
+class IdentityMapMiddleware:
+    """
+    Scope an identity map to each request, so that customers and connect accounts
+    are only looked up once per request.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with identity_map():
+            return self.get_response(request)
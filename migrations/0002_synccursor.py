@@ -0,0 +1,32 @@
+# Generated by Django 2.2.4 on 2026-10-18 09:12
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stripe', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncCursor',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('livemode', models.BooleanField(help_text='Whether the cursor was used in live or test mode.')),
+                ('starting_after', models.CharField(blank=True, default='',
+                                                    help_text='The id of the last object imported, empty when not started.',
+                                                    max_length=255)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'unique_together': {('name', 'livemode')},
+            },
+        ),
+        migrations.AlterField(
+            model_name='customer',
+            name='default_source',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+    ]
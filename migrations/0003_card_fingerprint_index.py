@@ -0,0 +1,16 @@
+# Generated by Django 2.2.4 on 2026-10-18 10:05
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stripe', '0002_synccursor'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='card',
+            index=models.Index(fields=['fingerprint', 'customer'], name='stripe_card_fingerprint_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 2.2.4 on 2026-10-18 11:20
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stripe', '0004_idempotencykey_created_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stripe_id', models.CharField(max_length=255, unique=True)),
+                ('type', models.CharField(help_text="Stripe's event description code", max_length=250)),
+                ('livemode', models.BooleanField(help_text='Whether the event was sent in live or test mode.')),
+                ('created', models.DateTimeField(help_text='The datetime this event was created in stripe.')),
+                ('data', django.contrib.postgres.fields.jsonb.JSONField(help_text='The event, as sent by Stripe.')),
+                ('received', models.DateTimeField(auto_now_add=True)),
+                ('processed', models.DateTimeField(blank=True, help_text='When the event was applied, null if pending.',
+                                                   null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='webhookevent',
+            index=models.Index(condition=models.Q(processed__isnull=True), fields=['created'],
+                               name='stripe_webhook_pending_idx'),
+        ),
+    ]
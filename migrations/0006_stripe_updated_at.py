@@ -0,0 +1,33 @@
+# Generated by Django 2.2.4 on 2026-10-18 12:02
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stripe', '0005_webhookevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='stripe_updated_at',
+            field=models.DateTimeField(blank=True, editable=False,
+                                       help_text='When the Stripe snapshot this record was last written from was taken. Older snapshots are not written over it.',
+                                       null=True),
+        ),
+        migrations.AddField(
+            model_name='card',
+            name='stripe_updated_at',
+            field=models.DateTimeField(blank=True, editable=False,
+                                       help_text='When the Stripe snapshot this record was last written from was taken. Older snapshots are not written over it.',
+                                       null=True),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='stripe_updated_at',
+            field=models.DateTimeField(blank=True, editable=False,
+                                       help_text='When the Stripe snapshot this record was last written from was taken. Older snapshots are not written over it.',
+                                       null=True),
+        ),
+    ]
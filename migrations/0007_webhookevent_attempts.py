@@ -0,0 +1,23 @@
+# Generated by Django 2.2.4 on 2026-10-18 16:41
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stripe', '0006_stripe_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhookevent',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0, help_text='The number of times applying the event failed.'),
+        ),
+        migrations.AddField(
+            model_name='webhookevent',
+            name='error',
+            field=models.TextField(blank=True, default='', help_text='Why applying the event last failed.'),
+            preserve_default=False,
+        ),
+    ]
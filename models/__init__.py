@@ -1,12 +1,17 @@
-from .base import IdempotencyKey, StripeModel
+from .base import GetOrCreateResult, IdempotencyKey, StripeModel, SyncCursor, SyncResult
 from .connect import Account
 from .core import Customer
 from .payment_methods import Card
+from .webhooks import WebhookEvent
 
 __all__ = [
     "Account",
     "Card",
     "Customer",
+    "GetOrCreateResult",
     "IdempotencyKey",
     "StripeModel",
+    "SyncCursor",
+    "SyncResult",
+    "WebhookEvent",
 ]
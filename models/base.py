@@ -1,16 +1,54 @@
 import logging
+import operator
 import uuid
+from collections import OrderedDict, defaultdict, namedtuple
 from datetime import timedelta
 
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.utils import timezone
 from django.contrib.postgres.fields import JSONField
 
+from ..aio import run_stripe
+from ..cache import object_cache
+from ..fetch import fetch_many
 from ..fields import StripeDateTimeField
+from ..governor import READ, WRITE, governed
+from ..identity import get_identity_map, resolve
+from ..metrics import instrument
+from ..utils import StripeObjectView, chunked, snapshot_watermark
 from .. import settings as stripe_settings
 
 logger = logging.getLogger(__name__)
 
+SyncResult = namedtuple("SyncResult", ["created", "updated", "skipped"])
+GetOrCreateResult = namedtuple("GetOrCreateResult", ["user", "obj", "created", "error"])
+
+
+def _db_value(value):
+    # Related instances are compared with the primary key ``values()`` returns.
+    return value.pk if isinstance(value, models.Model) else value
+
+
+def _empty_string_if_none(convert):
+    def wrapper(data):
+        field_data = convert(data)
+        return "" if field_data is None else field_data
+
+    return wrapper
+
+
+class StripeClass:
+    """
+    A `stripe` API resource, e.g. ``StripeClass("Customer")``, resolved on access
+    so that importing the models doesn't import the stripe SDK.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        return getattr(stripe_settings.get_stripe(), self.name)
+
 
 class StripeModel(models.Model):
 
@@ -41,19 +79,88 @@ class StripeModel(models.Model):
     description = models.TextField(
         null=True, blank=True, help_text="A description of this object."
     )
+    stripe_updated_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        editable=False,
+        help_text="When the Stripe snapshot this record was last written from was "
+                  "taken. Older snapshots are not written over it.",
+    )
 
     class Meta:
         abstract = True
 
+    def identity_keys(self):
+        """
+        The keys this instance can be resolved by through an identity map.
+
+        :rtype: list of tuple
+        """
+        return [("stripe_id", self.stripe_id)]
+
+    @classmethod
+    def get_by_stripe_id(cls, stripe_id):
+        """
+        Return the record of a Stripe object, looked up at most once per request
+        when an identity map is active.
+        """
+        return resolve(
+            cls, ("stripe_id", stripe_id), lambda: cls.objects.get(stripe_id=stripe_id)
+        )
+
     @property
     def default_api_key(self):
         return stripe_settings.get_default_api_key()
 
+    @classmethod
+    def api_retrieve_token(cls, token_id, api_key=stripe_settings.STRIPE_SECRET_KEY):
+        """
+        Retrieve a token, through the Stripe object cache.
+
+        Only the Stripe API is called, never the database, so this can run on
+        any thread.
+        """
+        stripe = stripe_settings.get_stripe()
+
+        def retrieve():
+            with governed(READ, api_key), instrument("retrieve", stripe.Token.OBJECT_NAME) as call:
+                call.response = stripe.Token.retrieve(token_id, api_key=api_key)
+            return call.response
+
+        return object_cache.get_or_fetch(
+            object_cache.make_key(stripe.Token, token_id, api_key=api_key), retrieve
+        )
+
     @classmethod
     def api_retrieve_card_from_token(cls, token_id, api_key=stripe_settings.STRIPE_SECRET_KEY):
-        import stripe
-        card_data = stripe.Token.retrieve(token_id, api_key=api_key)['card']
-        return cls._stripe_object_to_record(card_data)
+        token = cls.api_retrieve_token(token_id, api_key=api_key)
+        return cls._stripe_object_to_record(token['card'], in_place=False)
+
+    @classmethod
+    async def aapi_retrieve_card_from_token(cls, token_id, api_key=stripe_settings.STRIPE_SECRET_KEY):
+        """Async counterpart of `api_retrieve_card_from_token`."""
+        return await run_stripe(cls.api_retrieve_card_from_token, token_id, api_key=api_key)
+
+    @classmethod
+    def api_retrieve_cards_from_tokens(cls, token_ids, api_key=stripe_settings.STRIPE_SECRET_KEY,
+                                       max_workers=None):
+        """
+        Retrieve the cards of many tokens concurrently.
+
+        :param token_ids: The ids of the tokens to retrieve.
+        :type token_ids: iterable of str
+        :param max_workers: The size of the thread pool used.
+        :type max_workers: int
+        :returns: One result per token, in input order, whose ``error`` is set
+            instead of ``result`` if the retrieval failed.
+        :rtype: list of FetchResult
+        """
+        return fetch_many(
+            lambda token_id: cls.api_retrieve_card_from_token(token_id, api_key=api_key),
+            token_ids,
+            api_key=api_key,
+            max_workers=max_workers,
+        )
 
     @classmethod
     def _api_create(cls, api_key=stripe_settings.STRIPE_SECRET_KEY, **kwargs):
@@ -65,22 +172,213 @@ class StripeModel(models.Model):
         :type api_key: string
         """
 
-        return cls.stripe_class.create(api_key=api_key, **kwargs)
+        with governed(WRITE, api_key), instrument("create", cls.stripe_class.OBJECT_NAME) as call:
+            call.response = cls.stripe_class.create(api_key=api_key, **kwargs)
+        return call.response
+
+    @classmethod
+    async def _aapi_create(cls, api_key=stripe_settings.STRIPE_SECRET_KEY, **kwargs):
+        """Async counterpart of `_api_create`."""
+        return await run_stripe(cls._api_create, api_key=api_key, **kwargs)
 
-    def api_retrieve(self, api_key=None):
+    def api_retrieve(self, api_key=None, use_cache=True):
         """
         Call the stripe API's retrieve operation for this model.
 
+        The object is served from the Stripe object cache if it was retrieved in
+        the last ``STRIPE_OBJECT_CACHE_TTL`` seconds.
+
         :param api_key: The api key to use for this request. \
             Defaults to settings.STRIPE_SECRET_KEY.
         :type api_key: string
+        :param use_cache: If False, always call the API and refresh the cache.
+        :type use_cache: bool
         """
         api_key = api_key or self.default_api_key
 
-        return self.stripe_class.retrieve(
-            id=self.stripe_id, api_key=api_key, expand=self.expand_fields
+        def retrieve():
+            with governed(READ, api_key), \
+                    instrument("retrieve", self.stripe_class.OBJECT_NAME) as call:
+                call.response = self.stripe_class.retrieve(
+                    id=self.stripe_id, api_key=api_key, expand=self.expand_fields
+                )
+            return call.response
+
+        if not use_cache:
+            self.invalidate_cache(self.stripe_id, api_key=api_key)
+
+        return object_cache.get_or_fetch(
+            object_cache.make_key(
+                self.stripe_class, self.stripe_id, self.livemode, self.expand_fields,
+                api_key=api_key,
+            ),
+            retrieve,
+        )
+
+    @classmethod
+    def invalidate_cache(cls, stripe_id, api_key=None):
+        """
+        Drop the cached copies of a Stripe object of this type, e.g. after it was
+        changed or when a webhook reports a change.
+
+        :param api_key: The API key the object may have been retrieved with, if
+            not one of the configured ones.
+        :type api_key: string
+        """
+        object_cache.invalidate(cls.stripe_class, stripe_id, cls.expand_fields, api_key=api_key)
+
+    async def aapi_retrieve(self, api_key=None, use_cache=True):
+        """Async counterpart of `api_retrieve`."""
+        return await run_stripe(self.api_retrieve, api_key=api_key, use_cache=use_cache)
+
+    @classmethod
+    def api_retrieve_many(cls, objs, api_key=None, max_workers=None):
+        """
+        Call the stripe API's retrieve operation for many records concurrently.
+
+        Requests are spread over a bounded thread pool, throttled per API key and
+        retried with backoff on rate limit errors.
+
+        :param objs: The records to retrieve.
+        :type objs: iterable of StripeModel
+        :param api_key: The api key to use for these requests. \
+            Defaults to settings.STRIPE_SECRET_KEY.
+        :type api_key: string
+        :param max_workers: The size of the thread pool used.
+        :type max_workers: int
+        :returns: One result per record, in input order, whose ``error`` is set
+            instead of ``result`` if the retrieval failed.
+        :rtype: list of FetchResult
+        """
+        api_key = api_key or stripe_settings.get_default_api_key()
+
+        return fetch_many(
+            lambda obj: obj.api_retrieve(api_key=api_key),
+            objs,
+            api_key=api_key,
+            max_workers=max_workers,
         )
 
+    @classmethod
+    def store_created(cls, record, watermark=None, **fields):
+        """
+        Store the record of a Stripe object just created.
+
+        A webhook may have stored the object meanwhile, without its user: the row
+        is then updated instead, through the conditional write of
+        `sync_from_stripe_data`, so that a newer state a webhook stored is kept.
+        The given ``fields`` are set either way.
+
+        :param record: The record of the object, from `_stripe_object_to_record`.
+        :type record: dict
+        :param watermark: When the object was created, see `utils.snapshot_watermark`.
+        :type watermark: datetime
+        :param fields: The values set on top of the record, e.g. a ``user``.
+        :returns: The stored record.
+        :rtype: StripeModel
+        """
+        record = dict(record, **fields)
+        if watermark is not None:
+            record["stripe_updated_at"] = watermark
+        stripe_id = record.pop("stripe_id")
+
+        result = cls._apply_record(stripe_id, record, watermark=watermark)
+        obj = cls.objects.get(stripe_id=stripe_id)
+        if result.skipped and fields:
+            # A newer state is stored, keep it but still set the given fields.
+            for name, value in fields.items():
+                setattr(obj, name, value)
+            obj.save(update_fields=list(fields))
+
+        imap = get_identity_map()
+        if imap is not None:
+            imap.register(obj)
+        return obj
+
+    @classmethod
+    def _bulk_get_or_create_in_stripe(cls, users, existing, create, object_type, action_format,
+                                      livemode, max_workers=None, progress=None):
+        """
+        Get or create the records of many users at once.
+
+        The idempotency keys of the missing records are allocated in bulk, the
+        Stripe objects are created concurrently and the records are then written
+        with a single ``bulk_create``. Records a webhook stored meanwhile are kept,
+        and given their user if they have none.
+
+        :param users: The users to get or create a record for.
+        :type users: iterable of User
+        :param existing: The records already stored, by user pk.
+        :type existing: dict
+        :param create: Creates the Stripe object of a user and returns its record,
+            called with the user and an ``idempotency_key``.
+        :type create: callable
+        :param object_type: The object type of the idempotency keys.
+        :type object_type: str
+        :param action_format: The action of the idempotency keys, formatted with
+            the user pk.
+        :type action_format: str
+        :param progress: Called with the number of Stripe objects created so far
+            and the number to create.
+        :type progress: callable
+        :returns: One result per user, in input order, whose ``error`` is set if
+            the record could not be created.
+        :rtype: list of GetOrCreateResult
+        """
+        users = list(users)
+        missing = list({user.pk: user for user in users if user.pk not in existing}.values())
+
+        idempotency_keys = stripe_settings.get_idempotency_keys(
+            object_type, [action_format.format(user.pk) for user in missing], livemode
+        )
+        fetched = fetch_many(
+            lambda user: create(
+                user, idempotency_key=idempotency_keys[action_format.format(user.pk)]
+            ),
+            missing,
+            api_key=stripe_settings.STRIPE_SECRET_KEY,
+            max_workers=max_workers,
+            progress=progress,
+        )
+
+        errors = {result.item.pk: result.error for result in fetched if result.error}
+        records = [
+            cls(user=result.item, **result.result) for result in fetched if not result.error
+        ]
+        created = {}
+        if records:
+            users_by_stripe_id = {record.stripe_id: record.user for record in records}
+            with transaction.atomic():
+                cls.objects.bulk_create(records, ignore_conflicts=True)
+                stored = list(
+                    cls.objects.select_for_update().filter(stripe_id__in=list(users_by_stripe_id))
+                )
+                # The rows a webhook created first have no user yet.
+                unowned = [obj for obj in stored if obj.user_id is None]
+                for obj in unowned:
+                    obj.user = users_by_stripe_id[obj.stripe_id]
+                if unowned:
+                    cls.objects.bulk_update(unowned, ["user"])
+                created = {obj.user_id: obj for obj in stored}
+
+            imap = get_identity_map()
+            if imap is not None:
+                for obj in created.values():
+                    imap.register(obj)
+
+        results = []
+        for user in users:
+            if user.pk in existing:
+                results.append(GetOrCreateResult(user, existing[user.pk], False, None))
+            elif user.pk in created:
+                results.append(GetOrCreateResult(user, created[user.pk], True, None))
+            else:
+                error = errors.get(user.pk) or cls.DoesNotExist(
+                    "The record of user %r was not stored." % user.pk
+                )
+                results.append(GetOrCreateResult(user, None, False, error))
+        return results
+
     @classmethod
     def _id_from_data(cls, data):
         """
@@ -113,6 +411,9 @@ class StripeModel(models.Model):
         Gets called by this object's stripe object conversion method just before
         conversion.
         Use this to populate custom fields in a StripeModel from stripe data.
+
+        `data` may be a `StripeObjectView`, which already exposes `id` as
+        `stripe_id` and keeps any changes made here off the original object.
         """
         if data.get('id', None):
             data['stripe_id'] = data['id']
@@ -120,7 +421,7 @@ class StripeModel(models.Model):
         return data
 
     @classmethod
-    def _stripe_object_to_record(cls, data):
+    def _stripe_object_to_record(cls, data, in_place=True):
         """
         This takes an object, as it is formatted in Stripe's current API for our object
         type. In return, it provides a dict. The dict can be used to create a record or
@@ -132,11 +433,17 @@ class StripeModel(models.Model):
 
         :param data: the object, as sent by Stripe. Parsed from JSON, into a dict
         :type data: dict
+        :param in_place: If False, `data` is read through a `StripeObjectView` rather
+            than renamed in place, leaving the object untouched for the caller.
+        :type in_place: bool
 
         :return: All the members from the input, translated, mutated, etc
         :rtype: dict
         """
 
+        if not in_place:
+            data = StripeObjectView(data)
+
         manipulated_data = cls._manipulate_stripe_object_hook(data)
 
         if "object" not in data:
@@ -147,34 +454,305 @@ class StripeModel(models.Model):
                 "Trying to fit a %r into %r. Aborting." % (data["object"], cls.__name__)
             )
 
-        result = {}
+        return {
+            name: convert(manipulated_data)
+            for name, convert in cls._get_stripe_field_converters()
+        }
+
+    @classmethod
+    def _get_stripe_field_converters(cls):
+        """
+        Return the cached conversion plan used by `_stripe_object_to_record`.
+
+        The plan is built once per class on first use and rebuilt if the model's
+        fields change (Django recreates `_meta.fields` whenever its field cache is
+        expired).
+
+        :returns: ``(field name, converter)`` pairs.
+        :rtype: tuple
+        """
+        fields = cls._meta.fields
+        cached = cls.__dict__.get("_stripe_field_converters")
+        if cached is None or cached[0] is not fields:
+            cached = (fields, cls._build_stripe_field_converters(fields))
+            cls._stripe_field_converters = cached
+        return cached[1]
+
+    @classmethod
+    def _build_stripe_field_converters(cls, fields):
+        converters = []
 
         # Iterate over all the fields that we know are related to Stripe,
         # let each field work its own magic
         ignore_fields = ["id", "date_purged"]  # XXX: Customer hack
-        for field in cls._meta.fields:
-            if field.name in ignore_fields:
+        for field in fields:
+            if field.name in ignore_fields or field.name == "stripe_updated_at":
                 continue
 
             if isinstance(field, models.ForeignKey):
                 continue
 
             if hasattr(field, "stripe_to_db"):
-                field_data = field.stripe_to_db(manipulated_data)
+                convert = field.stripe_to_db
             else:
-                field_data = manipulated_data.get(field.name)
+                convert = operator.methodcaller("get", field.name)
 
-            if (
-                    isinstance(field, (models.CharField, models.TextField))
-                    and field_data is None
-            ):
+            if isinstance(field, (models.CharField, models.TextField)):
                 # TODO - this applies to StripeEnumField as well, since it
                 #  sub-classes CharField, is that intentional?
-                field_data = ""
+                convert = _empty_string_if_none(convert)
+
+            converters.append((field.name, convert))
+
+        return tuple(converters)
+
+    @classmethod
+    def sync_from_stripe_data(cls, data, watermark=None, skip_unchanged=False):
+        """
+        Create or update the record of a Stripe object.
+
+        With a ``watermark``, an existing row is only updated if its
+        `stripe_updated_at` is not newer, in a single conditional ``UPDATE``: a
+        stale snapshot never overwrites a newer one. Watermarks have a 1 second
+        resolution, so a snapshot with the same watermark as the stored one is
+        applied.
+
+        :param data: The object, as sent by Stripe.
+        :type data: dict
+        :param watermark: When the snapshot in `data` was taken, on Stripe's clock:
+            an event's ``created``, or `utils.snapshot_watermark` of a request.
+        :type watermark: datetime
+        :param skip_unchanged: If True, compare with the stored row first and only
+            write the fields that changed. See `sync_from_stripe_data_many`.
+        :type skip_unchanged: bool
+        :returns: Whether the record was created, updated or skipped.
+        :rtype: SyncResult
+        """
+        if skip_unchanged:
+            return cls.sync_from_stripe_data_many(
+                [data], watermark=watermark, skip_unchanged=True
+            )
+
+        record = cls._stripe_object_to_record(data, in_place=False)
+        if watermark is not None:
+            record["stripe_updated_at"] = watermark
+        stripe_id = record.pop("stripe_id")
+        return cls._apply_record(stripe_id, record, watermark=watermark)
 
-            result[field.name] = field_data
+    @classmethod
+    def _apply_record(cls, stripe_id, record, watermark=None):
+        """
+        Write a record with a conditional ``UPDATE``, or insert it.
+
+        If another writer inserts the object first, the insert fails on the unique
+        ``stripe_id`` and the conditional ``UPDATE`` is run again over its row.
+
+        :rtype: SyncResult
+        """
+        rows = cls.objects.filter(stripe_id=stripe_id)
+        if watermark is not None:
+            rows = rows.filter(
+                models.Q(stripe_updated_at__isnull=True)
+                | models.Q(stripe_updated_at__lte=watermark)
+            )
+        if rows.update(**record):
+            return SyncResult(0, 1, 0)
+
+        try:
+            with transaction.atomic():
+                cls.objects.create(stripe_id=stripe_id, **record)
+        except IntegrityError:
+            if rows.update(**record):
+                return SyncResult(0, 1, 0)
+            if not cls.objects.filter(stripe_id=stripe_id).exists():
+                raise
+            return SyncResult(0, 0, 1)
+        return SyncResult(1, 0, 0)
+
+    def sync_from_stripe(self, api_key=None, skip_unchanged=True):
+        """
+        Retrieve this object from Stripe and store its current state.
+
+        :param api_key: The api key to use for this request. \
+            Defaults to settings.STRIPE_SECRET_KEY.
+        :type api_key: string
+        :param skip_unchanged: If True, only write the fields that changed.
+        :type skip_unchanged: bool
+        :rtype: SyncResult
+        """
+        watermark = snapshot_watermark()
+        data = self.api_retrieve(api_key=api_key, use_cache=False)
+        return type(self).sync_from_stripe_data(
+            data, watermark=watermark, skip_unchanged=skip_unchanged
+        )
+
+    @classmethod
+    def sync_from_stripe_data_many(cls, data, batch_size=500, watermark=None,
+                                   watermarks=None, skip_unchanged=False, **extra_fields):
+        """
+        Create or update the records for many Stripe objects of this type.
+
+        The objects are converted with `_stripe_object_to_record` and written in
+        chunks of ``batch_size``: one query finds and locks the rows already stored
+        for the chunk, which are then updated with ``bulk_update``, and the
+        remaining records are inserted with ``bulk_create``. If the same object
+        appears more than once in a chunk, the last occurrence wins.
+
+        Rows whose `stripe_updated_at` is newer than the watermark of their object
+        are left untouched and counted as skipped. Watermarks have a 1 second
+        resolution, so a record with the same watermark as the stored row is
+        written: of two events in the same second, the last one wins.
+
+        With ``skip_unchanged``, records are compared with the stored rows and
+        only the fields that differ are updated. Rows without any change are not
+        rewritten and count as skipped, unless a newer watermark came with them:
+        their `stripe_updated_at` is then advanced, and they count as updated.
+
+        :param data: The objects, as sent by Stripe.
+        :type data: iterable of dict
+        :param batch_size: The number of objects converted and written per chunk.
+        :type batch_size: int
+        :param watermark: When the snapshots in `data` were taken, see
+            `utils.snapshot_watermark`.
+        :type watermark: datetime
+        :param watermarks: Per object watermarks, by stripe id, e.g. the creation
+            time of the event each object comes from. Takes precedence over
+            `watermark`.
+        :type watermarks: dict
+        :param skip_unchanged: If True, only write the fields that changed.
+        :type skip_unchanged: bool
+        :param extra_fields: Values set on every record, e.g. a ``customer`` for
+            cards, which `_stripe_object_to_record` does not fill in.
+        :returns: The number of created, updated and skipped records.
+        :rtype: SyncResult
+        """
+        watermarks = watermarks or {}
+        created = updated = skipped = 0
+
+        for chunk in chunked(data, batch_size):
+            records = OrderedDict()
+            for obj in chunk:
+                record = cls._stripe_object_to_record(obj, in_place=False)
+                record.update(extra_fields)
+                record_watermark = watermarks.get(record["stripe_id"], watermark)
+                if record_watermark is not None:
+                    record["stripe_updated_at"] = record_watermark
+                records[record["stripe_id"]] = record
+
+            result = cls._sync_records(records, skip_unchanged=skip_unchanged)
+            created += result.created
+            updated += result.updated
+            skipped += result.skipped
+
+        return SyncResult(created, updated, skipped)
+
+    @classmethod
+    def _sync_records(cls, records, skip_unchanged=False):
+        """
+        Write converted records, keyed by stripe id, in a single transaction.
+
+        Records another writer inserted after the lookup are synced again, over
+        the rows it stored.
 
-        return result
+        :rtype: SyncResult
+        """
+        compared_fields = []
+        if skip_unchanged:
+            compared_fields = [
+                name for name in next(iter(records.values()))
+                if name not in ("stripe_id", "stripe_updated_at")
+            ]
+
+        with transaction.atomic():
+            existing = {
+                row["stripe_id"]: row
+                for row in cls.objects.select_for_update()
+                .filter(stripe_id__in=list(records))
+                .values("stripe_id", "pk", "stripe_updated_at", *compared_fields)
+            }
+
+            to_create = []
+            to_update = defaultdict(list)
+            skipped = 0
+            for stripe_id, record in records.items():
+                if stripe_id not in existing:
+                    to_create.append(cls(**record))
+                    continue
+
+                stored = existing[stripe_id]
+                watermark = record.get("stripe_updated_at")
+                stored_watermark = stored["stripe_updated_at"]
+                if watermark is not None and stored_watermark is not None \
+                        and stored_watermark > watermark:
+                    skipped += 1
+                    continue
+
+                if skip_unchanged:
+                    update_fields = tuple(
+                        name for name in compared_fields
+                        if _db_value(record[name]) != stored[name]
+                    )
+                    if watermark is not None and (
+                            stored_watermark is None or watermark > stored_watermark):
+                        # Advance the watermark even when nothing else changed,
+                        # so that an older state cannot be applied over it.
+                        update_fields += ("stripe_updated_at",)
+                    if not update_fields:
+                        skipped += 1
+                else:
+                    update_fields = tuple(name for name in record if name != "stripe_id")
+
+                if update_fields:
+                    to_update[update_fields].append(cls(pk=stored["pk"], **record))
+
+            for update_fields, objs in to_update.items():
+                cls.objects.bulk_update(objs, update_fields)
+            updated = sum(len(objs) for objs in to_update.values())
+
+            if to_create:
+                try:
+                    with transaction.atomic():
+                        cls.objects.bulk_create(to_create)
+                except IntegrityError:
+                    # Another writer inserted some of these objects since they were
+                    # looked up: sync them again, as updates of the rows it stored.
+                    new_ids = [obj.stripe_id for obj in to_create]
+                    if not cls.objects.filter(stripe_id__in=new_ids).exists():
+                        raise
+                    retried = cls._sync_records(
+                        OrderedDict((stripe_id, records[stripe_id]) for stripe_id in new_ids),
+                        skip_unchanged=skip_unchanged,
+                    )
+                    return SyncResult(
+                        retried.created, updated + retried.updated, skipped + retried.skipped
+                    )
+
+        return SyncResult(len(to_create), updated, skipped)
+
+
+class SyncCursor(models.Model):
+    """
+    The position reached by a paginated import from the Stripe API, so that an
+    interrupted import can resume where it stopped.
+    """
+
+    name = models.CharField(max_length=100)
+    livemode = models.BooleanField(
+        help_text="Whether the cursor was used in live or test mode."
+    )
+    starting_after = models.CharField(
+        max_length=255,
+        default="",
+        blank=True,
+        help_text="The id of the last object imported, empty when not started.",
+    )
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ("name", "livemode")
+
+    def __str__(self):
+        return "{} ({})".format(self.name, self.starting_after or "not started")
 
 
 class IdempotencyKey(models.Model):
@@ -185,7 +763,7 @@ class IdempotencyKey(models.Model):
     livemode = models.BooleanField(
         help_text="Whether the key was used in live or test mode."
     )
-    created = models.DateTimeField(auto_now_add=True)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
 
     class Meta:
         unique_together = ("action", "livemode")
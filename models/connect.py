@@ -1,11 +1,11 @@
-import stripe
-
 from django.contrib.postgres.fields import JSONField
 from django.db import models
 
 from .. import enums
+from ..aio import run_db, run_stripe
+from ..identity import resolve
 from ..fields import StripeEnumField, StripeCurrencyCodeField
-from .base import StripeModel
+from .base import StripeClass, StripeModel
 from .. import settings as stripe_settings
 
 
@@ -14,7 +14,7 @@ class Account(StripeModel):
         Stripe documentation: https://stripe.com/docs/api#account
         """
 
-    stripe_class = stripe.Account
+    stripe_class = StripeClass("Account")
 
     user = models.OneToOneField(
         stripe_settings.get_subscriber_model_string(),
@@ -100,6 +100,17 @@ class Account(StripeModel):
             self.stripe_id,
         )
 
+    def identity_keys(self):
+        return super().identity_keys() + [("user", self.user_id)]
+
+    @classmethod
+    def get_for_user(cls, user):
+        """
+        Return the connect account of a user, looked up at most once per request
+        when an identity map is active.
+        """
+        return resolve(cls, ("user", user.pk), lambda: Account.objects.get(user=user))
+
     @classmethod
     def get_or_create_account_in_stripe(cls, user, livemode=stripe_settings.STRIPE_LIVE_MODE, **account_data):
         """
@@ -114,14 +125,66 @@ class Account(StripeModel):
         """
 
         try:
-            return Account.objects.get(user=user), False
+            return cls.get_for_user(user), False
         except Account.DoesNotExist:
-            action = f'create:{user.pk}'
-            idempotency_key = stripe_settings.get_idempotency_key(
-                "account", action, livemode
-            )
+            idempotency_key = cls.get_create_idempotency_key(user, livemode)
             return cls.create(user, idempotency_key=idempotency_key, **account_data), True
 
+    @classmethod
+    def get_create_idempotency_key(cls, user, livemode=stripe_settings.STRIPE_LIVE_MODE):
+        """Return the idempotency key of the creation of a user's connect account."""
+        return stripe_settings.get_idempotency_key("account", f'create:{user.pk}', livemode)
+
+    @classmethod
+    def get_or_create_accounts_in_stripe(cls, users, livemode=stripe_settings.STRIPE_LIVE_MODE,
+                                         max_workers=None, progress=None, **account_data):
+        """
+        Get or create the stripe connect accounts of many users.
+
+        Existing accounts are found in one query, the missing ones are created
+        in Stripe concurrently and stored with a single ``bulk_create``.
+
+        :param users: The user model instances for which to get or
+            create a connect account.
+        :type users: iterable of User
+        :param livemode: Whether to get the users in live or test mode.
+        :type livemode: bool
+        :param max_workers: The number of accounts created concurrently.
+        :type max_workers: int
+        :param progress: Called with the number of accounts created so far and
+            the number to create.
+        :type progress: callable
+        :returns: One result per user, in input order.
+        :rtype: list of GetOrCreateResult
+        """
+        users = list(users)
+        existing = {
+            account.user_id: account for account in Account.objects.filter(user__in=users)
+        }
+        return cls._bulk_get_or_create_in_stripe(
+            users,
+            existing,
+            lambda user, idempotency_key: cls.create(
+                user, idempotency_key=idempotency_key, **account_data
+            ),
+            "account",
+            'create:{}',
+            livemode,
+            max_workers=max_workers,
+            progress=progress,
+        )
+
+    @classmethod
+    async def aget_or_create_account_in_stripe(cls, user, livemode=stripe_settings.STRIPE_LIVE_MODE,
+                                               **account_data):
+        """Async counterpart of `get_or_create_account_in_stripe`."""
+
+        try:
+            return await run_db(cls.get_for_user, user), False
+        except Account.DoesNotExist:
+            idempotency_key = await run_db(cls.get_create_idempotency_key, user, livemode)
+            return await cls.acreate(user, idempotency_key=idempotency_key, **account_data), True
+
     @classmethod
     def create(cls, user, idempotency_key=None, **account_data, ):
         metadata = {}
@@ -133,3 +196,10 @@ class Account(StripeModel):
             idempotency_key=idempotency_key, metadata=metadata, **account_data
         )
         return cls._stripe_object_to_record(stripe_account)
+
+    @classmethod
+    async def acreate(cls, user, idempotency_key=None, **account_data):
+        """Async counterpart of `create`."""
+        return await run_stripe(
+            cls.create, user, idempotency_key=idempotency_key, **account_data
+        )
@@ -1,15 +1,18 @@
-import stripe
-
 from django.contrib.postgres.fields import JSONField
 from django.db import models
 
 from .. import settings as stripe_settings
 from .. import enums
+from ..aio import run_db, run_stripe
+from ..cache import object_cache
+from ..identity import resolve
+from ..governor import WRITE, governed
+from ..metrics import instrument
 from ..fields import (
     StripeCurrencyCodeField,
     StripeEnumField,
 )
-from .base import StripeModel
+from .base import StripeClass, StripeModel
 
 
 class Customer(StripeModel):
@@ -20,7 +23,7 @@ class Customer(StripeModel):
        Stripe documentation: https://stripe.com/docs/api/python#customers
        """
 
-    stripe_class = stripe.Customer
+    stripe_class = StripeClass("Customer")
     expand_fields = ["default_source"]
 
     address = JSONField(null=True, blank=True, help_text="The customer's address.")
@@ -40,7 +43,7 @@ class Customer(StripeModel):
         help_text="The currency the customer can be charged in for "
                   "recurring billing purposes",
     )
-    default_source = models.CharField(max_length=12, null=True, blank=True)
+    default_source = models.CharField(max_length=255, null=True, blank=True)
     delinquent = models.BooleanField(
         help_text="Whether or not the latest charge for the customer's "
                   "latest invoice has failed."
@@ -112,6 +115,21 @@ class Customer(StripeModel):
         else:
             return self.id
 
+    def identity_keys(self):
+        return super().identity_keys() + [("user", self.user_id, self.livemode)]
+
+    @classmethod
+    def get_for_user(cls, user, livemode=stripe_settings.STRIPE_LIVE_MODE):
+        """
+        Return the customer of a user, looked up at most once per request when an
+        identity map is active.
+        """
+        return resolve(
+            cls,
+            ("user", user.pk, livemode),
+            lambda: Customer.objects.get(user=user, livemode=livemode),
+        )
+
     @classmethod
     def get_or_create_customer_in_stripe(cls, user, livemode=stripe_settings.STRIPE_LIVE_MODE):
         """
@@ -126,14 +144,64 @@ class Customer(StripeModel):
         """
 
         try:
-            return Customer.objects.get(user=user, livemode=livemode), False
+            return cls.get_for_user(user, livemode=livemode), False
         except Customer.DoesNotExist:
-            action = f'create : {user.pk}'
-            idempotency_key = stripe_settings.get_idempotency_key(
-                "customer", action, livemode
-            )
+            idempotency_key = cls.get_create_idempotency_key(user, livemode)
             return cls.create(user, idempotency_key=idempotency_key), True
 
+    @classmethod
+    def get_create_idempotency_key(cls, user, livemode=stripe_settings.STRIPE_LIVE_MODE):
+        """Return the idempotency key of the creation of a user's customer."""
+        return stripe_settings.get_idempotency_key("customer", f'create : {user.pk}', livemode)
+
+    @classmethod
+    def get_or_create_customers_in_stripe(cls, users, livemode=stripe_settings.STRIPE_LIVE_MODE,
+                                          max_workers=None, progress=None):
+        """
+        Get or create the stripe customers of many users.
+
+        Existing customers are found in one query, the missing ones are created
+        in Stripe concurrently and stored with a single ``bulk_create``.
+
+        :param users: The user model instances for which to get or
+            create a customer.
+        :type users: iterable of User
+        :param livemode: Whether to get the users in live or test mode.
+        :type livemode: bool
+        :param max_workers: The number of customers created concurrently.
+        :type max_workers: int
+        :param progress: Called with the number of customers created so far and
+            the number to create.
+        :type progress: callable
+        :returns: One result per user, in input order.
+        :rtype: list of GetOrCreateResult
+        """
+        users = list(users)
+        existing = {
+            customer.user_id: customer
+            for customer in Customer.objects.filter(user__in=users, livemode=livemode)
+        }
+        return cls._bulk_get_or_create_in_stripe(
+            users,
+            existing,
+            cls.create,
+            "customer",
+            'create : {}',
+            livemode,
+            max_workers=max_workers,
+            progress=progress,
+        )
+
+    @classmethod
+    async def aget_or_create_customer_in_stripe(cls, user, livemode=stripe_settings.STRIPE_LIVE_MODE):
+        """Async counterpart of `get_or_create_customer_in_stripe`."""
+
+        try:
+            return await run_db(cls.get_for_user, user, livemode=livemode), False
+        except Customer.DoesNotExist:
+            idempotency_key = await run_db(cls.get_create_idempotency_key, user, livemode)
+            return await cls.acreate(user, idempotency_key=idempotency_key), True
+
     @classmethod
     def create(cls, user, idempotency_key=None):
         metadata = {}
@@ -149,15 +217,36 @@ class Customer(StripeModel):
         )
         return cls._stripe_object_to_record(stripe_customer)
 
+    @classmethod
+    async def acreate(cls, user, idempotency_key=None):
+        """Async counterpart of `create`."""
+        return await run_stripe(cls.create, user, idempotency_key=idempotency_key)
+
     def add_card(self, source):
         """
         Adds a card to this customer's account.
 
+        Only the Stripe API is called, never the database.
+
         :param source: Either a token, like the ones returned by our Stripe.js, or a
             dictionary containing a user's credit card details.
             Stripe will automatically validate the card.
         :type source: string, dict
         """
 
-        stripe_customer = self.api_retrieve()
-        return stripe_customer.sources.create(source=source)
+        with governed(WRITE, self.default_api_key), \
+                instrument("create_source", self.stripe_class.OBJECT_NAME) as call:
+            call.response = card = self.stripe_class.create_source(
+                self.stripe_id, source=source, api_key=self.default_api_key
+            )
+        self.invalidate_cache(self.stripe_id, api_key=self.default_api_key)
+        if isinstance(source, str):
+            # The cached token would still read as unused.
+            object_cache.invalidate(
+                stripe_settings.get_stripe().Token, source, api_key=self.default_api_key
+            )
+        return card
+
+    async def aadd_card(self, source):
+        """Async counterpart of `add_card`."""
+        return await run_stripe(self.add_card, source)
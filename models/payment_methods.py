@@ -1,14 +1,15 @@
-import stripe
 from django.db import models
 
 from .. import enums
+from ..aio import run_db
+from ..cache import bump_payment_methods_version
 from ..fields import StripeEnumField
-from .base import StripeModel
+from .base import StripeClass, StripeModel
 
 
 class Card(StripeModel):
 
-    stripe_class = stripe.Card
+    stripe_class = StripeClass("Card")
 
     address_city = models.TextField(
         max_length=5000,
@@ -97,6 +98,11 @@ class Card(StripeModel):
         help_text="If the card number is tokenized, this is the method that was used.",
     )
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["fingerprint", "customer"], name="stripe_card_fingerprint_idx"),
+        ]
+
     def __repr__(self):
         return "Card(pk={!r}, customer={!r})".format(
             self.pk,
@@ -104,9 +110,68 @@ class Card(StripeModel):
         )
 
     @classmethod
-    def get_card_detail_from_token(cls, card_token):
+    def get_card_detail_from_token(cls, card_token, customer=None):
+        """
+        Retrieve the card of a token, or the stored card with the same fingerprint.
+
+        :param card_token: The id of the token.
+        :type card_token: str
+        :param customer: If set, only look for a stored card of this customer.
+        :type customer: Customer
+        :returns: The stored card and False, or the card record and True if no
+            card with this fingerprint is stored.
+        :rtype: tuple
+        """
         card = cls.api_retrieve_card_from_token(card_token)
-        exists = Card.objects.filter(fingerprint=card['fingerprint'])
-        if exists:
-            return exists.first(), False
+        existing = cls._get_by_fingerprint(card['fingerprint'], customer)
+        if existing:
+            return existing, False
+        return card, True
+
+    @classmethod
+    def _get_by_fingerprint(cls, fingerprint, customer=None):
+        # A single indexed query on (fingerprint, customer).
+        cards = Card.objects.filter(fingerprint=fingerprint)
+        if customer is not None:
+            cards = cards.filter(customer=customer)
+        return cards.first()
+
+    @classmethod
+    def _get_owner_ids(cls, stripe_ids):
+        """Return the pks of the users owning the cards with these stripe ids."""
+        from .core import Customer
+
+        return set(
+            Customer.objects.filter(legacy_cards__stripe_id__in=list(stripe_ids))
+            .exclude(user=None)
+            .values_list("user_id", flat=True)
+        )
+
+    @classmethod
+    def _apply_record(cls, stripe_id, record, watermark=None):
+        # The conditional UPDATE sends no post_save, bump the payment methods
+        # versions of the previous and the new owner here.
+        previous_owner_ids = cls._get_owner_ids([stripe_id])
+        result = super()._apply_record(stripe_id, record, watermark=watermark)
+        if result.updated:
+            bump_payment_methods_version(*(previous_owner_ids | cls._get_owner_ids([stripe_id])))
+        return result
+
+    @classmethod
+    def _sync_records(cls, records, skip_unchanged=False):
+        # Bulk writes don't send post_save, bump the payment methods versions here,
+        # including those of the users a moved card belonged to.
+        previous_owner_ids = cls._get_owner_ids(records)
+        result = super()._sync_records(records, skip_unchanged=skip_unchanged)
+        if result.created or result.updated:
+            bump_payment_methods_version(*(previous_owner_ids | cls._get_owner_ids(records)))
+        return result
+
+    @classmethod
+    async def aget_card_detail_from_token(cls, card_token, customer=None):
+        """Async counterpart of `get_card_detail_from_token`."""
+        card = await cls.aapi_retrieve_card_from_token(card_token)
+        existing = await run_db(cls._get_by_fingerprint, card['fingerprint'], customer)
+        if existing:
+            return existing, False
         return card, True
@@ -0,0 +1,44 @@
+from django.contrib.postgres.fields import JSONField
+from django.db import models
+
+
+class WebhookEvent(models.Model):
+    """
+    A raw event received on the webhook endpoint, stored as sent by Stripe.
+
+    Rows are only appended by the endpoint; `webhooks.process_pending_events`
+    applies them and sets `processed`, or counts a failed attempt.
+    """
+
+    stripe_id = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=250, help_text="Stripe's event description code")
+    livemode = models.BooleanField(
+        help_text="Whether the event was sent in live or test mode."
+    )
+    created = models.DateTimeField(help_text="The datetime this event was created in stripe.")
+    data = JSONField(help_text="The event, as sent by Stripe.")
+    received = models.DateTimeField(auto_now_add=True)
+    processed = models.DateTimeField(
+        null=True, blank=True, help_text="When the event was applied, null if pending."
+    )
+    attempts = models.PositiveSmallIntegerField(
+        default=0, help_text="The number of times applying the event failed."
+    )
+    error = models.TextField(blank=True, help_text="Why applying the event last failed.")
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["created"],
+                name="stripe_webhook_pending_idx",
+                condition=models.Q(processed__isnull=True),
+            ),
+        ]
+
+    def __str__(self):
+        return "{} ({})".format(self.type, self.stripe_id)
+
+    @property
+    def object_data(self):
+        """The Stripe object the event is about."""
+        return self.data["data"]["object"]
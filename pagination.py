@@ -0,0 +1,12 @@
+from rest_framework.pagination import CursorPagination
+
+from . import settings as stripe_settings
+
+
+class PaymentMethodsPagination(CursorPagination):
+    """Cursor pagination on the primary key, newest payment methods first."""
+
+    ordering = "-id"
+    page_size = stripe_settings.PAYMENT_METHODS_PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = stripe_settings.PAYMENT_METHODS_MAX_PAGE_SIZE
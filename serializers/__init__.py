@@ -1,4 +1,6 @@
 from .payment_methods import (
+    CardPaymentMethodFastReadSerializer,
     CardPaymentMethodReadSerializer,
     CardPaymentMethodsWriteSerializer,
+    SparseFieldsMixin,
 )
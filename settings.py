@@ -1,4 +1,4 @@
-import stripe
+import threading
 
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
@@ -55,6 +55,42 @@ get_idempotency_key = get_callback_function(
     "STRIPE_IDEMPOTENCY_KEY_CALLBACK", _get_idempotency_key
 )
 
+
+def _get_idempotency_keys(object_type, actions, livemode):
+    if get_idempotency_key is not _get_idempotency_key:
+        # Keep using the configured provider, one key at a time.
+        return {
+            action: get_idempotency_key(object_type, action, livemode)
+            for action in actions
+        }
+
+    from .models import IdempotencyKey
+
+    actions = {f"{object_type}:{action}": action for action in actions}
+
+    def fetch(names):
+        return dict(
+            IdempotencyKey.objects.filter(action__in=names, livemode=livemode)
+            .values_list("action", "uuid")
+        )
+
+    keys = fetch(list(actions))
+    missing = [name for name in actions if name not in keys]
+    if missing:
+        IdempotencyKey.objects.bulk_create(
+            [IdempotencyKey(action=name, livemode=livemode) for name in missing],
+            ignore_conflicts=True,
+        )
+        keys.update(fetch(missing))
+
+    return {action: str(keys[name]) for name, action in actions.items()}
+
+
+# Returns a dict of the idempotency keys of many actions, by action.
+get_idempotency_keys = get_callback_function(
+    "STRIPE_IDEMPOTENCY_KEYS_CALLBACK", _get_idempotency_keys
+)
+
 SUBSCRIBER_CUSTOMER_KEY = getattr(
     settings, "STRIPE_SUBSCRIBER_CUSTOMER_KEY", "stripe_subscriber"
 )
@@ -80,21 +116,147 @@ else:
     STRIPE_PUBLIC_KEY = getattr(settings, "STRIPE_TEST_PUBLIC_KEY", "")
 
 
-def get_default_api_key():
+# Signing secret of the webhook endpoint, and how old (in seconds) a signature
+# may be before the event is refused.
+WEBHOOK_SECRET = getattr(settings, "STRIPE_WEBHOOK_SECRET", "")
+WEBHOOK_TOLERANCE = getattr(settings, "STRIPE_WEBHOOK_TOLERANCE", 300)
+# How many times an event failing to apply is tried before it is left aside.
+WEBHOOK_MAX_ATTEMPTS = getattr(settings, "STRIPE_WEBHOOK_MAX_ATTEMPTS", 5)
+
+# In-memory idempotency key provider (see idempotency.py)
+IDEMPOTENCY_KEY_CACHE_SIZE = getattr(settings, "STRIPE_IDEMPOTENCY_KEY_CACHE_SIZE", 10000)
+# Must be a cache shared by every process when several of them issue keys.
+IDEMPOTENCY_KEY_CACHE_ALIAS = getattr(settings, "STRIPE_IDEMPOTENCY_KEY_CACHE_ALIAS", None)
+IDEMPOTENCY_KEY_BATCH_SIZE = getattr(settings, "STRIPE_IDEMPOTENCY_KEY_BATCH_SIZE", 500)
+IDEMPOTENCY_KEY_FLUSH_INTERVAL = getattr(
+    settings, "STRIPE_IDEMPOTENCY_KEY_FLUSH_INTERVAL", 1.0
+)
+
+# Pagination of the payment-methods endpoint
+PAYMENT_METHODS_PAGE_SIZE = getattr(settings, "STRIPE_PAYMENT_METHODS_PAGE_SIZE", 20)
+PAYMENT_METHODS_MAX_PAGE_SIZE = getattr(
+    settings, "STRIPE_PAYMENT_METHODS_MAX_PAGE_SIZE", 100
+)
+
+# Serve ETag/Last-Modified on the payment-methods endpoint and answer matching
+# conditional requests with a 304. The per-user versions are kept in this
+# Django cache, which must be shared by all the processes serving the API: the
+# system checks refuse a LocMem cache.
+PAYMENT_METHODS_ETAG = getattr(settings, "STRIPE_PAYMENT_METHODS_ETAG", False)
+PAYMENT_METHODS_VERSION_CACHE = getattr(
+    settings, "STRIPE_PAYMENT_METHODS_VERSION_CACHE", "default"
+)
+
+# Render payment methods with CardPaymentMethodFastReadSerializer
+FAST_CARD_SERIALIZER = getattr(settings, "STRIPE_FAST_CARD_SERIALIZER", True)
+
+# Pooled keep-alive HTTP transport for the Stripe API (see transport.py)
+HTTP_CLIENT_POOLED = getattr(settings, "STRIPE_HTTP_CLIENT_POOLED", True)
+HTTP_POOL_SIZE = getattr(settings, "STRIPE_HTTP_POOL_SIZE", 10)
+HTTP_TIMEOUT = getattr(settings, "STRIPE_HTTP_TIMEOUT", 80)
+HTTP_CONNECT_TIMEOUT = getattr(settings, "STRIPE_HTTP_CONNECT_TIMEOUT", 5)
+# Use HTTP/2 when httpx and h2 are installed.
+HTTP2 = getattr(settings, "STRIPE_HTTP2", False)
+
+# Instrumentation of the Stripe API calls (see metrics.py). STRIPE_METRICS_SINK
+# may point to a callable receiving each `metrics.StripeCall`; the default
+# records them in the in-process registry, exposed in the Prometheus format by
+# the metrics endpoint when STRIPE_METRICS_ENDPOINT is True.
+METRICS_ENABLED = getattr(settings, "STRIPE_METRICS_ENABLED", True)
+METRICS_ENDPOINT = getattr(settings, "STRIPE_METRICS_ENDPOINT", False)
+
+# Concurrent reads (see fetch.py)
+FETCH_MAX_WORKERS = getattr(settings, "STRIPE_FETCH_MAX_WORKERS", 8)
+FETCH_MAX_CONCURRENCY_PER_KEY = getattr(
+    settings, "STRIPE_FETCH_MAX_CONCURRENCY_PER_KEY", 8
+)
+# Requests per second allowed per API key, None for no limit. Only enforced when
+# the rate governor is disabled.
+FETCH_RATE_LIMIT = getattr(settings, "STRIPE_FETCH_RATE_LIMIT", 20)
+FETCH_MAX_RETRIES = getattr(settings, "STRIPE_FETCH_MAX_RETRIES", 3)
+
+# Read-through cache of retrieved Stripe objects (see cache.py). A TTL of 0
+# disables it; STRIPE_OBJECT_CACHE_ALIAS stores the objects in a Django cache
+# instead of the in-process LRU, and STRIPE_OBJECT_CACHE_BACKEND can point to a
+# custom backend class.
+OBJECT_CACHE_TTL = getattr(settings, "STRIPE_OBJECT_CACHE_TTL", 30)
+OBJECT_CACHE_MAX_SIZE = getattr(settings, "STRIPE_OBJECT_CACHE_MAX_SIZE", 1024)
+OBJECT_CACHE_ALIAS = getattr(settings, "STRIPE_OBJECT_CACHE_ALIAS", None)
+
+# Rate governor pacing the Stripe API calls (see governor.py). The buckets are
+# kept in memory per process ("local"), in a file shared by the processes of a
+# host ("file", at STRIPE_RATE_GOVERNOR_PATH), or in a Django cache shared by
+# every node ("cache"). None disables the governor. Limits are calls per second,
+# per API key.
+RATE_GOVERNOR_BACKEND = getattr(settings, "STRIPE_RATE_GOVERNOR_BACKEND", "local")
+RATE_GOVERNOR_LIMITS = getattr(
+    settings,
+    "STRIPE_RATE_GOVERNOR_LIMITS",
+    {"live": {"read": 50, "write": 50}, "test": {"read": 12, "write": 12}},
+)
+RATE_GOVERNOR_BURST = getattr(settings, "STRIPE_RATE_GOVERNOR_BURST", 1.0)
+# The share of each budget kept for interactive calls.
+RATE_GOVERNOR_RESERVE = getattr(settings, "STRIPE_RATE_GOVERNOR_RESERVE", 0.2)
+RATE_GOVERNOR_MAX_WAIT = getattr(settings, "STRIPE_RATE_GOVERNOR_MAX_WAIT", 30)
+RATE_GOVERNOR_DEFAULT_LANE = getattr(
+    settings, "STRIPE_RATE_GOVERNOR_DEFAULT_LANE", "interactive"
+)
+RATE_GOVERNOR_PATH = getattr(settings, "STRIPE_RATE_GOVERNOR_PATH", None)
+RATE_GOVERNOR_CACHE_ALIAS = getattr(settings, "STRIPE_RATE_GOVERNOR_CACHE_ALIAS", "default")
+
+# Seconds by which the watermarks of API snapshots are backdated, to absorb the
+# skew between the local clock and Stripe's, which dates the webhook events.
+WATERMARK_CLOCK_SKEW = getattr(settings, "STRIPE_WATERMARK_CLOCK_SKEW", 5)
+
+# Size of the pool shared by the async API and concurrent requests (see fetch.py)
+ASYNC_MAX_WORKERS = getattr(settings, "STRIPE_ASYNC_MAX_WORKERS", 64)
+
+
+def get_default_api_key(livemode=None):
     """
     Returns the default API key for a value of `livemode`.
     """
-    if STRIPE_LIVE_MODE:
-        # Livemode is unknown. Use the default secret key.
+    if livemode is None:
+        # Livemode is unknown, use the mode of the settings
+        livemode = STRIPE_LIVE_MODE
+    if livemode:
+        # Livemode is true, use the live secret key
         return LIVE_API_KEY or STRIPE_SECRET_KEY
     else:
         # Livemode is false, use the test secret key
         return TEST_API_KEY or STRIPE_SECRET_KEY
 
 
+_stripe = None
+_stripe_lock = threading.Lock()
+
+
+def get_stripe():
+    """
+    Return the `stripe` module, importing it on first use.
+
+    Importing the stripe SDK is deferred until the first API call, so processes
+    which never call Stripe don't pay for it. The pooled HTTP client is installed
+    at the same time.
+    """
+    global _stripe
+
+    if _stripe is None:
+        with _stripe_lock:
+            if _stripe is None:
+                import stripe
+
+                if HTTP_CLIENT_POOLED:
+                    from .transport import install_http_client
+
+                    install_http_client()
+                _stripe = stripe
+    return _stripe
+
+
 def get_stripe_api_version():
     """Get the desired API version to use for Stripe requests."""
-    version = getattr(settings, "STRIPE_API_VERSION", stripe.api_version)
+    version = getattr(settings, "STRIPE_API_VERSION", None) or get_stripe().api_version
     return version or DEFAULT_STRIPE_API_VERSION
 
 
@@ -114,7 +276,7 @@ def set_stripe_api_version(version=None, validate=True):
         if not valid:
             raise ValueError("Bad stripe API version: {}".format(version))
 
-    stripe.api_version = version
+    get_stripe().api_version = version
 
 
 def get_subscriber_model_string():
@@ -0,0 +1,39 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import bump_payment_methods_version
+from .identity import get_identity_map
+from .models import Account, Card, Customer
+
+
+@receiver(post_save, sender=Card)
+@receiver(post_delete, sender=Card)
+def card_changed(sender, instance, **kwargs):
+    if instance.customer_id is None:
+        return
+
+    user_ids = Customer.objects.filter(pk=instance.customer_id).values_list("user_id", flat=True)
+    bump_payment_methods_version(*[user_id for user_id in user_ids if user_id is not None])
+
+
+@receiver(post_save, sender=Customer)
+@receiver(post_delete, sender=Customer)
+def customer_changed(sender, instance, **kwargs):
+    if instance.user_id is not None:
+        bump_payment_methods_version(instance.user_id)
+
+
+@receiver(post_save, sender=Account)
+@receiver(post_save, sender=Customer)
+def register_identity(sender, instance, **kwargs):
+    imap = get_identity_map()
+    if imap is not None:
+        imap.register(instance)
+
+
+@receiver(post_delete, sender=Account)
+@receiver(post_delete, sender=Customer)
+def discard_identity(sender, instance, **kwargs):
+    imap = get_identity_map()
+    if imap is not None:
+        imap.discard(instance)
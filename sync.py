@@ -0,0 +1,168 @@
+import functools
+
+from . import settings as stripe_settings
+from .governor import BACKGROUND, READ, governed
+from .metrics import instrument
+from .utils import snapshot_watermark
+
+
+def iter_stripe_pages(list_func, starting_after=None, limit=100, operation="list",
+                      object_type=None, **params):
+    """
+    Yield the objects of a Stripe list endpoint one page at a time.
+
+    Only one page is held in memory at a time, whatever the size of the list.
+    Pages are requested in the background lane of the rate governor.
+
+    :param list_func: The list operation to call, e.g. `stripe.Customer.list`.
+    :type list_func: callable
+    :param starting_after: The id of the object to resume after, if any.
+    :type starting_after: str
+    :param limit: The number of objects requested per page.
+    :type limit: int
+    :param operation: The operation the page requests are instrumented as.
+    :type operation: str
+    :param object_type: The object type the page requests are instrumented as.
+    :type object_type: str
+    :param params: Extra parameters for the list operation.
+    :rtype: generator of list
+    """
+    while True:
+        if starting_after:
+            params["starting_after"] = starting_after
+
+        with governed(READ, params.get("api_key"), lane=BACKGROUND), \
+                instrument(operation, object_type) as call:
+            call.response = page = list_func(limit=limit, **params)
+        if not page.data:
+            return
+
+        starting_after = page.data[-1]["id"]
+        yield page.data
+
+        if not page.has_more:
+            return
+
+
+def _with_request_time(pages):
+    """Pair each page with the watermark of the time it was requested at."""
+    while True:
+        requested_at = snapshot_watermark()
+        try:
+            page = next(pages)
+        except StopIteration:
+            return
+        yield requested_at, page
+
+
+def import_stripe_objects(model, list_func, cursor_name, limit=100, reset=False,
+                          extra_fields=None, **params):
+    """
+    Import every object of a Stripe list endpoint into `model`, page by page.
+
+    Each page is written with `StripeModel.sync_from_stripe_data_many` and the id
+    of its last object is then stored in a `SyncCursor`, so an interrupted import
+    resumes after the last page written. The cursor is cleared once the whole list
+    has been imported.
+
+    :param model: The model the objects are imported into.
+    :type model: StripeModel
+    :param list_func: The list operation to call, e.g. `stripe.Customer.list`.
+    :type list_func: callable
+    :param cursor_name: The name the resume position is stored under.
+    :type cursor_name: str
+    :param limit: The number of objects requested and written per page.
+    :type limit: int
+    :param reset: If True, ignore any stored position and start from the top.
+    :type reset: bool
+    :param extra_fields: Values set on every imported record.
+    :type extra_fields: dict
+    :returns: The result of each page written.
+    :rtype: generator of SyncResult
+    """
+    from .models import SyncCursor
+
+    cursor, _created = SyncCursor.objects.get_or_create(
+        name=cursor_name, livemode=stripe_settings.STRIPE_LIVE_MODE
+    )
+    starting_after = None if reset else cursor.starting_after or None
+    params.setdefault("api_key", stripe_settings.get_default_api_key())
+
+    pages = iter_stripe_pages(
+        list_func, starting_after, limit, object_type=model.stripe_class.OBJECT_NAME, **params
+    )
+    for requested_at, page in _with_request_time(pages):
+        yield model.sync_from_stripe_data_many(
+            page,
+            batch_size=limit,
+            watermark=requested_at,
+            skip_unchanged=True,
+            **(extra_fields or {})
+        )
+        cursor.starting_after = page[-1]["id"]
+        cursor.save(update_fields=["starting_after", "updated"])
+
+    cursor.starting_after = ""
+    cursor.save(update_fields=["starting_after", "updated"])
+
+
+def import_customers(limit=100, reset=False):
+    from .models import Customer
+
+    return import_stripe_objects(
+        Customer, Customer.stripe_class.list, "customers", limit=limit, reset=reset
+    )
+
+
+def import_accounts(limit=100, reset=False):
+    from .models import Account
+
+    return import_stripe_objects(
+        Account, Account.stripe_class.list, "accounts", limit=limit, reset=reset
+    )
+
+
+def import_cards(limit=100, reset=False):
+    """
+    Import the cards of every stored customer.
+
+    Customers are walked in `stripe_id` order and the resume position is the last
+    customer whose cards were all imported.
+
+    :rtype: generator of SyncResult
+    """
+    from .models import Card, Customer, SyncCursor
+
+    cursor, _created = SyncCursor.objects.get_or_create(
+        name="cards", livemode=stripe_settings.STRIPE_LIVE_MODE
+    )
+    customers = Customer.objects.order_by("stripe_id")
+    if cursor.starting_after and not reset:
+        customers = customers.filter(stripe_id__gt=cursor.starting_after)
+
+    for customer in customers.iterator():
+        list_sources = functools.partial(
+            Customer.stripe_class.list_sources, customer.stripe_id
+        )
+        pages = iter_stripe_pages(
+            list_sources,
+            limit=limit,
+            operation="list_sources",
+            object_type=Customer.stripe_class.OBJECT_NAME,
+            object="card",
+            api_key=stripe_settings.get_default_api_key(),
+        )
+        for requested_at, page in _with_request_time(pages):
+            yield Card.sync_from_stripe_data_many(
+                page,
+                batch_size=limit,
+                watermark=requested_at,
+                skip_unchanged=True,
+                customer=customer,
+            )
+
+        cursor.starting_after = customer.stripe_id
+        cursor.save(update_fields=["starting_after", "updated"])
+
+    cursor.starting_after = ""
+    cursor.save(update_fields=["starting_after", "updated"])
@@ -0,0 +1,22 @@
+"""
+Offline stand-ins for the Stripe API, for tests and load tests.
+
+A `FakeStripe` holds the state of a fake Stripe account. It answers either
+in-process through a `FakeStripeHTTPClient`, or over localhost through a
+`FakeStripeServer`. `RecordingHTTPClient` and `ReplayHTTPClient` record the
+responses of any client, e.g. of the real API, and play them back.
+"""
+from .fake_server import (
+    FakeStripe, FakeStripeError, FakeStripeHTTPClient, FakeStripeServer, fake_stripe
+)
+from .replay import RecordingHTTPClient, ReplayHTTPClient
+
+__all__ = [
+    "FakeStripe",
+    "FakeStripeError",
+    "FakeStripeHTTPClient",
+    "FakeStripeServer",
+    "fake_stripe",
+    "RecordingHTTPClient",
+    "ReplayHTTPClient",
+]
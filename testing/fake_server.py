@@ -0,0 +1,651 @@
+import hashlib
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qsl, urlsplit
+
+from stripe.http_client import HTTPClient
+
+from ..transport import use_http_client
+
+# 2020-01-01, the creation time of the first fake object.
+DEFAULT_EPOCH = 1577836800
+
+ERROR_TYPES = {
+    400: "invalid_request_error",
+    401: "invalid_request_error",
+    402: "card_error",
+    404: "invalid_request_error",
+    409: "idempotency_error",
+    429: "invalid_request_error",
+}
+
+ROUTES = [
+    ("POST", r"/v1/tokens", "create_token"),
+    ("GET", r"/v1/tokens/(?P<id>[^/]+)", "retrieve_token"),
+    ("GET", r"/v1/customers", "list_customers"),
+    ("POST", r"/v1/customers", "create_customer"),
+    ("GET", r"/v1/customers/(?P<id>[^/]+)", "retrieve_customer"),
+    ("POST", r"/v1/customers/(?P<id>[^/]+)", "update_customer"),
+    ("DELETE", r"/v1/customers/(?P<id>[^/]+)", "delete_customer"),
+    ("GET", r"/v1/customers/(?P<customer>[^/]+)/sources", "list_sources"),
+    ("POST", r"/v1/customers/(?P<customer>[^/]+)/sources", "create_source"),
+    ("GET", r"/v1/customers/(?P<customer>[^/]+)/sources/(?P<id>[^/]+)", "retrieve_source"),
+    ("DELETE", r"/v1/customers/(?P<customer>[^/]+)/sources/(?P<id>[^/]+)", "delete_source"),
+    ("GET", r"/v1/accounts", "list_accounts"),
+    ("POST", r"/v1/accounts", "create_account"),
+    ("GET", r"/v1/accounts/(?P<id>[^/]+)", "retrieve_account"),
+]
+ROUTES = [(method, re.compile(pattern), handler) for method, pattern, handler in ROUTES]
+
+
+class FakeStripeError(Exception):
+    def __init__(self, status, message, code=None, param=None):
+        super().__init__(message)
+        self.status = status
+        self.body = {
+            "error": {
+                "type": ERROR_TYPES.get(status, "api_error"),
+                "message": message,
+                "code": code,
+                "param": param,
+            }
+        }
+
+
+def decode_params(pairs):
+    """
+    Decode Stripe's form encoding, e.g. ``metadata[user_id]=1``, into nested
+    dicts and lists.
+
+    :param pairs: The decoded ``(key, value)`` pairs of a query string or body.
+    :type pairs: list of tuple
+    :rtype: dict
+    """
+    params = {}
+    for key, value in pairs:
+        path = [part for part in re.split(r"\[|\]\[|\]", key) if part != ""] or [key]
+        if key.endswith("[]"):
+            path.append("")
+
+        node = params
+        for part, next_part in zip(path, path[1:]):
+            node = node.setdefault(part, [] if next_part == "" else {})
+        if isinstance(node, list):
+            node.append(value)
+        else:
+            node[path[-1]] = value
+
+    return _lists_from_indexes(params)
+
+
+def _lists_from_indexes(value):
+    # Lists are sent as ``expand[0]=a&expand[1]=b``.
+    if isinstance(value, dict):
+        if value and all(key.isdigit() for key in value):
+            return [_lists_from_indexes(value[key]) for key in sorted(value, key=int)]
+        return {key: _lists_from_indexes(item) for key, item in value.items()}
+    return value
+
+
+def card_brand(number):
+    if number.startswith(("34", "37")):
+        return "American Express"
+    if number.startswith(("300", "301", "302", "303", "304", "305", "36", "38")):
+        return "Diners Club"
+    if number.startswith(("6011", "65")):
+        return "Discover"
+    if number.startswith("35"):
+        return "JCB"
+    if number.startswith(("51", "52", "53", "54", "55", "2")):
+        return "MasterCard"
+    if number.startswith("62"):
+        return "UnionPay"
+    if number.startswith("4"):
+        return "Visa"
+    return "Unknown"
+
+
+class FakeStripe:
+    """
+    The in-memory state of a fake Stripe API, covering the endpoints this app
+    uses: tokens, customers and their card sources, and connect accounts.
+
+    Ids and creation times come from counters, so a run is reproducible. The
+    latency of each request and the share of requests failing are configurable,
+    and are drawn from a random generator seeded with `seed`.
+
+    :param latency: The time every request takes, in seconds.
+    :type latency: float
+    :param jitter: A random extra time added to every request, up to this many
+        seconds.
+    :type jitter: float
+    :param error_rate: The share of requests answered with an error, from 0 to 1.
+    :type error_rate: float
+    :param error_statuses: The HTTP statuses injected errors are picked from.
+    :type error_statuses: tuple of int
+    :param seed: The seed of the random generator.
+    :type seed: int
+    :param epoch: The creation timestamp of the first object.
+    :type epoch: int
+    """
+
+    def __init__(self, latency=0, jitter=0, error_rate=0, error_statuses=(429, 500),
+                 seed=0, epoch=DEFAULT_EPOCH):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_statuses = tuple(error_statuses)
+        self.epoch = epoch
+        self.requests = Counter()
+        self._random = random.Random(seed)
+        self._ids = itertools.count(1)
+        self._failures = []
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget every object, idempotent response and pending failure."""
+        with self._lock:
+            self.tokens = OrderedDict()
+            self.customers = OrderedDict()
+            self.sources = {}
+            self.accounts = OrderedDict()
+            self._idempotent_responses = {}
+            self._failures = []
+            self.requests.clear()
+
+    def fail_next(self, status=500, count=1, path=None):
+        """
+        Answer the next `count` requests with an error.
+
+        :param status: The HTTP status of the error.
+        :type status: int
+        :param count: The number of requests failing.
+        :type count: int
+        :param path: If given, only requests whose path starts with it fail.
+        :type path: str
+        """
+        with self._lock:
+            self._failures.extend([(status, path)] * count)
+
+    def _next_id(self, prefix):
+        return "{}_fake{:010d}".format(prefix, next(self._ids))
+
+    def _created(self):
+        return self.epoch + len(self.customers) + len(self.accounts) + len(self.tokens)
+
+    # Seeding
+
+    def add_token(self, number="4242424242424242", exp_month=12, exp_year=2030, **card):
+        """Create a card token, as Stripe.js does, and return it."""
+        with self._lock:
+            return self._tokenize(
+                dict(card, number=number, exp_month=exp_month, exp_year=exp_year)
+            )
+
+    def add_customer(self, **fields):
+        """Create a customer and return it."""
+        with self._lock:
+            return self._create_customer(fields)
+
+    def add_card(self, customer_id, number="4242424242424242", **card):
+        """Attach a new card to a customer and return it."""
+        with self._lock:
+            token = self._tokenize(dict(card, number=number))
+            return self._attach_source(customer_id, token["id"])
+
+    def add_account(self, **fields):
+        """Create a connect account and return it."""
+        with self._lock:
+            return self._create_account(fields)
+
+    # Requests
+
+    def handle(self, method, path, params, headers):
+        """
+        Answer a request.
+
+        :param method: The HTTP method, e.g. ``GET``.
+        :type method: str
+        :param path: The path of the request, e.g. ``/v1/customers``.
+        :type path: str
+        :param params: The decoded query string or form body.
+        :type params: dict
+        :param headers: The request headers.
+        :type headers: dict
+        :returns: The body, HTTP status and headers of the response.
+        :rtype: tuple
+        """
+        headers = {name.lower(): value for name, value in headers.items()}
+        method = method.upper()
+
+        with self._lock:
+            self.requests[(method, path)] += 1
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+            status = self._injected_error(path)
+        if delay:
+            time.sleep(delay)
+
+        if status:
+            error = FakeStripeError(status, "Injected error with status {}.".format(status))
+            return self._response(error.status, error.body)
+
+        if not headers.get("authorization", "").startswith("Bearer "):
+            return self._response(401, FakeStripeError(401, "You did not provide an API key.").body)
+
+        for route_method, pattern, handler in ROUTES:
+            match = pattern.fullmatch(path)
+            if match and route_method == method:
+                break
+        else:
+            error = FakeStripeError(404, "Unrecognized request URL ({}: {}).".format(method, path))
+            return self._response(error.status, error.body)
+
+        idempotency_key = headers.get("idempotency-key") if method == "POST" else None
+        with self._lock:
+            if idempotency_key in self._idempotent_responses:
+                return self._idempotent_responses[idempotency_key]
+
+            try:
+                response = self._response(
+                    200, getattr(self, "_" + handler)(params, **match.groupdict())
+                )
+            except FakeStripeError as e:
+                response = self._response(e.status, e.body)
+
+            if idempotency_key:
+                self._idempotent_responses[idempotency_key] = response
+            return response
+
+    def _injected_error(self, path):
+        for i, (status, prefix) in enumerate(self._failures):
+            if prefix is None or path.startswith(prefix):
+                del self._failures[i]
+                return status
+        if self.error_rate and self._random.random() < self.error_rate:
+            return self._random.choice(self.error_statuses)
+        return None
+
+    def _response(self, status, body):
+        headers = {
+            "Content-Type": "application/json",
+            "Request-Id": self._next_id("req"),
+        }
+        return json.dumps(body).encode("utf-8"), status, headers
+
+    def _get(self, objects, object_id, name):
+        try:
+            return objects[object_id]
+        except KeyError:
+            raise FakeStripeError(
+                404, "No such {}: {}".format(name, object_id), code="resource_missing", param="id"
+            )
+
+    def _list(self, objects, url, params):
+        # Like Stripe, lists are ordered newest first.
+        objects = list(reversed(objects))
+        limit = min(int(params.get("limit", 10)), 100)
+
+        ids = [obj["id"] for obj in objects]
+        if params.get("starting_after"):
+            objects = objects[ids.index(params["starting_after"]) + 1:]
+        elif params.get("ending_before"):
+            objects = objects[:ids.index(params["ending_before"])][-limit:]
+
+        return {
+            "object": "list",
+            "url": url,
+            "has_more": len(objects) > limit,
+            "data": objects[:limit],
+        }
+
+    # Tokens
+
+    def _tokenize(self, card):
+        number = str(card.get("number", ""))
+        if not number.isdigit() or len(number) < 12:
+            raise FakeStripeError(
+                402, "Your card number is incorrect.", code="incorrect_number", param="number"
+            )
+
+        token = {
+            "id": self._next_id("tok"),
+            "object": "token",
+            "card": self._card(card),
+            "client_ip": None,
+            "created": self._created(),
+            "livemode": False,
+            "type": "card",
+            "used": False,
+        }
+        self.tokens[token["id"]] = token
+        return token
+
+    def _card(self, card):
+        number = str(card["number"])
+        return {
+            "id": self._next_id("card"),
+            "object": "card",
+            "address_city": card.get("address_city"),
+            "address_country": card.get("address_country"),
+            "address_line1": card.get("address_line1"),
+            "address_line1_check": "pass" if card.get("address_line1") else None,
+            "address_line2": card.get("address_line2"),
+            "address_state": card.get("address_state"),
+            "address_zip": card.get("address_zip"),
+            "address_zip_check": "pass" if card.get("address_zip") else None,
+            "brand": card_brand(number),
+            "country": "US",
+            "customer": None,
+            "cvc_check": "pass" if card.get("cvc") else None,
+            "dynamic_last4": None,
+            "exp_month": int(card.get("exp_month", 12)),
+            "exp_year": int(card.get("exp_year", 2030)),
+            "fingerprint": hashlib.sha1(number.encode("utf-8")).hexdigest()[:16],
+            "funding": "credit",
+            "last4": number[-4:],
+            "metadata": card.get("metadata", {}),
+            "name": card.get("name"),
+            "tokenization_method": None,
+        }
+
+    def _create_token(self, params):
+        return self._tokenize(params.get("card", {}))
+
+    def _retrieve_token(self, params, id):
+        return self._get(self.tokens, id, "token")
+
+    # Customers
+
+    def _create_customer(self, params):
+        customer = {
+            "id": self._next_id("cus"),
+            "object": "customer",
+            "address": params.get("address"),
+            "balance": int(params.get("balance", 0)),
+            "created": self._created(),
+            "currency": None,
+            "default_source": None,
+            "delinquent": False,
+            "description": params.get("description"),
+            "discount": None,
+            "email": params.get("email"),
+            "invoice_prefix": "FAKE{:04d}".format(len(self.customers) % 10000),
+            "invoice_settings": {
+                "custom_fields": None,
+                "default_payment_method": None,
+                "footer": None,
+            },
+            "livemode": False,
+            "metadata": params.get("metadata", {}),
+            "name": params.get("name"),
+            "phone": params.get("phone"),
+            "preferred_locales": params.get("preferred_locales", []),
+            "shipping": params.get("shipping"),
+            "tax_exempt": params.get("tax_exempt", "none"),
+        }
+        self.customers[customer["id"]] = customer
+        self.sources[customer["id"]] = OrderedDict()
+
+        if params.get("source"):
+            self._attach_source(customer["id"], params["source"])
+        return customer
+
+    def _list_customers(self, params):
+        return self._list(self.customers.values(), "/v1/customers", params)
+
+    def _retrieve_customer(self, params, id):
+        return self._get(self.customers, id, "customer")
+
+    def _update_customer(self, params, id):
+        customer = self._get(self.customers, id, "customer")
+        params = dict(params)
+        if "metadata" in params:
+            customer["metadata"] = dict(customer["metadata"], **params.pop("metadata"))
+        if "source" in params:
+            card = self._attach_source(id, params.pop("source"))
+            customer["default_source"] = card["id"]
+        for name, value in params.items():
+            if name in customer and name not in ("id", "object", "created", "livemode"):
+                customer[name] = value
+        return customer
+
+    def _delete_customer(self, params, id):
+        self._get(self.customers, id, "customer")
+        del self.customers[id]
+        del self.sources[id]
+        return {"id": id, "object": "customer", "deleted": True}
+
+    # Sources
+
+    def _attach_source(self, customer_id, source):
+        customer = self._get(self.customers, customer_id, "customer")
+
+        if isinstance(source, dict):
+            card = self._card(source)
+        else:
+            token = self._get(self.tokens, source, "token")
+            if token["used"]:
+                raise FakeStripeError(
+                    400,
+                    "You cannot use a Stripe token more than once: {}.".format(source),
+                    code="token_already_used",
+                )
+            token["used"] = True
+            card = dict(token["card"])
+
+        card["customer"] = customer_id
+        self.sources[customer_id][card["id"]] = card
+        if customer["default_source"] is None:
+            customer["default_source"] = card["id"]
+        return card
+
+    def _list_sources(self, params, customer):
+        self._get(self.customers, customer, "customer")
+        sources = self.sources[customer].values()
+        if params.get("object"):
+            sources = [card for card in sources if card["object"] == params["object"]]
+        return self._list(sources, "/v1/customers/{}/sources".format(customer), params)
+
+    def _create_source(self, params, customer):
+        if "source" not in params:
+            raise FakeStripeError(400, "Missing required param: source.", param="source")
+        return self._attach_source(customer, params["source"])
+
+    def _retrieve_source(self, params, customer, id):
+        self._get(self.customers, customer, "customer")
+        return self._get(self.sources[customer], id, "source")
+
+    def _delete_source(self, params, customer, id):
+        self._retrieve_source(params, customer, id)
+        del self.sources[customer][id]
+        if self.customers[customer]["default_source"] == id:
+            self.customers[customer]["default_source"] = next(iter(self.sources[customer]), None)
+        return {"id": id, "object": "card", "deleted": True}
+
+    # Accounts
+
+    def _create_account(self, params):
+        account = {
+            "id": self._next_id("acct"),
+            "object": "account",
+            "business_profile": params.get("business_profile", {}),
+            "business_type": params.get("business_type"),
+            "capabilities": params.get("capabilities", {}),
+            "charges_enabled": False,
+            "company": params.get("company"),
+            "country": params.get("country", "US"),
+            "created": self._created(),
+            "default_currency": params.get("default_currency", "usd"),
+            "details_submitted": False,
+            "email": params.get("email"),
+            "individual": params.get("individual"),
+            "livemode": False,
+            "metadata": params.get("metadata", {}),
+            "payouts_enabled": False,
+            "requirements": {
+                "current_deadline": None,
+                "currently_due": [],
+                "disabled_reason": None,
+                "eventually_due": [],
+                "past_due": [],
+                "pending_verification": [],
+            },
+            "settings": params.get("settings", {}),
+            "tos_acceptance": params.get("tos_acceptance", {}),
+            "type": params.get("type", "custom"),
+        }
+        self.accounts[account["id"]] = account
+        return account
+
+    def _list_accounts(self, params):
+        return self._list(self.accounts.values(), "/v1/accounts", params)
+
+    def _retrieve_account(self, params, id):
+        return self._get(self.accounts, id, "account")
+
+
+class FakeStripeHTTPClient(HTTPClient):
+    """
+    A Stripe HTTP client answering every request from a `FakeStripe` directly,
+    without a socket, e.g. to measure the app rather than the network stack.
+    """
+
+    name = "fake"
+
+    def __init__(self, fake=None, **kwargs):
+        super().__init__(**kwargs)
+        self.fake = fake if fake is not None else FakeStripe()
+
+    def request(self, method, url, headers, post_data=None):
+        url = urlsplit(url)
+        params = decode_params(parse_qsl(post_data or url.query, keep_blank_values=True))
+        return self.fake.handle(method, url.path, params, headers)
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so pooled clients are measured as they run against Stripe.
+    protocol_version = "HTTP/1.1"
+
+    def _handle(self):
+        url = urlsplit(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length).decode("utf-8") if length else url.query
+        params = decode_params(parse_qsl(body, keep_blank_values=True))
+
+        content, status, headers = self.server.fake.handle(
+            self.command, url.path, params, self.headers
+        )
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_DELETE = _handle
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeStripeServer:
+    """
+    A localhost HTTP server answering as the Stripe API, from a `FakeStripe`.
+
+    Point the SDK to it with ``stripe.api_base = server.api_base``, or use
+    `fake_stripe`. The server runs in a background thread between `start` and
+    `stop`, or within a ``with`` block.
+
+    :param fake: The state the server answers from. A new one is created with
+        `options` if not given.
+    :type fake: FakeStripe
+    :param host: The interface to listen on.
+    :type host: str
+    :param port: The port to listen on. By default, a free port is picked.
+    :type port: int
+    """
+
+    def __init__(self, fake=None, host="127.0.0.1", port=0, **options):
+        self.fake = fake if fake is not None else FakeStripe(**options)
+        self._server = _ThreadingHTTPServer((host, port), _RequestHandler)
+        self._server.fake = self.fake
+        self._thread = None
+
+    @property
+    def api_base(self):
+        host, port = self._server.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="fake-stripe", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+@contextmanager
+def fake_stripe(in_process=True, fake=None, **options):
+    """
+    Send every Stripe API call made within the block to a fake Stripe.
+
+    With `in_process`, the calls are answered by a `FakeStripeHTTPClient`.
+    Otherwise a `FakeStripeServer` is started and the calls go through the
+    configured HTTP client, e.g. the pooled one, over localhost.
+
+    Usage::
+
+        with fake_stripe(latency=0.05, error_rate=0.01) as fake:
+            customer = fake.add_customer()
+            ...
+
+    :param options: The `FakeStripe` options, if `fake` isn't given.
+    :returns: The `FakeStripe` answering the calls.
+    :rtype: FakeStripe
+    """
+    from .. import settings as stripe_settings
+
+    fake = fake if fake is not None else FakeStripe(**options)
+    stripe = stripe_settings.get_stripe()
+
+    if in_process:
+        with use_http_client(FakeStripeHTTPClient(fake)):
+            yield fake
+        return
+
+    api_base = stripe.api_base
+    with FakeStripeServer(fake) as server:
+        stripe.api_base = server.api_base
+        try:
+            yield fake
+        finally:
+            stripe.api_base = api_base
@@ -0,0 +1,130 @@
+import json
+import threading
+from collections import defaultdict, deque
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from stripe import error
+from stripe.http_client import HTTPClient, new_default_http_client
+
+FORMAT_VERSION = 1
+
+
+def request_key(method, url, post_data=None):
+    """
+    Identify a request by its method, path, query string and body.
+
+    The host is left out, so a recording made against a fake server replays
+    in place of the Stripe API, and the parameters are sorted.
+
+    :rtype: str
+    """
+    url = urlsplit(url)
+    params = sorted(parse_qsl(url.query, keep_blank_values=True))
+    body = sorted(parse_qsl(post_data or "", keep_blank_values=True))
+    key = "{} {}".format(method.upper(), url.path)
+    if params:
+        key += "?" + urlencode(params)
+    if body:
+        key += " " + urlencode(body)
+    return key
+
+
+class RecordingHTTPClient(HTTPClient):
+    """
+    A Stripe HTTP client passing every request to another client and recording
+    the responses, to be saved with `save` and replayed by `ReplayHTTPClient`.
+
+    :param client: The client actually sending the requests. Defaults to the
+        SDK's default client.
+    :type client: stripe.http_client.HTTPClient
+    """
+
+    name = "recording"
+
+    def __init__(self, client=None, **kwargs):
+        super().__init__(**kwargs)
+        self.client = client if client is not None else new_default_http_client()
+        self.interactions = []
+        self._lock = threading.Lock()
+
+    def request(self, method, url, headers, post_data=None):
+        content, status, response_headers = self.client.request(
+            method, url, headers, post_data
+        )
+        with self._lock:
+            self.interactions.append({
+                "request": request_key(method, url, post_data),
+                "status": status,
+                "headers": dict(response_headers),
+                "content": content.decode("utf-8") if isinstance(content, bytes) else content,
+            })
+        return content, status, response_headers
+
+    def save(self, path):
+        """Write the recorded interactions to the JSON file at `path`."""
+        with self._lock:
+            interactions = list(self.interactions)
+        with open(path, "w") as f:
+            json.dump({"version": FORMAT_VERSION, "interactions": interactions}, f, indent=1)
+
+    def close(self):
+        self.client.close()
+
+
+class ReplayHTTPClient(HTTPClient):
+    """
+    A Stripe HTTP client answering requests from a recording, without any
+    network access.
+
+    Requests are matched on `request_key`, and the responses recorded for the
+    same request are replayed in their recorded order.
+
+    :param recording: The path of a file saved by `RecordingHTTPClient`, or its
+        interactions.
+    :type recording: str or list
+    :param loop: If True, once the responses recorded for a request have all
+        been replayed, start over from the first one, e.g. for load tests.
+        Otherwise, the last one is replayed again.
+    :type loop: bool
+    """
+
+    name = "replay"
+
+    def __init__(self, recording, loop=False, **kwargs):
+        super().__init__(**kwargs)
+        if isinstance(recording, str):
+            with open(recording) as f:
+                recording = json.load(f)["interactions"]
+
+        self.loop = loop
+        self._recorded = defaultdict(list)
+        for interaction in recording:
+            self._recorded[interaction["request"]].append(interaction)
+        self._pending = {key: deque(responses) for key, responses in self._recorded.items()}
+        self._lock = threading.Lock()
+
+    def request(self, method, url, headers, post_data=None):
+        key = request_key(method, url, post_data)
+
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is None:
+                raise error.APIConnectionError(
+                    "No recorded response for {}.".format(key), should_retry=False
+                )
+            if len(pending) > 1:
+                interaction = pending.popleft()
+            elif self.loop:
+                interaction = pending.popleft()
+                pending.extend(self._recorded[key])
+            else:
+                interaction = pending[0]
+
+        return (
+            interaction["content"].encode("utf-8"),
+            interaction["status"],
+            interaction["headers"],
+        )
+
+    def close(self):
+        pass
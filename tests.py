@@ -1,3 +1,1081 @@
-from django.test import TestCase
+import contextvars
+import io
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+import warnings
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock, skipIf
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.exceptions import FieldDoesNotExist
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, transaction
+from django.db.models import EmailField, QuerySet
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from . import cache, governor, metrics, settings as stripe_settings
+from .cache import get_payment_methods_version, object_cache
+from .fetch import fetch_many
+from .idempotency import IdempotencyKeyAllocator
+from .identity import identity_map
+from .models import Account, Card, Customer, IdempotencyKey, SyncCursor, WebhookEvent
+from .serializers import CardPaymentMethodFastReadSerializer, CardPaymentMethodReadSerializer
+from .testing import fake_stripe
+from .views import PaymentMethodsViewSet, WebhookView
+from .webhooks import process_pending_events
+
+WEBHOOK_SECRET = "whsec_test"
+
+
+def create_user(index):
+    """Create a user, filling the fields the project's user model requires."""
+    User = get_user_model()
+    values = {}
+    for name in [User.USERNAME_FIELD, *User.REQUIRED_FIELDS, "phone_number"]:
+        try:
+            field = User._meta.get_field(name)
+        except FieldDoesNotExist:
+            continue
+        if isinstance(field, EmailField):
+            values[name] = "stripe-test-{}@example.com".format(index)
+        elif name == "phone_number":
+            values[name] = "+1555{:07d}".format(index)
+        else:
+            values[name] = "stripe-test-{}".format(index)
+    return User.objects.create(**values)
+
+
+class FakeStripeMixin:
+    """Run each test against a new `FakeStripe`, with an empty object cache."""
+
+    factory = APIRequestFactory()
+
+    def setUp(self):
+        stripe = stripe_settings.get_stripe()
+        api_key = mock.patch.object(stripe, "api_key", stripe.api_key or "sk_test_fake")
+        api_key.start()
+        self.addCleanup(api_key.stop)
+
+        fake = fake_stripe()
+        self.fake = fake.__enter__()
+        self.addCleanup(fake.__exit__, None, None, None)
+
+        object_cache.clear()
+        self.addCleanup(object_cache.clear)
+
+    def create_customer(self, user=None, **fields):
+        data = self.fake.add_customer(**fields)
+        return Customer.store_created(Customer._stripe_object_to_record(data), user=user)
+
+    def add_cards(self, customer, numbers):
+        for number in numbers:
+            self.fake.add_card(customer.stripe_id, number=number)
+        Card.sync_from_stripe_data_many(
+            self.fake.sources[customer.stripe_id].values(), customer=customer
+        )
+
+    def call(self, view, method, path, user, data=None, **kwargs):
+        request = getattr(self.factory, method)(path, data)
+        force_authenticate(request, user=user)
+        response = view(request, **kwargs)
+        response.render()
+        return response
+
+
+class FakeStripeTestCase(FakeStripeMixin, TestCase):
+    pass
+
+
+class FakeStripeTransactionTestCase(FakeStripeMixin, TransactionTestCase):
+    """For the tests of what happens once a transaction commits."""
+
+
+class CardAddTests(FakeStripeTestCase):
+    create_view = PaymentMethodsViewSet.as_view({"post": "create"})
+
+    def add_card(self, user, token_id):
+        return self.call(
+            self.create_view, "post", "/payment-methods/", user, {"stripe_id": token_id}
+        )
+
+    def test_first_card_creates_customer_and_account(self):
+        user = create_user(0)
+        token = self.fake.add_token(number="4242424242424242")
+
+        response = self.add_card(user, token["id"])
+
+        self.assertEqual(response.status_code, 201, response.content)
+        customer = Customer.objects.get(user=user)
+        self.assertTrue(Account.objects.filter(user=user).exists())
+        card = Card.objects.get(customer=customer)
+        self.assertEqual(card.fingerprint, token["card"]["fingerprint"])
+        self.assertEqual(len(self.fake.sources[customer.stripe_id]), 1)
+        self.assertTrue(self.fake.tokens[token["id"]]["used"])
+
+    def test_known_card_is_not_added_again(self):
+        user = create_user(0)
+        self.add_card(user, self.fake.add_token(number="4242424242424242")["id"])
+
+        response = self.add_card(user, self.fake.add_token(number="4242424242424242")["id"])
+
+        self.assertEqual(response.status_code, 201, response.content)
+        customer = Customer.objects.get(user=user)
+        self.assertEqual(Card.objects.filter(customer=customer).count(), 1)
+        self.assertEqual(len(self.fake.sources[customer.stripe_id]), 1)
+        self.assertEqual(Customer.objects.count(), 1)
+
+    def test_used_token_creates_nothing(self):
+        token_id = self.fake.add_token()["id"]
+        self.add_card(create_user(0), token_id)
+        user = create_user(1)
+
+        response = self.add_card(user, token_id)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Customer.objects.filter(user=user).exists())
+        self.assertFalse(Account.objects.filter(user=user).exists())
+
+    def test_invalid_token_creates_nothing(self):
+        user = create_user(0)
+
+        response = self.add_card(user, "tok_missing")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Customer.objects.exists())
+        self.assertFalse(Account.objects.exists())
+        self.assertEqual(self.fake.customers, {})
+
+    def test_customer_stored_by_a_webhook_is_given_its_user(self):
+        user = create_user(0)
+        token = self.fake.add_token()
+        customer_data = self.fake.add_customer()
+        Customer.sync_from_stripe_data(customer_data)
+
+        # The customer.created webhook was applied before the request stored
+        # the customer it created.
+        record = Customer._stripe_object_to_record(customer_data, in_place=False)
+        with mock.patch.object(Customer, "create", return_value=record):
+            response = self.add_card(user, token["id"])
+
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(Customer.objects.get(stripe_id=customer_data["id"]).user, user)
+
+
+class PaymentMethodsListTests(FakeStripeTestCase):
+    list_view = PaymentMethodsViewSet.as_view({"get": "list"})
+
+    def test_cards_are_paginated_with_a_cursor(self):
+        user = create_user(0)
+        self.add_cards(self.create_customer(user), ["42424242{:08d}".format(i) for i in range(3)])
+        card_ids = list(Card.objects.order_by("-id").values_list("id", flat=True))
+
+        first = json.loads(
+            self.call(self.list_view, "get", "/payment-methods/?page_size=2", user).content
+        )
+        self.assertEqual(set(first), {"next", "previous", "results"})
+        self.assertIsNone(first["previous"])
+        self.assertIsNotNone(first["next"])
+
+        second = json.loads(self.call(self.list_view, "get", first["next"], user).content)
+        self.assertIsNone(second["next"])
+        self.assertIsNotNone(second["previous"])
+
+        self.assertEqual(
+            [card["id"] for card in first["results"] + second["results"]], card_ids
+        )
+
+
+class ImportTests(FakeStripeTestCase):
+    def import_objects(self, *args):
+        out = io.StringIO()
+        call_command("import_stripe_objects", *args, stdout=out)
+        return out.getvalue()
+
+    def test_imports_every_object_type_by_default(self):
+        for i in range(3):
+            customer = self.fake.add_customer(email="customer{}@example.com".format(i))
+            self.fake.add_card(customer["id"], number="42424242{:08d}".format(i))
+        self.fake.add_account()
+
+        output = self.import_objects("--limit", "2")
+
+        self.assertIn("Imported customers: 3 created", output)
+        self.assertIn("Imported accounts: 1 created", output)
+        self.assertIn("Imported cards: 3 created", output)
+        self.assertEqual(Customer.objects.count(), 3)
+        self.assertEqual(Account.objects.count(), 1)
+        self.assertEqual(Card.objects.count(), 3)
+        self.assertFalse(SyncCursor.objects.exclude(starting_after="").exists())
+
+    def test_imports_the_given_object_types(self):
+        self.fake.add_customer()
+        self.fake.add_account()
+
+        output = self.import_objects("accounts")
+
+        self.assertNotIn("customers", output)
+        self.assertEqual(Customer.objects.count(), 0)
+        self.assertEqual(Account.objects.count(), 1)
+
+    def test_list_calls_are_instrumented(self):
+        customer = self.fake.add_customer()
+        self.fake.add_card(customer["id"])
+        calls = []
+
+        with mock.patch.object(stripe_settings, "METRICS_ENABLED", True), \
+                mock.patch.object(metrics, "_sink", calls.append):
+            self.import_objects("customers", "cards")
+
+        self.assertLessEqual(
+            {("list", "customer"), ("list_sources", "customer")},
+            {(call.operation, call.object_type) for call in calls},
+        )
+
+    def test_unknown_object_type(self):
+        with self.assertRaises(CommandError):
+            self.import_objects("invoices")
+
+
+class WebhookTestMixin:
+    webhook_view = WebhookView.as_view()
+
+    def setUp(self):
+        super().setUp()
+        secret = mock.patch.object(stripe_settings, "WEBHOOK_SECRET", WEBHOOK_SECRET)
+        secret.start()
+        self.addCleanup(secret.stop)
+        self.event_ids = itertools.count(1)
+
+    def event(self, event_type, data, created):
+        return {
+            "id": "evt_{}".format(next(self.event_ids)),
+            "object": "event",
+            "type": event_type,
+            "livemode": False,
+            "created": int(created.timestamp()),
+            "data": {"object": data},
+        }
+
+    def post(self, event, secret=WEBHOOK_SECRET):
+        payload = json.dumps(event)
+        timestamp = int(time.time())
+        signature = stripe_settings.get_stripe().WebhookSignature._compute_signature(
+            "{}.{}".format(timestamp, payload), secret
+        )
+        request = self.factory.post(
+            "/webhooks/",
+            payload,
+            content_type="application/json",
+            HTTP_STRIPE_SIGNATURE="t={},v1={}".format(timestamp, signature),
+        )
+        return self.webhook_view(request)
+
+
+class WebhookTests(WebhookTestMixin, FakeStripeTestCase):
+    def test_event_is_stored_once(self):
+        event = self.event("customer.created", self.fake.add_customer(), timezone.now())
+
+        self.assertEqual(self.post(event).status_code, 200)
+        self.assertEqual(self.post(event).status_code, 200)
+
+        self.assertEqual(WebhookEvent.objects.filter(stripe_id=event["id"]).count(), 1)
+
+    def test_bad_signature_is_refused(self):
+        event = self.event("customer.created", self.fake.add_customer(), timezone.now())
+
+        self.assertEqual(self.post(event, secret="whsec_other").status_code, 400)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+    def test_latest_state_of_each_object_is_applied(self):
+        now = timezone.now().replace(microsecond=0)
+        data = self.fake.add_customer(email="first@example.com")
+        self.post(self.event("customer.created", dict(data), now - timedelta(seconds=2)))
+        self.post(self.event("customer.updated", dict(data, email="second@example.com"), now))
+        self.post(self.event("invoice.created", {"id": "in_1", "object": "invoice"}, now))
+
+        self.assertEqual(process_pending_events(), 3)
+
+        customer = Customer.objects.get(stripe_id=data["id"])
+        self.assertEqual(customer.email, "second@example.com")
+        self.assertEqual(customer.stripe_updated_at, now)
+        self.assertFalse(WebhookEvent.objects.filter(processed__isnull=True).exists())
+        self.assertEqual(process_pending_events(), 0)
+
+    def test_processed_event_invalidates_the_cached_object(self):
+        customer = self.create_customer(email="old@example.com")
+        customer.api_retrieve()
+        self.fake.customers[customer.stripe_id]["email"] = "new@example.com"
+        self.assertEqual(customer.api_retrieve()["email"], "old@example.com")
+
+        data = dict(self.fake.customers[customer.stripe_id])
+        self.post(self.event("customer.updated", data, timezone.now()))
+        process_pending_events()
+
+        self.assertEqual(customer.api_retrieve()["email"], "new@example.com")
+
+    def test_failing_event_does_not_block_the_others(self):
+        now = timezone.now().replace(microsecond=0)
+        good = self.fake.add_customer(email="good@example.com")
+        bad = self.fake.add_customer(email="bad@example.com")
+        self.post(self.event("customer.created", good, now))
+        self.post(self.event("customer.created", bad, now))
+        sync_many = Customer.sync_from_stripe_data_many
+
+        def failing_sync_many(objects, **kwargs):
+            if any(data["id"] == bad["id"] for data in objects):
+                raise ValueError("cannot apply")
+            return sync_many(objects, **kwargs)
+
+        with mock.patch.object(Customer, "sync_from_stripe_data_many",
+                               side_effect=failing_sync_many), \
+                self.assertLogs("{}.webhooks".format(__package__), "ERROR"):
+            self.assertEqual(process_pending_events(), 2)
+
+            self.assertTrue(Customer.objects.filter(stripe_id=good["id"]).exists())
+            self.assertFalse(Customer.objects.filter(stripe_id=bad["id"]).exists())
+            failed = WebhookEvent.objects.get(processed__isnull=True)
+            self.assertEqual(failed.object_data["id"], bad["id"])
+            self.assertEqual((failed.attempts, failed.error), (1, "ValueError: cannot apply"))
+
+            for _attempt in range(1, stripe_settings.WEBHOOK_MAX_ATTEMPTS):
+                self.assertEqual(process_pending_events(), 1)
+            # Left aside once it failed WEBHOOK_MAX_ATTEMPTS times.
+            self.assertEqual(process_pending_events(), 0)
+
+    def test_stale_event_is_not_applied(self):
+        now = timezone.now().replace(microsecond=0)
+        data = self.fake.add_customer(email="current@example.com")
+        Customer.sync_from_stripe_data(data, watermark=now)
+        self.post(self.event("customer.updated", dict(data, email="stale@example.com"),
+                             now - timedelta(seconds=10)))
+
+        process_pending_events()
+
+        self.assertEqual(Customer.objects.get(stripe_id=data["id"]).email, "current@example.com")
+
+
+class PaymentMethodsVersionTests(WebhookTestMixin, FakeStripeTransactionTestCase):
+    list_view = PaymentMethodsViewSet.as_view({"get": "list"})
+
+    def setUp(self):
+        super().setUp()
+        etag = mock.patch.object(stripe_settings, "PAYMENT_METHODS_ETAG", True)
+        etag.start()
+        self.addCleanup(etag.stop)
+
+        self.user = create_user(0)
+        self.customer = self.create_customer(self.user)
+        self.add_cards(self.customer, ["4242424242424242"])
+
+    def list_cards(self, **headers):
+        request = self.factory.get("/payment-methods/", **headers)
+        force_authenticate(request, user=self.user)
+        response = self.list_view(request)
+        if hasattr(response, "render"):
+            response.render()
+        return response
+
+    def test_matching_etag_is_answered_with_304(self):
+        response = self.list_cards()
+        self.assertEqual(response.status_code, 200)
+
+        response = self.list_cards(HTTP_IF_NONE_MATCH=response["ETag"])
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
+    def test_added_card_changes_the_etag(self):
+        etag = self.list_cards()["ETag"]
+
+        self.add_cards(self.customer, ["5555555555554444"])
+        response = self.list_cards(HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(len(json.loads(response.content)["results"]), 2)
+
+    def test_version_is_bumped_once_committed(self):
+        version = get_payment_methods_version(self.user.pk)
+
+        with transaction.atomic():
+            self.add_cards(self.customer, ["5555555555554444"])
+            self.assertEqual(get_payment_methods_version(self.user.pk), version)
+
+        self.assertNotEqual(get_payment_methods_version(self.user.pk), version)
+
+    def test_card_event_bumps_payment_methods_version(self):
+        card = next(iter(self.fake.sources[self.customer.stripe_id].values()))
+        version = get_payment_methods_version(self.user.pk)
+
+        self.post(self.event("customer.source.updated", dict(card, exp_year=2031), timezone.now()))
+        process_pending_events()
+
+        self.assertEqual(Card.objects.get(stripe_id=card["id"]).exp_year, 2031)
+        self.assertNotEqual(get_payment_methods_version(self.user.pk), version)
+
+
+class IdentityMapTests(FakeStripeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user(0)
+
+    def get_customer(self):
+        return Customer.get_for_user(self.user, livemode=False)
+
+    def test_customer_is_loaded_once_per_map(self):
+        customer = self.create_customer(self.user)
+
+        with identity_map(), self.assertNumQueries(1):
+            self.assertEqual(self.get_customer(), customer)
+            self.assertIs(self.get_customer(), self.get_customer())
+
+        with self.assertNumQueries(2):
+            self.get_customer()
+            self.get_customer()
+
+    def test_missing_customer_is_looked_up_once(self):
+        with identity_map(), self.assertNumQueries(1):
+            for _attempt in range(2):
+                with self.assertRaises(Customer.DoesNotExist):
+                    self.get_customer()
+
+    def test_customer_created_after_a_miss_is_resolved(self):
+        with identity_map():
+            with self.assertRaises(Customer.DoesNotExist):
+                self.get_customer()
+            customer = self.create_customer(self.user)
+
+            with self.assertNumQueries(0):
+                self.assertEqual(self.get_customer(), customer)
+
+    def test_deleted_customer_is_looked_up_again(self):
+        customer = self.create_customer(self.user)
+
+        with identity_map():
+            self.get_customer()
+            customer.delete()
+
+            with self.assertRaises(Customer.DoesNotExist):
+                self.get_customer()
+
+
+class BulkGetOrCreateTests(FakeStripeTestCase):
+    def get_or_create(self, users):
+        return Customer.get_or_create_customers_in_stripe(users, livemode=False)
+
+    def test_existing_customers_are_kept_and_missing_ones_created(self):
+        users = [create_user(i) for i in range(3)]
+        existing = self.create_customer(users[1])
+
+        results = self.get_or_create(users)
+
+        self.assertEqual([result.user for result in results], users)
+        self.assertEqual([result.created for result in results], [True, False, True])
+        self.assertEqual(results[1].obj, existing)
+        for result in results:
+            self.assertIsNone(result.error)
+            self.assertEqual(Customer.objects.get(pk=result.obj.pk).user, result.user)
+        self.assertEqual(len(self.fake.customers), 3)
+
+        self.assertEqual([result.created for result in self.get_or_create(users)], [False] * 3)
+        self.assertEqual(len(self.fake.customers), 3)
+
+    def test_failed_creation_is_reported_on_its_user(self):
+        users = [create_user(i) for i in range(2)]
+        create = Customer.create
+
+        def failing_create(user, idempotency_key=None):
+            if user == users[0]:
+                raise ValueError("cannot create")
+            return create(user, idempotency_key=idempotency_key)
+
+        with mock.patch.object(Customer, "create", side_effect=failing_create):
+            results = self.get_or_create(users)
+
+        self.assertIsInstance(results[0].error, ValueError)
+        self.assertIsNone(results[0].obj)
+        self.assertFalse(Customer.objects.filter(user=users[0]).exists())
+        self.assertTrue(results[1].created)
+        self.assertIsNone(results[1].error)
+
+    def test_customer_stored_by_a_webhook_is_given_its_user(self):
+        user = create_user(0)
+        data = self.fake.add_customer()
+        Customer.sync_from_stripe_data(data)
+
+        record = Customer._stripe_object_to_record(data, in_place=False)
+        with mock.patch.object(Customer, "create", return_value=record):
+            [result] = self.get_or_create([user])
+
+        self.assertTrue(result.created)
+        self.assertEqual(result.obj.stripe_id, data["id"])
+        self.assertEqual(Customer.objects.get(stripe_id=data["id"]).user, user)
+
+
+class SyncTests(FakeStripeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.customer = self.create_customer()
+        for i in range(3):
+            self.fake.add_card(self.customer.stripe_id, number="42424242{:08d}".format(i))
+        self.cards = list(self.fake.sources[self.customer.stripe_id].values())
+        self.now = timezone.now().replace(microsecond=0)
+
+    def sync(self, cards, watermark, skip_unchanged=True):
+        return Card.sync_from_stripe_data_many(
+            cards, watermark=watermark, skip_unchanged=skip_unchanged, customer=self.customer
+        )
+
+    def test_unchanged_cards_are_skipped(self):
+        self.assertEqual(self.sync(self.cards, self.now), (3, 0, 0))
+
+        self.assertEqual(self.sync(self.cards, self.now), (0, 0, 3))
+
+    def test_only_changed_cards_are_updated(self):
+        self.sync(self.cards, self.now)
+        cards = [dict(self.cards[0], exp_year=2031)] + self.cards[1:]
+
+        self.assertEqual(self.sync(cards, self.now), (0, 1, 2))
+        self.assertEqual(Card.objects.get(stripe_id=cards[0]["id"]).exp_year, 2031)
+
+    def test_newer_watermark_is_written_and_counted(self):
+        self.sync(self.cards, self.now)
+        later = self.now + timedelta(seconds=10)
+
+        self.assertEqual(self.sync(self.cards, later), (0, 3, 0))
+        self.assertEqual(
+            set(Card.objects.values_list("stripe_updated_at", flat=True)), {later}
+        )
+
+    def test_older_snapshot_is_not_applied(self):
+        self.sync(self.cards, self.now)
+        cards = [dict(card, exp_year=2020) for card in self.cards]
+        earlier = self.now - timedelta(seconds=10)
+
+        for skip_unchanged in (True, False):
+            self.assertEqual(self.sync(cards, earlier, skip_unchanged=skip_unchanged), (0, 0, 3))
+            self.assertEqual(Card.sync_from_stripe_data(cards[0], watermark=earlier), (0, 0, 1))
+        self.assertFalse(Card.objects.filter(exp_year=2020).exists())
+
+    def test_cards_inserted_concurrently_are_updated(self):
+        self.sync(self.cards[:1], self.now)
+        cards = [
+            dict(self.cards[0], exp_year=2031), self.cards[1], dict(self.cards[2], exp_year=2031)
+        ]
+        bulk_update = Card.objects.bulk_update
+
+        def racing_bulk_update(*args, **kwargs):
+            if not Card.objects.filter(stripe_id=self.cards[2]["id"]).exists():
+                # Another writer stores the last card between the lookup and the insert.
+                record = Card._stripe_object_to_record(self.cards[2], in_place=False)
+                Card.objects.create(customer=self.customer, **record)
+            return bulk_update(*args, **kwargs)
+
+        with mock.patch.object(Card.objects, "bulk_update", side_effect=racing_bulk_update):
+            self.assertEqual(self.sync(cards, self.now), (1, 2, 0))
+
+        self.assertEqual(Card.objects.count(), 3)
+        self.assertEqual(Card.objects.filter(exp_year=2031).count(), 2)
+
+    def test_created_record_does_not_overwrite_a_newer_state(self):
+        user = create_user(0)
+        data = self.fake.add_customer(email="created@example.com")
+        Customer.sync_from_stripe_data(dict(data, email="updated@example.com"), watermark=self.now)
+
+        customer = Customer.store_created(
+            Customer._stripe_object_to_record(data, in_place=False),
+            watermark=self.now - timedelta(seconds=10),
+            user=user,
+        )
+
+        self.assertEqual(customer.email, "updated@example.com")
+        self.assertEqual(customer.user, user)
+
+    def test_write_is_retried_over_a_concurrent_insert(self):
+        data = self.fake.add_customer(email="stale@example.com")
+        record = Customer._stripe_object_to_record(data, in_place=False)
+        update = QuerySet.update
+
+        def racing_update(queryset, **values):
+            count = update(queryset, **values)
+            if not Customer.objects.filter(stripe_id=data["id"]).exists():
+                # Another writer stores a newer state between the UPDATE and the insert.
+                Customer.objects.create(
+                    **dict(record, email="newer@example.com", stripe_updated_at=self.now)
+                )
+            return count
+
+        with mock.patch.object(QuerySet, "update", autospec=True, side_effect=racing_update):
+            result = Customer.sync_from_stripe_data(
+                data, watermark=self.now - timedelta(seconds=10)
+            )
+
+        self.assertEqual(result, (0, 0, 1))
+        self.assertEqual(Customer.objects.get(stripe_id=data["id"]).email, "newer@example.com")
+
+    def test_sync_from_stripe_refreshes_the_row(self):
+        self.fake.customers[self.customer.stripe_id]["email"] = "new@example.com"
+
+        self.assertEqual(self.customer.sync_from_stripe(), (0, 1, 0))
+        self.assertEqual(Customer.objects.get(pk=self.customer.pk).email, "new@example.com")
+        self.assertEqual(self.customer.sync_from_stripe(), (0, 0, 1))
+
+
+class IdempotencyKeyAllocatorTests(TestCase):
+    def setUp(self):
+        # Keys are only persisted by the explicit flush() calls of the tests.
+        self.allocator = IdempotencyKeyAllocator(flush_interval=None)
+
+    def get(self, action="create:1"):
+        return self.allocator.get("customer", action, False)
+
+    def stored_keys(self, action="create:1"):
+        return [
+            str(key_uuid) for key_uuid in IdempotencyKey.objects.filter(
+                action="customer:" + action, livemode=False
+            ).values_list("uuid", flat=True)
+        ]
+
+    def test_hit_makes_no_query(self):
+        key = self.get()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get(), key)
+
+    def test_miss_reuses_the_stored_key(self):
+        stored = IdempotencyKey.objects.create(action="customer:create:1", livemode=False)
+
+        self.assertEqual(self.get(), str(stored.uuid))
+        self.assertTrue(self.allocator.flush())
+        self.assertEqual(self.stored_keys(), [str(stored.uuid)])
+
+    def test_new_key_is_persisted_on_flush(self):
+        key = self.get()
+        self.assertEqual(self.stored_keys(), [])
+
+        self.assertTrue(self.allocator.flush())
+
+        self.assertEqual(self.stored_keys(), [key])
+
+    def test_expired_key_is_replaced(self):
+        expired = IdempotencyKey.objects.create(action="customer:create:1", livemode=False)
+        IdempotencyKey.objects.filter(pk=expired.pk).update(
+            created=timezone.now() - timedelta(hours=25)
+        )
+
+        key = self.get()
+        self.allocator.flush()
+
+        self.assertNotEqual(key, str(expired.uuid))
+        self.assertEqual(self.stored_keys(), [key])
+
+    def test_issued_key_expires(self):
+        key = self.get()
+        later = timezone.now() + timedelta(hours=25)
+
+        with mock.patch("django.utils.timezone.now", return_value=later):
+            self.assertNotEqual(self.get(), key)
+
+    def test_key_stored_first_by_another_process_wins(self):
+        self.get()
+        # Another process persisted its own key for the action meanwhile.
+        stored = IdempotencyKey.objects.create(action="customer:create:1", livemode=False)
+
+        self.assertTrue(self.allocator.flush())
+
+        self.assertEqual(self.stored_keys(), [str(stored.uuid)])
+        self.assertEqual(self.get(), str(stored.uuid))
+
+    def test_failed_flush_is_retried(self):
+        key = self.get()
+
+        with mock.patch.object(
+            IdempotencyKey.objects, "bulk_create", side_effect=DatabaseError("unavailable")
+        ), self.assertLogs("{}.idempotency".format(__package__), "ERROR"):
+            self.assertFalse(self.allocator.flush())
+        self.assertEqual(self.stored_keys(), [])
+
+        self.assertTrue(self.allocator.flush())
+        self.assertEqual(self.stored_keys(), [key])
+
+
+class FastCardSerializerTests(FakeStripeTestCase):
+    list_view = PaymentMethodsViewSet.as_view({"get": "list"})
+    retrieve_view = PaymentMethodsViewSet.as_view({"get": "retrieve"})
+
+    def setUp(self):
+        super().setUp()
+        self.user = create_user(0)
+        customer = self.create_customer(self.user)
+        # A Visa, a Mastercard and an American Express card.
+        self.add_cards(customer, ["4242424242424242", "5555555555554444", "378282246310005"])
+        Card.objects.filter(customer=customer).update(address_line1_check="pass")
+
+    def render_both(self, view, path, **kwargs):
+        responses = []
+        for fast in (True, False):
+            with mock.patch.object(stripe_settings, "FAST_CARD_SERIALIZER", fast):
+                responses.append(self.call(view, "get", path, self.user, **kwargs))
+        return responses
+
+    def assertSameContent(self, fast, regular):
+        self.assertEqual(fast.status_code, 200, fast.content)
+        self.assertEqual(regular.status_code, 200, regular.content)
+        self.assertEqual(fast.content, regular.content)
+
+    def test_list(self):
+        queries = ("", "?fields=id,brand,funding,last4", "?fields=brand,unknown", "?page_size=2")
+        for query in queries:
+            with self.subTest(query=query):
+                self.assertSameContent(
+                    *self.render_both(self.list_view, "/payment-methods/" + query)
+                )
+
+    def test_retrieve(self):
+        card = Card.objects.filter(brand="American Express").get()
+        for query in ("", "?fields=brand,exp_year,address_line1_check"):
+            with self.subTest(query=query):
+                self.assertSameContent(*self.render_both(
+                    self.retrieve_view, "/payment-methods/{}/{}".format(card.pk, query), pk=card.pk
+                ))
+
+    def test_render_many(self):
+        cards = Card.objects.order_by("pk")
+        for fields in (None, ["brand", "funding", "customer"]):
+            with self.subTest(fields=fields):
+                renderer = CardPaymentMethodFastReadSerializer(fields)
+                expected = CardPaymentMethodReadSerializer(cards, many=True).data
+                if fields is not None:
+                    expected = [
+                        OrderedDict((name, row[name]) for name in row if name in fields)
+                        for row in expected
+                    ]
+                rows = cards.values(*renderer.value_names)
+                self.assertEqual(
+                    JSONRenderer().render(renderer.render_many(rows)),
+                    JSONRenderer().render(expected),
+                )
+
+
+class FakeClock:
+    """Stands in for the `time` module of the governor; sleeping advances it."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    monotonic = time
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class ObjectCacheTests(SimpleTestCase):
+    stripe_class = SimpleNamespace(OBJECT_NAME="customer")
+
+    def setUp(self):
+        self.clock = FakeClock()
+        clock = mock.patch.object(cache, "time", self.clock)
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def fetch(self, value):
+        return lambda: {"id": "cus_1", "value": value}
+
+    def make_key(self, livemode=None, api_key="sk_test_1", expand_fields=()):
+        return cache.StripeObjectCache.make_key(
+            self.stripe_class, "cus_1", livemode, expand_fields, api_key
+        )
+
+    def test_entries_expire_after_the_ttl(self):
+        object_cache = cache.StripeObjectCache(cache.LRUCacheBackend(), ttl=30)
+        key = self.make_key()
+
+        object_cache.get_or_fetch(key, self.fetch(1))
+        self.clock.now += 29
+        self.assertEqual(object_cache.get_or_fetch(key, self.fetch(2))["value"], 1)
+        self.clock.now += 1
+        self.assertEqual(object_cache.get_or_fetch(key, self.fetch(3))["value"], 3)
+
+        self.assertEqual(object_cache.stats, {"hits": 1, "misses": 2})
+
+    def test_livemodes_and_api_keys_are_cached_apart(self):
+        object_cache = cache.StripeObjectCache(cache.LRUCacheBackend(), ttl=30)
+        keys = [
+            self.make_key(livemode=False),
+            self.make_key(livemode=True, api_key="sk_live_1"),
+            self.make_key(livemode=False, api_key="sk_test_2"),
+        ]
+
+        for value, key in enumerate(keys):
+            object_cache.get_or_fetch(key, self.fetch(value))
+
+        for value, key in enumerate(keys):
+            self.assertEqual(object_cache.get_or_fetch(key, self.fetch(None))["value"], value)
+
+    def test_invalidate_drops_every_livemode(self):
+        object_cache = cache.StripeObjectCache(cache.LRUCacheBackend(), ttl=30)
+        keys = [self.make_key(livemode=livemode) for livemode in (None, False, True)]
+        for key in keys:
+            object_cache.get_or_fetch(key, self.fetch(1))
+
+        object_cache.invalidate(self.stripe_class, "cus_1", api_key="sk_test_1")
+
+        for key in keys:
+            self.assertEqual(object_cache.get_or_fetch(key, self.fetch(2))["value"], 2)
+
+    def test_django_backend_keys_are_valid_for_memcached(self):
+        backend = cache.DjangoCacheBackend(key_prefix="stripe:test:{}:".format(uuid.uuid4().hex))
+        key = self.make_key(livemode=False, expand_fields=["default_source", "sources data"])
+
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            backend.set(key, {"id": "cus_1"}, 30)
+            self.assertEqual(backend.get(key), {"id": "cus_1"})
+
+        self.assertEqual([str(warning.message) for warning in caught], [])
+
+    def test_django_backend_clear_keeps_the_other_entries_of_the_alias(self):
+        backend = cache.DjangoCacheBackend(key_prefix="stripe:test:{}:".format(uuid.uuid4().hex))
+        other_key = "stripe:test:{}".format(uuid.uuid4().hex)
+        caches["default"].set(other_key, "kept")
+        self.addCleanup(caches["default"].delete, other_key)
+        backend.set(self.make_key(), {"id": "cus_1"}, 30)
+
+        backend.clear()
+
+        self.assertIsNone(backend.get(self.make_key()))
+        self.assertEqual(caches["default"].get(other_key), "kept")
+
+
+class RateGovernorTests(SimpleTestCase):
+    limits = {"live": {"read": 10, "write": 10}, "test": {"read": 10, "write": 10}}
+
+    def setUp(self):
+        self.clock = FakeClock()
+        clock = mock.patch.object(governor, "time", self.clock)
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def acquire(self, rate_governor, times=1, **kwargs):
+        for _ in range(times):
+            rate_governor.acquire("sk_test_governor", governor.READ, **kwargs)
+
+    def test_empty_bucket_refills(self):
+        rate_governor = governor.RateGovernor(governor.LocalBucketStore(), self.limits)
+
+        self.acquire(rate_governor, 10)
+        self.assertEqual(self.clock.sleeps, [])
+
+        self.acquire(rate_governor)
+        self.assertEqual(len(self.clock.sleeps), 1)
+        self.assertAlmostEqual(self.clock.sleeps[0], 0.1)
+
+        self.clock.now += 1
+        self.acquire(rate_governor, 10)
+        self.assertEqual(len(self.clock.sleeps), 1)
+
+    def test_background_calls_leave_the_reserve(self):
+        rate_governor = governor.RateGovernor(
+            governor.LocalBucketStore(), self.limits, reserve=0.2
+        )
+
+        with governor.background():
+            self.acquire(rate_governor, 8)
+        self.acquire(rate_governor, 2, lane=governor.INTERACTIVE)
+        self.assertEqual(self.clock.sleeps, [])
+
+        self.acquire(rate_governor, lane=governor.BACKGROUND)
+        self.assertAlmostEqual(self.clock.sleeps[0], 0.3)
+
+    def test_wait_longer_than_max_wait_times_out(self):
+        rate_governor = governor.RateGovernor(
+            governor.LocalBucketStore(), self.limits, max_wait=0.05
+        )
+        rate_governor.penalize("sk_test_governor", governor.READ)
+
+        with self.assertRaises(governor.RateGovernorTimeout):
+            self.acquire(rate_governor)
+        self.assertEqual(self.clock.sleeps, [])
+
+    def test_lane_is_per_context(self):
+        default = governor.get_lane()
+
+        with governor.priority("lane"):
+            self.assertEqual(governor.get_lane(), "lane")
+            self.assertEqual(contextvars.copy_context().run(governor.get_lane), "lane")
+            # A new thread starts from an empty context.
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                self.assertEqual(executor.submit(governor.get_lane).result(), default)
+
+        self.assertEqual(governor.get_lane(), default)
+
+    @skipIf(governor.fcntl is None, "flock is not available")
+    def test_file_buckets_are_shared_between_stores(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "buckets")
+        first, second = governor.FileBucketStore(path), governor.FileBucketStore(path)
+
+        for _ in range(10):
+            self.assertEqual(first.take("bucket", 10, 10, 0), 0)
+        self.assertAlmostEqual(second.take("bucket", 10, 10, 0), 0.1)
+
+        self.clock.now += 1
+        self.assertEqual(second.take("bucket", 10, 10, 0), 0)
+
+    def test_cache_buckets_count_calls_per_window(self):
+        store = governor.CacheBucketStore(key_prefix="stripe:rate:{}:".format(uuid.uuid4().hex))
+
+        for _ in range(8):
+            self.assertEqual(store.take("bucket", 10, 10, 2), 0)
+        # The calls allowed below the floor give their token back.
+        self.assertAlmostEqual(store.take("bucket", 10, 10, 2), 1.0)
+        self.assertEqual(store.take("bucket", 10, 10, 0), 0)
+
+        self.clock.now += 1
+        self.assertEqual(store.take("bucket", 10, 10, 2), 0)
+
+
+class FetchManyTests(SimpleTestCase):
+    def test_results_are_in_input_order_with_errors_per_item(self):
+        def call(item):
+            if item == 2:
+                raise ValueError("no item 2")
+            # The later items finish first.
+            time.sleep(0.01 * (4 - item))
+            return item * 10
+
+        progress = mock.Mock()
+        results = fetch_many(call, range(5), "sk_test_fetch", max_workers=5, progress=progress)
+
+        self.assertEqual([result.item for result in results], [0, 1, 2, 3, 4])
+        self.assertEqual([result.result for result in results], [0, 10, None, 30, 40])
+        self.assertIsInstance(results[2].error, ValueError)
+        self.assertEqual(progress.call_count, 5)
+        self.assertEqual(progress.call_args, mock.call(5, 5))
+
+    def test_rate_limited_calls_are_retried(self):
+        stripe = stripe_settings.get_stripe()
+        attempts = Counter()
+
+        def call(item):
+            attempts[item] += 1
+            if item == "limited" or attempts[item] == 1:
+                raise stripe.error.RateLimitError("Too many requests")
+            return item
+
+        with mock.patch.object(time, "sleep"):
+            results = fetch_many(call, ["once", "limited"], "sk_test_fetch")
+
+        self.assertEqual(results[0].result, "once")
+        self.assertEqual(attempts["once"], 2)
+        self.assertIsInstance(results[1].error, stripe.error.RateLimitError)
+        self.assertEqual(attempts["limited"], stripe_settings.FETCH_MAX_RETRIES + 1)
+
+    def test_request_id_and_lane_are_passed_to_the_workers(self):
+        def call(item):
+            return metrics.get_request_id(), governor.get_lane()
+
+        with metrics.tag_request("req_1"), governor.priority("lane"):
+            results = fetch_many(call, [1, 2], "sk_test_fetch", max_workers=2)
+
+        self.assertEqual([result.result for result in results], [("req_1", "lane")] * 2)
+
+
+class MetricsTests(SimpleTestCase):
+    def call(self, duration, status="ok", error=None, response_bytes=0):
+        return metrics.StripeCall(
+            "retrieve", "customer", duration, status, error, response_bytes, None
+        )
+
+    def test_durations_are_counted_in_cumulative_buckets(self):
+        registry = metrics.MetricsRegistry(buckets=(0.1, 1))
+        for duration in (0.05, 0.1, 0.5, 2):
+            registry.record(self.call(duration))
+
+        # Each bucket counts the calls up to its bound, included.
+        self.assertEqual(registry.histograms[("retrieve", "customer")][:3], [2, 1, 1])
+        self.assertIn(
+            'stripe_api_call_duration_seconds_bucket{operation="retrieve",object_type="customer",'
+            'le="1"} 3',
+            registry.render_prometheus(),
+        )
+
+    def test_render_prometheus(self):
+        registry = metrics.MetricsRegistry(buckets=(0.1, 1))
+        registry.record(self.call(0.05, response_bytes=100))
+        registry.record(self.call(2.0, status="429", error="RateLimitError"))
+        registry.inc("stripe_api_retries_total", ())
+
+        labels = 'operation="retrieve",object_type="customer"'
+        self.assertEqual(registry.render_prometheus().splitlines(), [
+            "# TYPE stripe_api_call_duration_seconds histogram",
+            'stripe_api_call_duration_seconds_bucket{%s,le="0.1"} 1' % labels,
+            'stripe_api_call_duration_seconds_bucket{%s,le="1"} 1' % labels,
+            'stripe_api_call_duration_seconds_bucket{%s,le="+Inf"} 2' % labels,
+            "stripe_api_call_duration_seconds_sum{%s} 2.050000" % labels,
+            "stripe_api_call_duration_seconds_count{%s} 2" % labels,
+            "# TYPE stripe_api_calls_total counter",
+            'stripe_api_calls_total{%s,status="429"} 1' % labels,
+            'stripe_api_calls_total{%s,status="ok"} 1' % labels,
+            "# TYPE stripe_api_errors_total counter",
+            'stripe_api_errors_total{%s,error="RateLimitError"} 1' % labels,
+            "# TYPE stripe_api_response_bytes_total counter",
+            "stripe_api_response_bytes_total{%s} 100" % labels,
+            "# TYPE stripe_api_retries_total counter",
+            "stripe_api_retries_total{} 1",
+        ])
+
+    def test_request_id_is_per_context(self):
+        with metrics.tag_request("req_1"):
+            self.assertEqual(contextvars.copy_context().run(metrics.get_request_id), "req_1")
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                self.assertIsNone(executor.submit(metrics.get_request_id).result())
+
+        self.assertIsNone(metrics.get_request_id())
+
+
+class PackageImportTests(SimpleTestCase):
+    def assertStripeNotLoaded(self, code):
+        code = (
+            "import sys; {}; "
+            "print(sorted(name for name in sys.modules if name.split('.')[0] == 'stripe'))"
+        ).format(code)
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, sys.path)))
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+        )
+
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip(), "[]")
+
+    def test_import_does_not_load_stripe(self):
+        self.assertStripeNotLoaded("import {}".format(__package__))
+
+    def test_urls_import_does_not_load_stripe(self):
+        # The URLconf pulls in the views, serializers and models.
+        self.assertStripeNotLoaded(
+            "import django; django.setup(); import {}.urls".format(__package__)
+        )
@@ -0,0 +1,157 @@
+import os
+import textwrap
+import threading
+from contextlib import contextmanager
+
+import stripe
+from stripe import error
+from stripe.http_client import RequestsClient
+
+from . import settings as stripe_settings
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+class PooledHTTPClient(RequestsClient):
+    """
+    A Stripe HTTP client keeping a pool of keep-alive connections per API key
+    and per process.
+
+    Sessions are created lazily and thrown away in a forked child, so workers
+    never share sockets with their parent. With ``http2``, sessions are HTTP/2
+    ``httpx`` clients when httpx and h2 are installed, and requests sessions
+    otherwise.
+    """
+
+    name = "pooled"
+
+    def __init__(self, timeout=80, connect_timeout=None, pool_size=10, http2=False, **kwargs):
+        super().__init__(timeout=(connect_timeout, timeout) if connect_timeout else timeout, **kwargs)
+        self.pool_size = pool_size
+        self.http2 = http2
+        self._sessions = {}
+        self._sessions_pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def _get_session(self, headers):
+        api_key = headers.get("Authorization", "")
+
+        with self._lock:
+            if self._sessions_pid != os.getpid():
+                self._sessions = {}
+                self._sessions_pid = os.getpid()
+
+            session = self._sessions.get(api_key)
+            if session is None:
+                session = self._sessions[api_key] = self._create_session()
+            return session
+
+    def _create_session(self):
+        if self.http2 and httpx is not None:
+            try:
+                return httpx.Client(
+                    http2=True,
+                    timeout=self._httpx_timeout(),
+                    verify=stripe.ca_bundle_path if self._verify_ssl_certs else False,
+                    limits=httpx.Limits(
+                        max_connections=self.pool_size,
+                        max_keepalive_connections=self.pool_size,
+                    ),
+                )
+            except ImportError:
+                # h2 is not installed
+                pass
+
+        import requests
+
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=self.pool_size
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def _httpx_timeout(self):
+        if isinstance(self._timeout, tuple):
+            connect_timeout, timeout = self._timeout
+            return httpx.Timeout(timeout, connect=connect_timeout)
+        return httpx.Timeout(self._timeout)
+
+    def request(self, method, url, headers, post_data=None):
+        session = self._get_session(headers)
+
+        if httpx is not None and isinstance(session, httpx.Client):
+            return self._request_httpx(session, method, url, headers, post_data)
+
+        # RequestsClient.request() uses the session of the current thread.
+        self._thread_local.session = session
+        return super().request(method, url, headers, post_data)
+
+    def _request_httpx(self, client, method, url, headers, post_data):
+        try:
+            response = client.request(method, url, headers=headers, content=post_data)
+        except (httpx.TimeoutException, httpx.NetworkError) as e:
+            self._raise_connection_error(e, should_retry=True)
+        except httpx.HTTPError as e:
+            self._raise_connection_error(e, should_retry=False)
+        return response.content, response.status_code, response.headers
+
+    def _raise_connection_error(self, e, should_retry):
+        msg = textwrap.fill(
+            "Unexpected error communicating with Stripe.  "
+            "If this problem persists, let us know at support@stripe.com."
+        )
+        msg += "\n\n(Network error: %s: %s)" % (type(e).__name__, e)
+        raise error.APIConnectionError(msg, should_retry=should_retry)
+
+    def close(self):
+        with self._lock:
+            sessions, self._sessions = self._sessions, {}
+        for session in sessions.values():
+            session.close()
+
+
+_http_client = None
+_http_client_lock = threading.Lock()
+
+
+def get_http_client():
+    """Return the process-wide `PooledHTTPClient` configured from the settings."""
+    global _http_client
+
+    with _http_client_lock:
+        if _http_client is None:
+            _http_client = PooledHTTPClient(
+                timeout=stripe_settings.HTTP_TIMEOUT,
+                connect_timeout=stripe_settings.HTTP_CONNECT_TIMEOUT,
+                pool_size=stripe_settings.HTTP_POOL_SIZE,
+                http2=stripe_settings.HTTP2,
+                proxy=stripe.proxy,
+            )
+        return _http_client
+
+
+def install_http_client():
+    """Route all the Stripe API calls through the pooled HTTP client."""
+    stripe.default_http_client = get_http_client()
+
+
+@contextmanager
+def use_http_client(client):
+    """
+    Route the Stripe API calls made within the block through `client`, e.g. a
+    fake or a recording client, and restore the previous client afterwards.
+    """
+    # Install the configured client first, so it can't replace `client` later.
+    stripe_settings.get_stripe()
+
+    previous = stripe.default_http_client
+    stripe.default_http_client = client
+    try:
+        yield client
+    finally:
+        stripe.default_http_client = previous
@@ -1,5 +1,9 @@
+from .metrics import urlpatterns as metrics_urls
 from .payment_methods import urlpatterns as payment_method_urls
+from .webhooks import urlpatterns as webhook_urls
 
 urlpatterns = []
 
 urlpatterns += payment_method_urls
+urlpatterns += webhook_urls
+urlpatterns += metrics_urls
@@ -1,6 +1,10 @@
 import datetime
+import itertools
+import time
+from collections.abc import MutableMapping
 
 from django.conf import settings
+from django.db import connections, router, transaction
 from django.utils import timezone
 from django.utils.encoding import force_text
 
@@ -8,11 +12,102 @@ from rest_framework.exceptions import APIException
 from rest_framework import status
 
 
-def clear_expired_idempotency_keys():
+# Batch size of `clear_expired_idempotency_keys` when only a max runtime is given.
+DEFAULT_CLEANUP_BATCH_SIZE = 1000
+
+
+def clear_expired_idempotency_keys(batch_size=None, max_runtime=None, dry_run=False):
+    """
+    Delete the idempotency keys created more than 24 hours ago.
+
+    With a ``batch_size``, keys are deleted with raw ``DELETE`` statements of at
+    most ``batch_size`` rows each, committed one by one. This skips loading the
+    rows into Python and keeps each statement's locks short.
+
+    :param batch_size: The number of keys deleted per statement, or None to
+        delete all of them through the ORM at once.
+    :type batch_size: int
+    :param max_runtime: Stop starting new batches after this many seconds. The
+        keys are then deleted in batches of `DEFAULT_CLEANUP_BATCH_SIZE` if no
+        ``batch_size`` is given.
+    :type max_runtime: float
+    :param dry_run: If True, only count the expired keys.
+    :type dry_run: bool
+    :returns: The number of keys deleted, or that would be deleted.
+    :rtype: int
+    """
     from .models import IdempotencyKey
 
     threshold = timezone.now() - datetime.timedelta(hours=24)
-    IdempotencyKey.objects.filter(created__lt=threshold).delete()
+    expired = IdempotencyKey.objects.filter(created__lt=threshold)
+
+    if dry_run:
+        return expired.count()
+
+    if not batch_size and max_runtime:
+        # A single ORM delete could not stop in time.
+        batch_size = DEFAULT_CLEANUP_BATCH_SIZE
+    if not batch_size:
+        return expired.delete()[0]
+
+    db = router.db_for_write(IdempotencyKey)
+    connection = connections[db]
+    qn = connection.ops.quote_name
+    meta = IdempotencyKey._meta
+    table = qn(meta.db_table)
+    pk = qn(meta.pk.column)
+    sql = (
+        f"DELETE FROM {table} WHERE {pk} IN "
+        f"(SELECT {pk} FROM {table} WHERE {qn(meta.get_field('created').column)} < %s LIMIT %s)"
+    )
+
+    deadline = time.monotonic() + max_runtime if max_runtime else None
+    deleted = 0
+    while deadline is None or time.monotonic() < deadline:
+        with transaction.atomic(using=db), connection.cursor() as cursor:
+            cursor.execute(sql, [threshold, batch_size])
+            count = cursor.rowcount
+        deleted += count
+        if count < batch_size:
+            break
+
+    return deleted
+
+
+def chunked(iterable, size):
+    """
+    Split an iterable into lists of at most `size` items, consuming it lazily.
+
+    :rtype: generator
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def snapshot_watermark(requested_at=None):
+    """
+    Return the watermark of a snapshot requested from the Stripe API.
+
+    Webhook events are watermarked with their ``created`` time, which comes from
+    Stripe's clock with a 1 second resolution. To be comparable, the local
+    request time is floored to the second and backdated by
+    ``STRIPE_WATERMARK_CLOCK_SKEW`` seconds, so that the clock skew never makes a
+    snapshot look newer than an event that followed it.
+
+    :param requested_at: When the snapshot was requested. Defaults to now.
+    :type requested_at: datetime
+    :rtype: datetime
+    """
+    from . import settings as stripe_settings
+
+    requested_at = requested_at or timezone.now()
+    return requested_at.replace(microsecond=0) - datetime.timedelta(
+        seconds=stripe_settings.WATERMARK_CLOCK_SKEW
+    )
 
 
 def convert_tstamp(response):
@@ -31,6 +126,65 @@ def convert_tstamp(response):
     return datetime.datetime.fromtimestamp(response, tz)
 
 
+class StripeObjectView(MutableMapping):
+    """
+    A lightweight view of a Stripe object which exposes its `id` as `stripe_id`.
+
+    Reads go straight through to the wrapped object; writes and deletes are kept on
+    the view, so the wrapped object is never mutated nor copied.
+    """
+
+    _deleted = object()
+
+    def __init__(self, data, aliases=None):
+        self._data = data
+        self._aliases = aliases or {"stripe_id": "id"}
+        self._hidden = frozenset(self._aliases.values())
+        self._changes = {}
+
+    def __getitem__(self, key):
+        if key in self._changes:
+            value = self._changes[key]
+            if value is self._deleted:
+                raise KeyError(key)
+            return value
+        if key in self._hidden:
+            raise KeyError(key)
+        return self._data[self._aliases.get(key, key)]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        self._changes[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._changes[key] = self._deleted
+
+    def __iter__(self):
+        reverse_aliases = {v: k for k, v in self._aliases.items()}
+        seen = set()
+        for key in self._data:
+            key = reverse_aliases.get(key, key)
+            seen.add(key)
+            if key in self:
+                yield key
+        for key, value in self._changes.items():
+            if key not in seen and value is not self._deleted:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return "StripeObjectView({!r})".format(dict(self))
+
+
 class CustomValidation(APIException):
     status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
     default_detail = 'A server error occurred.'
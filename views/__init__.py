@@ -2,4 +2,6 @@ from rest_framework.routers import DefaultRouter
 
 router = DefaultRouter()
 
-from .payment_methods import PaymentMethodsViewSet
\ No newline at end of file
+from .metrics import metrics_view
+from .payment_methods import PaymentMethodsViewSet
+from .webhooks import WebhookView
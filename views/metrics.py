@@ -0,0 +1,14 @@
+from django.http import Http404, HttpResponse
+
+from .. import settings as stripe_settings
+from ..metrics import registry
+
+
+def metrics_view(request):
+    """Expose the Stripe API call metrics in the Prometheus text format."""
+    if not stripe_settings.METRICS_ENDPOINT:
+        raise Http404
+
+    return HttpResponse(
+        registry.render_prometheus(), content_type="text/plain; version=0.0.4"
+    )
@@ -1,17 +1,84 @@
+import functools
+
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from rest_framework import viewsets
+from rest_framework.response import Response
 
-from ..serializers import CardPaymentMethodReadSerializer, CardPaymentMethodsWriteSerializer
+from .. import settings as stripe_settings
+from ..cache import payment_methods_etag, payment_methods_last_modified
+from ..pagination import PaymentMethodsPagination
+from ..serializers import (
+    CardPaymentMethodFastReadSerializer,
+    CardPaymentMethodReadSerializer,
+    CardPaymentMethodsWriteSerializer,
+)
 from ..models import Card
 
 
+def conditional(view_method):
+    """
+    Serve ETag/Last-Modified from the user's payment methods version, and answer
+    a matching conditional request with a 304 before the view runs.
+    """
+    conditional_method = method_decorator(
+        condition(
+            etag_func=payment_methods_etag,
+            last_modified_func=payment_methods_last_modified,
+        )
+    )(view_method)
+
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        if stripe_settings.PAYMENT_METHODS_ETAG:
+            return conditional_method(self, request, *args, **kwargs)
+        return view_method(self, request, *args, **kwargs)
+
+    return wrapper
+
+
 class PaymentMethodsViewSet(viewsets.ModelViewSet):
     serializer_class = CardPaymentMethodsWriteSerializer
+    pagination_class = PaymentMethodsPagination
 
     def get_queryset(self):
-        return Card.objects.filter(customer=self.request.user.stripe_customer)
+        # Filtering through the customer join avoids loading
+        # request.user.stripe_customer in a query of its own.
+        cards = Card.objects.filter(customer__user=self.request.user)
+
+        if self.action in ['retrieve', 'list']:
+            fields = CardPaymentMethodReadSerializer.get_requested_fields(self.request)
+            if fields:
+                cards = cards.only(*fields)
+        return cards
 
     def get_serializer_class(self):
         if self.action == 'create':
             return CardPaymentMethodsWriteSerializer
         if self.action in ['retrieve', 'list']:
             return CardPaymentMethodReadSerializer
+
+    def get_fast_serializer(self):
+        return CardPaymentMethodFastReadSerializer(
+            CardPaymentMethodReadSerializer.get_requested_fields(self.request)
+        )
+
+    @conditional
+    def list(self, request, *args, **kwargs):
+        if not stripe_settings.FAST_CARD_SERIALIZER:
+            return super().list(request, *args, **kwargs)
+
+        renderer = self.get_fast_serializer()
+        queryset = self.filter_queryset(self.get_queryset()).values(*renderer.value_names)
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(renderer.render_many(page))
+        return Response(renderer.render_many(queryset))
+
+    @conditional
+    def retrieve(self, request, *args, **kwargs):
+        if not stripe_settings.FAST_CARD_SERIALIZER:
+            return super().retrieve(request, *args, **kwargs)
+
+        return Response(self.get_fast_serializer().render_instance(self.get_object()))
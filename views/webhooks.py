@@ -0,0 +1,46 @@
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .. import settings as stripe_settings
+from ..models import WebhookEvent
+from ..utils import convert_tstamp
+
+
+class WebhookView(APIView):
+    """
+    Receive Stripe webhook events.
+
+    The signature is verified and the raw event is stored for
+    `webhooks.process_pending_events`; nothing else happens before the ack, and an
+    event delivered twice is stored once.
+    """
+
+    authentication_classes = ()
+    permission_classes = ()
+
+    def post(self, request):
+        stripe = stripe_settings.get_stripe()
+        try:
+            event = stripe.Webhook.construct_event(
+                request.body,
+                request.META.get("HTTP_STRIPE_SIGNATURE", ""),
+                stripe_settings.WEBHOOK_SECRET,
+                tolerance=stripe_settings.WEBHOOK_TOLERANCE,
+            )
+        except (ValueError, stripe.error.SignatureVerificationError):
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+
+        WebhookEvent.objects.bulk_create(
+            [
+                WebhookEvent(
+                    stripe_id=event["id"],
+                    type=event["type"],
+                    livemode=event["livemode"],
+                    created=convert_tstamp(event["created"]),
+                    data=event.to_dict_recursive(),
+                )
+            ],
+            ignore_conflicts=True,
+        )
+        return Response(status=status.HTTP_200_OK)
@@ -0,0 +1,149 @@
+import logging
+from collections import OrderedDict, defaultdict
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import settings as stripe_settings
+from .governor import background
+
+logger = logging.getLogger(__name__)
+
+# Event types applied by `process_pending_events`, with the model they update.
+EVENT_MODELS = {
+    "account.updated": "Account",
+    "customer.created": "Customer",
+    "customer.updated": "Customer",
+    "customer.source.created": "Card",
+    "customer.source.updated": "Card",
+}
+
+
+def _get_event_model(event):
+    from . import models
+
+    model_name = EVENT_MODELS.get(event.type)
+    if model_name is None:
+        return None
+
+    model = getattr(models, model_name)
+    if not model.is_valid_object(event.object_data):
+        # e.g. a bank account source
+        return None
+    return model
+
+
+@background()
+def process_pending_events(batch_size=500):
+    """
+    Apply a batch of pending webhook events.
+
+    Events are taken oldest first and locked with ``SKIP LOCKED``, so several
+    workers can run side by side. Events about the same object are coalesced:
+    only the latest state of each object is written, with
+    `StripeModel.sync_from_stripe_data_many`, and never over a newer one.
+    Unhandled event types are marked as processed without further work. Any
+    Stripe API call made meanwhile runs in the background lane of the rate
+    governor.
+
+    The objects of each model are written in a savepoint. If that fails, they are
+    written again one at a time: the events of an object that still fails are
+    left pending with their `attempts` counted, and are no longer taken once
+    they reach ``STRIPE_WEBHOOK_MAX_ATTEMPTS``, so that they cannot hold the
+    other events back.
+
+    :param batch_size: The maximum number of events applied.
+    :type batch_size: int
+    :returns: The number of events processed or counted as failed.
+    :rtype: int
+    """
+    from .models import WebhookEvent
+
+    with transaction.atomic():
+        events = list(
+            WebhookEvent.objects.select_for_update(skip_locked=True)
+            .filter(processed__isnull=True, attempts__lt=stripe_settings.WEBHOOK_MAX_ATTEMPTS)
+            .order_by("created", "pk")[:batch_size]
+        )
+        if not events:
+            return 0
+
+        latest = OrderedDict()
+        watermarks = {}
+        event_keys = {}
+        for event in events:
+            model = _get_event_model(event)
+            if model is not None:
+                data = event.object_data
+                latest[(model, data["id"])] = data
+                watermarks[data["id"]] = event.created
+                event_keys[event.pk] = (model, data["id"])
+
+        objects_by_model = defaultdict(list)
+        for (model, _stripe_id), data in latest.items():
+            objects_by_model[model].append(data)
+
+        errors = {}
+        for model, objects in objects_by_model.items():
+            try:
+                with transaction.atomic():
+                    _sync_objects(model, objects, watermarks)
+            except Exception:
+                for data in objects:
+                    try:
+                        with transaction.atomic():
+                            _sync_objects(model, [data], watermarks)
+                    except Exception as e:
+                        logger.exception("Could not apply the events of %s.", data["id"])
+                        errors[(model, data["id"])] = "{}: {}".format(type(e).__name__, e)
+            for data in objects:
+                model.invalidate_cache(
+                    data["id"],
+                    api_key=stripe_settings.get_default_api_key(data.get("livemode")),
+                )
+
+        failed = defaultdict(list)
+        for event in events:
+            key = event_keys.get(event.pk)
+            if key in errors:
+                failed[errors[key]].append(event.pk)
+        for error, pks in failed.items():
+            WebhookEvent.objects.filter(pk__in=pks).update(
+                attempts=F("attempts") + 1, error=error
+            )
+
+        failed_pks = {pk for pks in failed.values() for pk in pks}
+        WebhookEvent.objects.filter(
+            pk__in=[event.pk for event in events if event.pk not in failed_pks]
+        ).update(processed=timezone.now())
+
+    return len(events)
+
+
+def _sync_objects(model, objects, watermarks):
+    if model.__name__ == "Card":
+        _sync_cards(objects, watermarks)
+    else:
+        model.sync_from_stripe_data_many(objects, watermarks=watermarks)
+
+
+def _sync_cards(objects, watermarks):
+    from .models import Card, Customer
+
+    customers = Customer.objects.in_bulk(
+        {data["customer"] for data in objects if data.get("customer")},
+        field_name="stripe_id",
+    )
+
+    cards_by_customer = defaultdict(list)
+    for data in objects:
+        cards_by_customer[customers.get(data.get("customer"))].append(data)
+
+    for customer, cards in cards_by_customer.items():
+        if customer is None:
+            Card.sync_from_stripe_data_many(cards, watermarks=watermarks)
+        else:
+            Card.sync_from_stripe_data_many(
+                cards, watermarks=watermarks, customer=customer
+            )